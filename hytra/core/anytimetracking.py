@@ -0,0 +1,109 @@
+'''
+Tracking with a wall-clock time budget.
+
+The solvers do not report intermediate solutions, so they are run in a separate process that is terminated
+when the time budget runs out. In that case, the best feasible solution found so far is returned instead:
+either a solution of the problem split into time windows (see `hytra.core.splittracking`), which is much faster
+to obtain than the full solution, or a given fallback solution.
+
+Every returned result has a `provenOptimal` entry that tells whether the solver finished in time.
+'''
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import logging
+import time
+import traceback
+import multiprocessing
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+from hytra.core.splittracking import SplitTracking, trackFlowBased
+
+
+def getLogger():
+    ''' logger to be used in this module '''
+    return logging.getLogger(__name__)
+
+def _runSolver(solver, args, resultQueue):
+    ''' run `solver(*args)` in a worker process and put the result or the error message into the `resultQueue` '''
+    try:
+        resultQueue.put((True, solver(*args)))
+    except Exception:
+        resultQueue.put((False, traceback.format_exc()))
+
+def solveWithTimeBudget(solver, args, timeBudget):
+    '''
+    Run `solver(*args)` in a separate process for at most `timeBudget` seconds.
+
+    **returns** the solver's result, or `None` if the time budget ran out
+    '''
+    if timeBudget <= 0:
+        return None
+
+    resultQueue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_runSolver, args=(solver, args, resultQueue))
+    process.start()
+    try:
+        # read the result before joining, otherwise a large result blocks the worker while it is writing to the queue
+        success, result = resultQueue.get(timeout=timeBudget)
+    except queue.Empty:
+        getLogger().warning("Solver did not finish within the time budget of {} secs, terminating it".format(timeBudget))
+        process.terminate()
+        process.join()
+        return None
+    process.join()
+
+    if not success:
+        getLogger().error("Solver failed:\n{}".format(result))
+        raise RuntimeError("Solver failed")
+    return result
+
+def getEmptyResult(model):
+    '''
+    **returns** the result where all detections and links in the `model` are inactive,
+    which is always a feasible solution
+    '''
+    return {'detectionResults': [{'id': d['id'], 'value': 0} for d in model['segmentationHypotheses']],
+            'linkingResults': [{'src': l['src'], 'dest': l['dest'], 'value': 0} for l in model['linkingHypotheses']],
+            'divisionResults': []}
+
+def _trackSplit(model, weights, solver, numSplits, overlap):
+    '''
+    split tracking, as function that can be run by `solveWithTimeBudget`.
+    The windows are solved one after another in the worker process itself, because terminating it
+    would not stop worker processes of its own.
+    '''
+    return SplitTracking(model, weights, solver=solver, useMultiprocessing=False).track(numSplits=numSplits, overlap=overlap)
+
+def trackWithTimeBudget(model, weights, timeBudget, solver=trackFlowBased, numSplits=None, overlap=0, fallbackResult=None):
+    '''
+    Track the `model` with the given `solver`, but return after `timeBudget` seconds at the latest.
+
+    If `numSplits` is given, the problem is first solved in that many time windows and stitched,
+    which yields a good solution quickly. Then the full problem is solved in the remaining time.
+    If the full solution could not be found in time, the split tracking result is returned,
+    if that was not found in time either, the `fallbackResult` or an empty result.
+
+    **returns** the result dictionary with an additional entry `provenOptimal`
+    '''
+    startTime = time.time()
+    bestResult = None
+
+    if numSplits is not None and numSplits > 1:
+        getLogger().info("Finding an initial solution by tracking {} time windows".format(numSplits))
+        bestResult = solveWithTimeBudget(_trackSplit, (model, weights, solver, numSplits, overlap), timeBudget)
+
+    remainingTime = timeBudget - (time.time() - startTime)
+    getLogger().info("Tracking full model with a time budget of {} secs".format(remainingTime))
+    result = solveWithTimeBudget(solver, (model, weights), remainingTime)
+    if result is not None:
+        result['provenOptimal'] = True
+        return result
+
+    if bestResult is None:
+        getLogger().warning("No solution found within the time budget, returning the fallback solution")
+        bestResult = fallbackResult if fallbackResult is not None else getEmptyResult(model)
+    else:
+        getLogger().warning("Full model could not be solved within the time budget, returning the split tracking solution")
+    bestResult['provenOptimal'] = False
+    return bestResult
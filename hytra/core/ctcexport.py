@@ -0,0 +1,196 @@
+'''
+Export tracking results to the format of the [Cell Tracking Challenge](http://celltrackingchallenge.net):
+one 16 bit TIFF per frame where every object is labeled by its track ID, and a text file listing
+`trackId begin end parentTrackId` for every track.
+
+The lineage of the hypotheses graph is collected into flat arrays once (`getLineageArrays`),
+from which the track table (`getTrackTable`) and the relabeling per frame (`getFrameMappings`) are derived.
+`exportLabelImages` then relabels and writes the frames in a pool of worker processes, where only a bounded
+number of frames is in flight at any time.
+'''
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import os
+import logging
+import collections
+import multiprocessing
+import numpy as np
+import vigra
+from skimage.external import tifffile
+from hytra.util.relabeling import relabel
+
+def getLogger():
+    ''' logger to be used in this module '''
+    return logging.getLogger(__name__)
+
+def getLineageArrays(hypothesesGraph):
+    '''
+    Collect the result of `hypothesesGraph.computeLineage()` in a single pass over all nodes.
+
+    **returns** a dictionary of integer arrays with one entry per node: `timestep` and `objectId` of the node,
+    its `trackId`, and the track IDs of its `parent` and `gapParent` if the track starts after a division or
+    after a link that skips frames. Missing IDs are 0, as track IDs start at 1.
+    '''
+    def trackIdOf(node):
+        trackId = hypothesesGraph._graph.node[node]['trackId']
+        return 0 if trackId is None else trackId
+
+    columns = dict((k, []) for k in ['timestep', 'objectId', 'trackId', 'parent', 'gapParent'])
+    for n in hypothesesGraph.nodeIterator():
+        nodeData = hypothesesGraph._graph.node[n]
+        if 'trackId' not in nodeData:
+            raise ValueError("You need to compute the Lineage of every node before accessing the trackId!")
+        columns['timestep'].append(n[0])
+        columns['objectId'].append(n[1])
+        columns['trackId'].append(trackIdOf(n))
+        columns['parent'].append(trackIdOf(nodeData['parent']) if 'parent' in nodeData else 0)
+        columns['gapParent'].append(trackIdOf(nodeData['gap_parent']) if 'gap_parent' in nodeData else 0)
+
+    return dict((k, np.array(v, dtype=np.int64)) for k, v in columns.items())
+
+def getTrackTable(lineage):
+    '''
+    Derive the track table from the `lineage` arrays (see `getLineageArrays`).
+
+    **returns** an array with one row `(trackId, begin, end, parentTrackId)` per track, sorted by track ID,
+    where `parentTrackId` is 0 for tracks that do not start with a division or a link skipping frames.
+    '''
+    hasTrack = lineage['trackId'] > 0
+    if not np.any(hasTrack):
+        return np.zeros((0, 4), dtype=np.int64)
+    trackIds, nodeTracks = np.unique(lineage['trackId'][hasTrack], return_inverse=True)
+    timesteps = lineage['timestep'][hasTrack]
+
+    begin = np.full(len(trackIds), np.iinfo(np.int64).max, dtype=np.int64)
+    end = np.full(len(trackIds), np.iinfo(np.int64).min, dtype=np.int64)
+    np.minimum.at(begin, nodeTracks, timesteps)
+    np.maximum.at(end, nodeTracks, timesteps)
+
+    # only the first node of a track has a parent, a link skipping frames overrides the division parent
+    parent = np.zeros(len(trackIds), dtype=np.int64)
+    np.maximum.at(parent, nodeTracks, lineage['parent'][hasTrack])
+    gapParent = np.zeros(len(trackIds), dtype=np.int64)
+    np.maximum.at(gapParent, nodeTracks, lineage['gapParent'][hasTrack])
+    jumps = (gapParent > 0) & (gapParent != trackIds)
+    for trackId, p, t in zip(trackIds[jumps], gapParent[jumps], begin[jumps]):
+        getLogger().info("Jumping over one time frame in this link: trackid: {}, parent: {}, time: {}".format(trackId, p, t))
+    parent[jumps] = gapParent[jumps]
+
+    return np.column_stack([trackIds, begin, end, parent])
+
+def saveTracks(trackTable, filename):
+    '''
+    Write the `trackTable` (see `getTrackTable`) to `filename` in the text format of the cell tracking challenge
+    '''
+    with open(filename, 'wt') as f:
+        f.write(''.join("{} {} {} {}\n".format(*row) for row in trackTable.tolist()))
+
+def getFrameMappings(lineage):
+    '''
+    **returns** a dictionary from timestep to a dictionary mapping object IDs to track IDs, for all frames
+    that contain nodes. Objects without track are mapped to 0.
+    '''
+    order = np.argsort(lineage['timestep'], kind='mergesort')
+    timesteps, starts = np.unique(lineage['timestep'][order], return_index=True)
+    mappings = {}
+    for timestep, nodes in zip(timesteps.tolist(), np.split(order, starts[1:])):
+        mappings[timestep] = dict(zip(lineage['objectId'][nodes].tolist(), lineage['trackId'][nodes].tolist()))
+    return mappings
+
+def getFrameFilename(outputDir, filenamePrefix, timestep, filenameZeroPadding=3):
+    ''' **returns** the filename of the TIFF file of `timestep`, e.g. `mask003.tif` '''
+    return os.path.join(outputDir, filenamePrefix + format(timestep, "0{}".format(filenameZeroPadding)) + '.tif')
+
+def saveFrameToTiff(labelImage, filename):
+    '''
+    Save a label image with axes `xy` or `xyz` as 16 bit TIFF with the axes expected by the cell tracking challenge
+    '''
+    labelImage = np.swapaxes(labelImage, 0, 1)
+    if len(labelImage.shape) == 2: # 2d
+        vigra.impex.writeImage(labelImage.astype('uint16'), filename)
+    else: # 3D
+        labelImage = np.transpose(labelImage, axes=[2, 0, 1])
+        tifffile.imsave(filename, labelImage.astype('uint16'))
+
+def exportFrame(imageProvider, labelImageFilename, labelImagePath, timeframe, mapping, filename):
+    '''
+    Load the label image of `timeframe`, relabel it with `mapping` (if it is not `None`) and save it to `filename`.
+
+    **returns** the `timeframe`
+    '''
+    labelImage = imageProvider.getLabelImageForFrame(labelImageFilename, labelImagePath, timeframe)
+    if mapping is not None:
+        labelImage = relabel(labelImage, mapping)
+    saveFrameToTiff(labelImage, filename)
+    return timeframe
+
+_workerState = {}
+
+def _initializeWorker(pluginManager, labelImageFilename, labelImagePath):
+    ''' set up the image provider once per worker process, so the plugins are not loaded again for every frame '''
+    _workerState['imageProvider'] = pluginManager.getImageProvider()
+    _workerState['labelImage'] = (labelImageFilename, labelImagePath)
+
+def exportFrameOnCloud(timeframe, mapping, filename):
+    '''
+    Export one frame with the image provider of this worker process, see `exportFrame`.
+    Runs in the worker processes of `exportLabelImages`.
+
+    **returns** the `timeframe`
+    '''
+    labelImageFilename, labelImagePath = _workerState['labelImage']
+    return exportFrame(_workerState['imageProvider'], labelImageFilename, labelImagePath, timeframe, mapping, filename)
+
+def exportLabelImages(mappings,
+                      timeRange,
+                      pluginManager,
+                      labelImageFilename,
+                      labelImagePath,
+                      outputDir,
+                      filenamePrefix='mask',
+                      filenameZeroPadding=3,
+                      numWorkers=None,
+                      useMultiprocessing=True):
+    '''
+    Relabel the label image of every frame in `timeRange` by the `mappings` from `getFrameMappings`,
+    and save it as TIFF in `outputDir`. Frames without mapping are exported unchanged.
+
+    **Parameters:**
+
+    * `pluginManager`: a `TrackingPluginManager` whose image provider loads the label images,
+      it is sent to every worker process once
+    * `numWorkers`: number of worker processes, defaults to the number of CPU cores
+    * `useMultiprocessing`: if `False`, all frames are processed one after another in this process
+
+    At most two frames per worker are submitted at any time, so the memory needed does not grow with
+    the length of the sequence.
+    '''
+    def getFilename(timeframe):
+        return getFrameFilename(outputDir, filenamePrefix, timeframe, filenameZeroPadding)
+
+    if not useMultiprocessing:
+        imageProvider = pluginManager.getImageProvider()
+        for timeframe in range(timeRange[0], timeRange[1]):
+            exportFrame(imageProvider, labelImageFilename, labelImagePath,
+                        timeframe, mappings.get(timeframe, None), getFilename(timeframe))
+        return
+
+    if numWorkers is None:
+        numWorkers = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes=numWorkers,
+                                initializer=_initializeWorker,
+                                initargs=(pluginManager, labelImageFilename, labelImagePath))
+    try:
+        pending = collections.deque()
+        for timeframe in range(timeRange[0], timeRange[1]):
+            if len(pending) >= 2 * numWorkers:
+                pending.popleft().get()
+            pending.append(pool.apply_async(exportFrameOnCloud,
+                                            (timeframe, mappings.get(timeframe, None), getFilename(timeframe))))
+        pool.close()
+        while len(pending) > 0:
+            pending.popleft().get()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
@@ -22,6 +22,14 @@ def angle(v1, v2):
     return (radians*180)/math.pi
 
 
+def roundCoordinates(coordinates):
+    '''
+    round (non-negative) coordinates to the nearest pixel, halves are rounded up like python 2's `round`
+    (`np.round` would round them to the nearest even number)
+    '''
+    return np.floor(np.asarray(coordinates, dtype=np.float64) + 0.5)
+
+
 
 ##### Feature base class #######
 
@@ -173,12 +181,30 @@ class FeatureManager( object ):
         return result
  
 
-    def computeFeatures_at(self, feats_cur, feats_next, img_next, feat_names, label_image_filename=None):
+    def getTemplateRegion(self, feats_cur, image_shape):
+        '''
+        **returns** the tuple `(offset, shape)` of the bounding box of the templates around all objects in `feats_cur`,
+        which is the only part of the next frame's label image that `computeFeatures_at` looks at,
+        or `None` if there are no objects
+        '''
+        coms = np.array(feats_cur[self.com_name_cur])[1:]
+        if len(coms) == 0:
+            return None
+        coms = roundCoordinates(coms.reshape(len(coms), -1)[:, :len(image_shape)])
+        begin = np.maximum(coms - self.template_size/2, 0).min(axis=0).astype(int)
+        end = np.minimum(coms + self.template_size/2, image_shape).max(axis=0).astype(int)
+        if np.any(end <= begin):
+            return None
+        return tuple(begin), tuple(end - begin)
+
+    def computeFeatures_at(self, feats_cur, feats_next, img_next, feat_names, label_image_filename=None, img_next_offset=None):
         '''
         **Parameters:**
     
         * if `label_image_filename` is given, it is used to filter the objects from the feature dictionaries 
           that belong to that label image only (in the JST setting) 
+        * if `img_next` is only a region of the next frame (see `getTemplateRegion`), then `img_next_offset`
+          is the position of this region in the frame
         ''' 
 
 #        n_labels = feats_cur.values()[0].shape[0]
@@ -232,13 +258,14 @@ class FeatureManager( object ):
 
             if feats_next is not None and img_next is not None:
                 # find roi around the center of the current object
-                idx_cur = [round(x) for x in com_cur]
+                idx_cur = roundCoordinates(com_cur)
 
                 roi = []
                 for idx,coord in enumerate(idx_cur):
+                    offset = 0 if img_next_offset is None else img_next_offset[idx]
                     start = max(coord - self.template_size/2, 0)
-                    stop = min(coord + self.template_size/2, img_next.shape[idx])
-                    roi.append(slice(int(start),int(stop)))
+                    stop = min(coord + self.template_size/2, offset + img_next.shape[idx])
+                    roi.append(slice(int(start - offset),int(stop - offset)))
 
                 # find all coms in the neighborhood of com_cur by checking the next frame's labelimage in the roi
                 subimg_next = img_next[roi]
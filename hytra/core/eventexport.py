@@ -0,0 +1,162 @@
+'''
+Export a JSON tracking result as one HDF5 "events" file per frame, containing the label image of the frame
+and the tracking events (moves, splits and mergers) that end in this frame, as used by ilastik and `empryonic`.
+
+The result is indexed once by `getEventsPerTimestep`, which yields a small table of events per frame.
+`exportEvents` then writes the frames in a pool of worker processes, which each set up their plugin manager
+and image provider only once and receive nothing but the events of the frame they are writing.
+'''
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import os
+import logging
+import multiprocessing
+import numpy as np
+import h5py
+import hytra.core.jsongraph
+from hytra.pluginsystem.plugin_manager import TrackingPluginManager
+
+def getLogger():
+    ''' logger to be used in this module '''
+    return logging.getLogger(__name__)
+
+def getEventsPerTimestep(model, result):
+    '''
+    Index all active links, divisions and mergers of the JSON `result` by the frame they end in, in one pass each.
+
+    **returns** a dictionary from every timestep between the first and last frame of the `model` to a dictionary with
+    `moves` (list of `(idAtPreviousFrame, idAtThisFrame)`),
+    `splits` (dictionary `{parentIdAtPreviousFrame: [childId, childId]}`) and
+    `mergers` (dictionary `{idAtThisFrame: numberOfObjects}`)
+    '''
+    traxelIdPerTimestepToUniqueIdMap, uuidToTraxelMap = hytra.core.jsongraph.getMappingsBetweenUUIDsAndTraxels(model)
+    mergers, _, links, divisions = hytra.core.jsongraph.getMergersDetectionsLinksDivisions(result, uuidToTraxelMap)
+
+    # there might be empty frames, we want them as output too
+    timesteps = [int(t) for t in traxelIdPerTimestepToUniqueIdMap.keys()]
+    eventsPerTimestep = dict((t, {'moves': [], 'splits': {}, 'mergers': {}})
+                             for t in range(min(timesteps), max(timesteps) + 1))
+
+    for source, target in links:
+        eventsPerTimestep[target[0]]['moves'].append((source[1], target[1]))
+
+    for time, objectId, count in mergers:
+        eventsPerTimestep[time]['mergers'][objectId] = count
+
+    if divisions is not None:
+        # the children of a division are the targets of the active links of the mother cell into the next frame,
+        # links that skip frames are no division
+        childrenPerParent = dict((division, []) for division in divisions)
+        for source, target in links:
+            if source in childrenPerParent and target[0] == source[0] + 1:
+                childrenPerParent[source].append(target[1])
+        for parent in divisions:
+            if parent[0] + 1 not in eventsPerTimestep:
+                continue
+            children = childrenPerParent[parent]
+            assert len(children) == 2, "Expected two children of {}, but found {}".format(parent, children)
+            eventsPerTimestep[parent[0] + 1]['splits'][parent[1]] = children
+
+    return eventsPerTimestep
+
+_workerState = {}
+
+def _initializeWorker(pluginPaths, verbose, imageProviderName):
+    ''' set up the plugin manager and image provider once per worker process '''
+    pluginManager = TrackingPluginManager(verbose=verbose, pluginPaths=pluginPaths)
+    pluginManager.setImageProvider(imageProviderName)
+    _workerState['imageProvider'] = pluginManager.getImageProvider()
+
+def writeEventsForTimestep(timestep, events, labelImageFilename, labelImagePath, filename):
+    '''
+    Write the label image of `timestep` and its `events` (see `getEventsPerTimestep`) to the HDF5 file `filename`.
+    Runs in the worker processes of `exportEvents`, errors are logged with the failing timestep and raised again,
+    such that the export fails.
+    '''
+    getLogger().debug("-- Writing results to {}".format(filename))
+    try:
+        # convert to ndarray for better indexing
+        dis = np.asarray([])
+        app = np.asarray([])
+        div = np.asarray([[k, v[0], v[1]] for k, v in events['splits'].items()])
+        mov = np.asarray(events['moves'])
+        mer = np.asarray([[k, v] for k, v in events['mergers'].items()])
+        mul = np.asarray([])
+
+        label_img = _workerState['imageProvider'].getLabelImageForFrame(labelImageFilename, labelImagePath, timestep)
+
+        with h5py.File(filename, 'w') as dest_file:
+            # write meta fields and copy segmentation from project
+            seg = dest_file.create_group('segmentation')
+            seg.create_dataset("labels", data=label_img, compression='gzip')
+            meta = dest_file.create_group('objects/meta')
+            ids = np.unique(label_img)
+            ids = ids[ids > 0]
+            valid = np.ones(ids.shape)
+            meta.create_dataset("id", data=ids, dtype=np.uint32)
+            meta.create_dataset("valid", data=valid, dtype=np.uint32)
+
+            tg = dest_file.create_group("tracking")
+
+            # write associations
+            if app is not None and len(app) > 0:
+                ds = tg.create_dataset("Appearances", data=app, dtype=np.int32)
+                ds.attrs["Format"] = "cell label appeared in current file"
+
+            if dis is not None and len(dis) > 0:
+                ds = tg.create_dataset("Disappearances", data=dis, dtype=np.int32)
+                ds.attrs["Format"] = "cell label disappeared in current file"
+
+            if mov is not None and len(mov) > 0:
+                ds = tg.create_dataset("Moves", data=mov, dtype=np.int32)
+                ds.attrs["Format"] = "from (previous file), to (current file)"
+
+            if div is not None and len(div) > 0:
+                ds = tg.create_dataset("Splits", data=div, dtype=np.int32)
+                ds.attrs["Format"] = "ancestor (previous file), descendant (current file), descendant (current file)"
+
+            if mer is not None and len(mer) > 0:
+                ds = tg.create_dataset("Mergers", data=mer, dtype=np.int32)
+                ds.attrs["Format"] = "descendant (current file), number of objects"
+
+            if mul is not None and len(mul) > 0:
+                ds = tg.create_dataset("MultiFrameMoves", data=mul, dtype=np.int32)
+                ds.attrs["Format"] = "from (given by timestep), to (current file), timestep"
+
+        getLogger().debug("-> results successfully written")
+    except Exception as e:
+        getLogger().error("ERROR while writing events of timestep {} to {}: {}".format(timestep, filename, str(e)))
+        raise
+
+def exportEvents(eventsPerTimestep,
+                 labelImageFilename,
+                 labelImagePath,
+                 outputDir,
+                 pluginPaths=['hytra/plugins'],
+                 imageProviderName='LocalImageLoader',
+                 numWorkers=None,
+                 verbose=False):
+    '''
+    Write one events file named `<timestep>.h5` (zero padded to 5 digits) per timestep of `eventsPerTimestep`
+    to `outputDir`, using `numWorkers` processes (defaults to the number of CPU cores).
+    If any timestep cannot be written, the remaining ones are cancelled and its error is raised.
+    '''
+    if not os.path.exists(outputDir):
+        os.makedirs(outputDir)
+
+    pool = multiprocessing.Pool(processes=numWorkers,
+                                initializer=_initializeWorker,
+                                initargs=(pluginPaths, verbose, imageProviderName))
+    try:
+        jobs = []
+        for timestep in sorted(eventsPerTimestep.keys()):
+            filename = os.path.join(outputDir, "{0:05d}.h5".format(timestep))
+            jobs.append(pool.apply_async(writeEventsForTimestep,
+                                         (timestep, eventsPerTimestep[timestep], labelImageFilename, labelImagePath, filename)))
+        pool.close()
+        for job in jobs:
+            job.get()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
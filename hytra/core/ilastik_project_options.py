@@ -24,6 +24,7 @@ class IlastikProjectOptions:
         self.rawImageAxes = None
         self.imageProviderName = 'LocalImageLoader'
         self.featureSerializerName = 'LocalFeatureSerializer'
+        self.featureDirectory = None  # where the NpzFeatureSerializer stores the features of every frame
         self.sizeFilter = None  # set to tuple with min,max pixel count
 
 def extractWeightDictFromIlastikProject(ilpFilename, basePath='/ConservationTracking/Parameters/0000'):
@@ -132,17 +132,6 @@ class IlastikHypothesesGraph(HypothesesGraph):
         featVec = probabilityGenerator.getTransitionFeatureVector(feats[0], feats[1], transitionClassifier.selectedFeatures)
         probs = transitionClassifier.predictProbabilities(featVec)[0]
 
-        # or image borders, so predict probability just by distance
-        upperBound = self.fieldOfView.getUpperBound()
-        lowerBound = self.fieldOfView.getLowerBound()
-
-        coordsMax = feats[0]['Coord<Maximum >']
-        boundMax = np.array(upperBound[1:len(coordsMax)+1])
-        coordsMin = feats[0]['Coord<Minimum >']
-        boundMin = np.array(lowerBound[1:len(coordsMin)+1])
-
-        dist_border = self.fieldOfView.spatial_distance_to_border(traxelA.Timestep, traxelA.X(), traxelA.Y(), traxelA.Z(), False)
-
         # find the objects crossing the image border and return the distance based probability instead
         # REASON: The TC classifier gets confused by the feature values at the image border.
         # experiments on Fluo-N2DH-SIM 01:
@@ -158,11 +147,36 @@ class IlastikHypothesesGraph(HypothesesGraph):
         # pure distance: 0.951674
         # from all links: used distance 13598 times, TC prob 271502 times
 
-        if np.isclose(coordsMax, boundMax).any() or np.isclose(coordsMin, boundMin).any():
+        if self._touchesImageBorder(feats[0]):
             return self.getTransitionFeaturesDist(traxelA, traxelB, self.transitionParameter, self.maxNumObjects + 1)
         else:
             return [probs[0]] + [probs[1]] * (max_state - 1)
 
+    def _touchesImageBorder(self, featureDict):
+        """
+        Check whether the bounding box of an object (given by its feature dict) touches the field of view's border
+        """
+        upperBound = self.fieldOfView.getUpperBound()
+        lowerBound = self.fieldOfView.getLowerBound()
+
+        coordsMax = featureDict['Coord<Maximum >']
+        boundMax = np.array(upperBound[1:len(coordsMax)+1])
+        coordsMin = featureDict['Coord<Minimum >']
+        boundMin = np.array(lowerBound[1:len(coordsMin)+1])
+
+        return np.isclose(coordsMax, boundMax).any() or np.isclose(coordsMin, boundMin).any()
+
+    def isTransitionDistanceBased(self, traxelA):
+        """
+        Whether the transition energies of links leaving `traxelA` are computed from the distance of the objects,
+        and hence depend on the `transitionParameter`. That is the case if there is no transition classifier,
+        or if the object touches the image border (see `getTransitionFeaturesRF`).
+        """
+        if self.transitionClassifier is None:
+            return True
+        featureDict = self.probabilityGenerator.getTraxelFeatureDict(traxelA.Timestep, traxelA.Id)
+        return self._touchesImageBorder(featureDict)
+
 
 
     def getBoundaryCostMultiplier(self, traxel, fov, margin, t0, t1, forAppearance):
@@ -15,12 +15,13 @@ class IlastikMergerResolver(hytra.core.mergerresolver.MergerResolver):
     Specialization of merger resolving to work with the hypotheses graph given by ilastik,
     and to read/write images from/to the input/output slots of the respective operators. 
     '''
-    def __init__(self, hypothesesGraph, pluginPaths=[os.path.abspath('../hytra/plugins')], withFullGraph=False, verbose=False):
-        super(IlastikMergerResolver, self).__init__(pluginPaths, verbose)
+    def __init__(self, hypothesesGraph, pluginPaths=[os.path.abspath('../hytra/plugins')], withFullGraph=False, verbose=False, useMultiprocessing=False):
+        super(IlastikMergerResolver, self).__init__(pluginPaths, verbose, useMultiprocessing)
         trackingGraph = hypothesesGraph.toTrackingGraph(noFeatures=True)
         self.model = trackingGraph.model
         self.result = hypothesesGraph.getSolutionDictionary()
         self.hypothesesGraph = hypothesesGraph
+        self._objectSlicings = None
         
         # Find mergers in the given model and result
         traxelIdPerTimestepToUniqueIdMap, uuidToTraxelMap = hytra.core.jsongraph.getMappingsBetweenUUIDsAndTraxels(self.model)
@@ -43,7 +44,7 @@ class IlastikMergerResolver(hytra.core.mergerresolver.MergerResolver):
             self._createUnresolvedGraph(divisionsPerTimestep, self.mergersPerTimestep, mergerLinks, withFullGraph)
             self._prepareResolvedGraph()
 
-    def run(self, transition_classifier_filename=None, transition_classifier_path=None):
+    def run(self, transition_classifier_filename=None, transition_classifier_path=None, timeBudget=None):
         """
         Run merger resolving from within Ilastik 
         We can't use run() from parent because it has to be done on a per frame basis.
@@ -55,6 +56,9 @@ class IlastikMergerResolver(hytra.core.mergerresolver.MergerResolver):
 
         **Returns** a nested dictionary, indexed first by time, then object Id, containing a list of new segmentIDs per merger
         """
+        # all frames have been fitted by now, so the worker processes are not needed anymore
+        self.close()
+
         traxelIdPerTimestepToUniqueIdMap, uuidToTraxelMap = hytra.core.jsongraph.getMappingsBetweenUUIDsAndTraxels(self.model)
         timesteps = [t for t in traxelIdPerTimestepToUniqueIdMap.keys()]
                 
@@ -73,7 +77,7 @@ class IlastikMergerResolver(hytra.core.mergerresolver.MergerResolver):
         # run min-cost max-flow to find merger assignments
         getLogger().info("Running min-cost max-flow to find resolved merger assignments")
 
-        nodeFlowMap, arcFlowMap = self._minCostMaxFlowMergerResolving(objectFeatures, transitionClassifier)
+        nodeFlowMap, arcFlowMap = self._minCostMaxFlowMergerResolving(objectFeatures, transitionClassifier, timeBudget=timeBudget)
 
         # fuse results into a new solution
         # 1.) replace merger nodes in JSON graph by their replacements -> new JSON graph
@@ -105,6 +109,8 @@ class IlastikMergerResolver(hytra.core.mergerresolver.MergerResolver):
                                          traxelIdPerTimestepToUniqueIdMap,
                                          mergerNodeFilter,
                                          mergerLinkFilter)
+        if not self.mergerResolvingProvenOptimal:
+            self.result['provenOptimal'] = False
 
         # return a dictionary telling about which mergers were resolved into what
         mergerDict = {}
@@ -140,9 +146,35 @@ class IlastikMergerResolver(hytra.core.mergerresolver.MergerResolver):
                     if 'value' in self.hypothesesGraph._graph.node[neighbor] and  self.hypothesesGraph._graph.node[neighbor]['value'] > 1:
                         mergerIsPresent = True
         
-        # Compute coordinate for object ID
+        # Compute coordinate for object ID, only looking at the pixels in its bounding box
         if mergerIsPresent:
-            coordinatesForObjectIds[objectId] = np.transpose(np.vstack(np.where(labelImage == objectId)))
+            objectImage, offset = self._cropToObject(labelImage, timestep, objectId)
+            coordinates = np.transpose(np.vstack(np.where(objectImage == objectId)))
+            if offset is not None:
+                coordinates += offset
+            coordinatesForObjectIds[objectId] = coordinates
+
+    def _cropToObject(self, labelImage, timestep, objectId):
+        '''
+        Restrict the `labelImage` to the bounding box of the object, given by the `Coord<Minimum >` and `Coord<Maximum >`
+        features of its traxel. If those are not available, the bounding boxes of all objects in the frame are computed
+        in one pass and reused for all objects of this `labelImage`.
+
+        **returns** the view of the `labelImage` and its offset
+        '''
+        node = (timestep, objectId)
+        if self.hypothesesGraph.hasNode(node) and 'traxel' in self.hypothesesGraph._graph.node[node]:
+            features = self.hypothesesGraph._graph.node[node]['traxel'].Features
+            if 'Coord<Minimum >' in features and 'Coord<Maximum >' in features:
+                ndims = len(labelImage.shape)
+                minCoords = np.array(features['Coord<Minimum >'][:ndims], dtype=np.int64)
+                maxCoords = np.array(features['Coord<Maximum >'][:ndims], dtype=np.int64)
+                slicing = tuple(slice(lower, upper + 1) for lower, upper in zip(minCoords, maxCoords))
+                return labelImage[slicing], minCoords
+
+        if self._objectSlicings is None or self._objectSlicings[0] != timestep or self._objectSlicings[1] is not labelImage:
+            self._objectSlicings = (timestep, labelImage, hytra.core.mergerresolver.getObjectSlicings(labelImage))
+        return hytra.core.mergerresolver.cropToObject(labelImage, self._objectSlicings[2], objectId)
  
     def fitAndRefineNodesForTimestep(self, coordinatesForObjectIds, maxObjectId, timestep):
         '''
@@ -153,14 +185,18 @@ class IlastikMergerResolver(hytra.core.mergerresolver.MergerResolver):
          
         This function is used by Ilastik to fit and refine nodes per frame instead of
         loading the full volume in _fitAndRefineNodes()
+
+        If `self.useMultiprocessing` is set, the objects of this frame are fitted in batches by worker processes,
+        which are kept alive for all frames until `run` or `close` is called.
+        As the previous frame has already been refined, they still get initialized by the fits of their predecessors.
         '''
  
         # use image provider plugin to load labelimage
         nextObjectId = maxObjectId + 1
  
         t = str(timestep)
-        detections = self.detectionsPerTimestep[t]
- 
+
+        objectsToFit = []
         for idx, coordinates in coordinatesForObjectIds.items():            
             node = (timestep, idx)
             if node not in self.resolvedGraph:
@@ -172,43 +208,18 @@ class IlastikMergerResolver(hytra.core.mergerresolver.MergerResolver):
             
             if idx in self.mergersPerTimestep[t]:
                 count = self.mergersPerTimestep[t][idx]
-                
-                for predecessor, _ in self.unresolvedGraph.in_edges(node):
-                    initializations.extend(self.unresolvedGraph.node[predecessor]['fits'])
-                # TODO: what shall we do if e.g. a 2-merger and a single object merge to 2 + 1,
-                # so there are 3 initializations for the 2-merger, and two initializations for the 1 merger?
-                # What does pgmlink do in that case?
+                initializations = self._getInitializations(node)
                 
             getLogger().debug("Looking at node {} in timestep {} with count {}".format(idx, t, count))         
- 
-            # use merger resolving plugin to fit `count` objects
-            fittedObjects = self.mergerResolverPlugin.resolveMergerForCoords(coordinates, count, initializations)
-            
-            assert(len(fittedObjects) == count)
- 
-            # split up node if count > 1, duplicate incoming and outgoing arcs
-            if count > 1:
-                for idx in range(nextObjectId, nextObjectId + count):
-                    newNode = (timestep, idx)
-                    self.resolvedGraph.add_node(newNode, division=False, count=1, origin=node)
- 
-                    for e in self.unresolvedGraph.out_edges(node):
-                        self.resolvedGraph.add_edge(newNode, e[1])
-                    for e in self.unresolvedGraph.in_edges(node):
-                        if 'newIds' in self.unresolvedGraph.node[e[0]]:
-                            for newId in self.unresolvedGraph.node[e[0]]['newIds']:
-                                self.resolvedGraph.add_edge((e[0][0], newId), newNode)
-                        else:
-                            self.resolvedGraph.add_edge(e[0], newNode)
- 
-                self.resolvedGraph.remove_node(node)
-                self.unresolvedGraph.node[node]['newIds'] = range(nextObjectId, nextObjectId + count)
-                nextObjectId += count
- 
-            # each unresolved node stores its fitted shape(s) to be used
-            # as initialization in the next frame, this way division duplicates
-            # and de-merged nodes in the resolved graph do not need to store a fit as well
-            self.unresolvedGraph.node[node]['fits'] = fittedObjects
+            objectsToFit.append((idx, coordinates, count, initializations))
+
+        # use merger resolving plugin to fit `count` objects, in the worker processes if `self.useMultiprocessing` is set
+        fits = self._fitObjects([coordinates for _, coordinates, _, _ in objectsToFit],
+                                [count for _, _, count, _ in objectsToFit],
+                                [initializations for _, _, _, initializations in objectsToFit])
+
+        for (idx, _, count, _), fittedObjects in zip(objectsToFit, fits):
+            nextObjectId = self._refineNode((timestep, idx), count, fittedObjects, nextObjectId)
 
     def _computeObjectFeatures(self, timesteps):
         '''
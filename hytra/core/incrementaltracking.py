@@ -0,0 +1,223 @@
+'''
+Re-solving a tracking problem after changing its parameters, without rebuilding the hypotheses graph.
+
+Most of the parameters one wants to sweep over (the weights of transitions, detections, divisions and of the
+appearance/disappearance costs) do not change the energies in the model at all, they are only passed to the
+solver. The `transitionParameter` of the distance based transition probabilities does change the energies,
+but only those of links (and tracklet-internal transitions) that are computed from the object distance.
+`IncrementalTracking` keeps the model in memory together with the object distances of these transitions,
+and recomputes only the affected energies in a vectorized fashion.
+'''
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import logging
+import numpy as np
+import hytra.core.jsongraph
+from hytra.core.jsongraph import listify, delistify
+from hytra.core.splittracking import trackFlowBased
+
+
+def getLogger():
+    ''' logger to be used in this module '''
+    return logging.getLogger(__name__)
+
+
+class IncrementalTracking(object):
+    """
+    Track with changing parameters on the same `IlastikHypothesesGraph`.
+
+    Usage:
+
+        incrementalTracking = IncrementalTracking(hypothesesGraph, weights)
+        for transitionParameter in [5.0, 10.0, 20.0]:
+            result = incrementalTracking.resolve(transitionParameter=transitionParameter)
+
+    Every result is cached. As scaling all weights by the same positive factor does not change the solution,
+    such configurations are answered from the cache as well.
+    """
+
+    def __init__(self, hypothesesGraph, weights, solver=trackFlowBased, convexify=False, epsilon=0.000001):
+        '''
+        Set up the model of the given `hypothesesGraph`, inserting its energies if that has not been done yet.
+
+        **Parameters:**
+
+        * `hypothesesGraph`: an `IlastikHypothesesGraph`
+        * `weights`: the initial weights, either as dict `{'weights': [...]}` or as a 5-element list
+          `[transWeight, detWeight, divWeight, appearance_cost, disappearance_cost]`
+        * `solver`: a function that takes a model and weights and returns a result dictionary,
+          see `hytra.core.splittracking` for available solvers
+        * `convexify`: whether to convexify all energies as needed by the flow solver
+        * `epsilon`: the epsilon used for convexification
+        '''
+        self.hypothesesGraph = hypothesesGraph
+        if not all('features' in hypothesesGraph._graph.node[n] for n in hypothesesGraph.nodeIterator()):
+            getLogger().info("Inserting energies into hypotheses graph")
+            hypothesesGraph.insertEnergies()
+
+        self.trackingGraph = hypothesesGraph.toTrackingGraph()
+        self.model = self.trackingGraph.model
+        if isinstance(weights, dict):
+            self.weights = self.trackingGraph.weightsDictToList(weights)
+        else:
+            self.weights = list(weights)
+        self.transitionParameter = hypothesesGraph.transitionParameter
+        self.result = None
+
+        self._solver = solver
+        self._convexify = convexify
+        self._epsilon = epsilon
+        self._numStates = hypothesesGraph.maxNumObjects + 1
+        self._resultCache = {}
+
+        self._extractEnergyColumns()
+        if convexify:
+            self.trackingGraph.convexifyCosts(epsilon)
+
+    def _traxelsOfNode(self, node):
+        ''' list of traxels represented by a node of the hypotheses graph '''
+        if self.hypothesesGraph.withTracklets:
+            return self.hypothesesGraph._graph.node[node]['tracklet']
+        else:
+            return [self.hypothesesGraph._graph.node[node]['traxel']]
+
+    def _extractEnergyColumns(self):
+        '''
+        Find all transitions whose energies depend on the `transitionParameter` and store their
+        object distances (and frame gaps) as arrays. For detections that contain such transitions internally
+        (tracklets), store the part of the energy that does not depend on the `transitionParameter`.
+        '''
+        graph = self.hypothesesGraph
+        nodeByUuid = dict((graph._graph.node[n]['id'], n) for n in graph.nodeIterator())
+
+        def distance(traxelA, traxelB):
+            return np.linalg.norm(np.array([traxelA.X(), traxelA.Y(), traxelA.Z()]) - np.array([traxelB.X(), traxelB.Y(), traxelB.Z()]))
+
+        # links
+        self._linkIndices = []
+        self._linkNodes = []
+        linkDistances = []
+        linkGaps = []
+        for i, link in enumerate(self.model['linkingHypotheses']):
+            src, dest = nodeByUuid[link['src']], nodeByUuid[link['dest']]
+            srcTraxel = self._traxelsOfNode(src)[-1]
+            destTraxel = self._traxelsOfNode(dest)[0]
+            if graph.isTransitionDistanceBased(srcTraxel):
+                self._linkIndices.append(i)
+                self._linkNodes.append((src, dest))
+                linkDistances.append(distance(srcTraxel, destTraxel))
+                linkGaps.append(destTraxel.Timestep - srcTraxel.Timestep)
+        self._linkDistances = np.array(linkDistances, dtype=np.float64)
+        self._linkGaps = np.array(linkGaps)
+
+        # transitions within tracklets
+        self._detectionIndices = []
+        self._detectionNodes = []
+        internalDistances = []
+        internalDetection = []
+        for i, seg in enumerate(self.model['segmentationHypotheses']):
+            node = nodeByUuid[seg['id']]
+            traxels = self._traxelsOfNode(node)
+            distances = [distance(a, b) for a, b in zip(traxels[:-1], traxels[1:]) if graph.isTransitionDistanceBased(a)]
+            if len(distances) > 0:
+                internalDetection.extend([len(self._detectionIndices)] * len(distances))
+                internalDistances.extend(distances)
+                self._detectionIndices.append(i)
+                self._detectionNodes.append(node)
+        self._internalDistances = np.array(internalDistances, dtype=np.float64)
+        self._internalDetection = np.array(internalDetection, dtype=np.int64)
+
+        currentEnergies = np.array([delistify(self.model['segmentationHypotheses'][i]['features']) for i in self._detectionIndices])
+        currentEnergies = currentEnergies.reshape((len(self._detectionIndices), self._numStates))
+        self._constantDetectionEnergies = currentEnergies - self._accumulateInternalTransitionEnergies(self.transitionParameter)
+
+        getLogger().debug("Energies of {} links and {} detections depend on the transition parameter".format(
+            len(self._linkIndices), len(self._detectionIndices)))
+
+    def _transitionEnergies(self, distances, transitionParameter):
+        ''' vectorized version of the negative log of `IlastikHypothesesGraph.getTransitionFeaturesDist` for all `distances` '''
+        prob = np.exp(-distances / transitionParameter)
+        probs = np.column_stack([1.0 - prob] + [prob] * (self._numStates - 1))
+        probs[probs < 0.0000000001] = 0.0000000001
+        return -np.log(probs)
+
+    def _accumulateInternalTransitionEnergies(self, transitionParameter):
+        ''' sum of the transition energies inside each tracklet in `self._detectionIndices` '''
+        accumulated = np.zeros((len(self._detectionIndices), self._numStates))
+        if len(self._internalDistances) > 0:
+            np.add.at(accumulated, self._internalDetection, self._transitionEnergies(self._internalDistances, transitionParameter))
+        return accumulated
+
+    def _setFeatures(self, element, graphAttributes, energies):
+        ''' store `energies` as features of a model element and the corresponding hypotheses graph node or edge '''
+        features = listify(list(energies))
+        if self._convexify:
+            features = hytra.core.jsongraph.convexify(features, self._epsilon)
+        element['features'] = features
+        graphAttributes['features'] = features
+
+    def _updateTransitionEnergies(self, transitionParameter):
+        ''' recompute only the energies that depend on the `transitionParameter` '''
+        if transitionParameter == self.transitionParameter:
+            return
+
+        getLogger().info("Updating energies for transition parameter {}".format(transitionParameter))
+        linkEnergies = self._transitionEnergies(self._linkDistances, transitionParameter)
+        skipLinks = self._linkGaps > 1
+        linkEnergies[skipLinks, 1] += self.hypothesesGraph.skipLinksBias * self._linkGaps[skipLinks]
+        for i, (src, dest), energies in zip(self._linkIndices, self._linkNodes, linkEnergies):
+            self._setFeatures(self.model['linkingHypotheses'][i], self.hypothesesGraph._graph.edge[src][dest], energies)
+
+        detectionEnergies = self._constantDetectionEnergies + self._accumulateInternalTransitionEnergies(transitionParameter)
+        for i, node, energies in zip(self._detectionIndices, self._detectionNodes, detectionEnergies):
+            self._setFeatures(self.model['segmentationHypotheses'][i], self.hypothesesGraph._graph.node[node], energies)
+
+        self.transitionParameter = transitionParameter
+        self.hypothesesGraph.transitionParameter = transitionParameter
+
+    def _getCacheKey(self):
+        ''' the solution does not change if all weights are scaled by the same positive factor '''
+        weights = np.array(self.weights, dtype=np.float64)
+        scale = np.abs(weights).max()
+        if scale > 0:
+            weights /= scale
+        return (self.transitionParameter,) + tuple(np.round(weights, 10))
+
+    def resolve(self,
+                transitionParameter=None,
+                transitionWeight=None,
+                detectionWeight=None,
+                divisionWeight=None,
+                appearanceCost=None,
+                disappearanceCost=None):
+        '''
+        Change the given parameters (all others keep their previous value), update the affected energies,
+        and run tracking again.
+
+        **returns** the result dictionary, which is also stored in `self.result`
+        '''
+        for i, w in enumerate([transitionWeight, detectionWeight, divisionWeight, appearanceCost, disappearanceCost]):
+            if w is not None:
+                self.weights[i] = w
+        if transitionParameter is not None:
+            self._updateTransitionEnergies(transitionParameter)
+
+        key = self._getCacheKey()
+        if key in self._resultCache:
+            getLogger().info("Reusing solution of an equivalent parameter configuration")
+            self.result = self._resultCache[key]
+            return self.result
+
+        weights = self.trackingGraph.weightsListToDict(self.weights)
+        self.result = self._solver(self.model, weights)
+
+        self._resultCache[key] = self.result
+        return self.result
+
+    def sweep(self, parameterConfigurations):
+        '''
+        Run `resolve` for each dictionary of keyword arguments in the list `parameterConfigurations`,
+        in the given order.
+
+        **returns** a list of results
+        '''
+        return [self.resolve(**parameters) for parameters in parameterConfigurations]
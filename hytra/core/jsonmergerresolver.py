@@ -25,8 +25,9 @@ class JsonMergerResolver(hytra.core.mergerresolver.MergerResolver):
                  raw_path,
                  raw_axes,
                  pluginPaths=[os.path.abspath('../hytra/plugins')],
-                 verbose=False):
-        super(JsonMergerResolver, self).__init__(pluginPaths, verbose)
+                 verbose=False,
+                 useMultiprocessing=False):
+        super(JsonMergerResolver, self).__init__(pluginPaths, verbose, useMultiprocessing)
 
         # copy model and result because we will modify it here
         assert(isinstance(jsonTrackingGraph, JsonTrackingGraph))
@@ -46,6 +47,8 @@ class JsonMergerResolver(hytra.core.mergerresolver.MergerResolver):
         self.raw_path = raw_path
         self.raw_axes = raw_axes
         self.pluginManager.setImageProvider('LocalImageLoader')
+        # frames are read in time order, once to compute features and once for the export
+        self.pluginManager.enableImageProviderCache()
         self.imageProvider = self.pluginManager.getImageProvider()
     
 
@@ -54,18 +57,11 @@ class JsonMergerResolver(hytra.core.mergerresolver.MergerResolver):
         Computes object features for all nodes in the resolved graph because they
         are needed for the transition classifier or to compute new distances.
 
+        Processes one frame at a time: all nodes of a frame are kept in the relabeled label image,
+        and their features are computed with a single call to the feature computation plugins.
+
         **returns:** a dictionary of feature-dicts per node
         """
-        rawImages = {}
-        labelImages = {}
-        for t in timesteps:
-            if self.raw_filename is not None:
-                rawImages[str(t)] = self.imageProvider.getImageDataAtTimeFrame(self.raw_filename, self.raw_path, self.raw_axes, int(t))
-            else:
-                rawImages[str(t)] = self.imageProvider.getLabelImageForFrame(self.label_image_filename, self.label_image_path, int(t)).astype(np.float32)
-            labelImages[str(t)] = self.imageProvider.getLabelImageForFrame(self.label_image_filename, self.label_image_path, int(t))
-            self.relabelMergers(labelImages[str(t)], int(t))
-
         getLogger().info("Computing object features")
         objectFeatures = {}
         imageShape = self.imageProvider.getImageShape(self.label_image_filename, self.label_image_path)
@@ -74,34 +70,50 @@ class JsonMergerResolver(hytra.core.mergerresolver.MergerResolver):
         # there is no time axis...
         ndims = len([i for i in imageShape if i != 1])
         getLogger().info("Data has dimensionality {}".format(ndims))
+
+        nodesPerTimestep = {}
         for node in self.resolvedGraph.nodes_iter():
             intT, idx = node
             if str(idx).startswith('div-'):
                 continue
+            nodesPerTimestep.setdefault(intT, []).append(node)
 
-            # mask out this object only and compute features
-            mask = labelImages[str(intT)].copy()
-            mask[mask != idx] = 0
-            mask[mask == idx] = 1
+        for t in timesteps:
+            intT = int(t)
+            if intT not in nodesPerTimestep:
+                continue
+
+            labelImage = self.imageProvider.getLabelImageForFrame(self.label_image_filename, self.label_image_path, intT)
+            self.relabelMergers(labelImage, intT)
+            if self.raw_filename is not None:
+                rawImage = self.imageProvider.getImageDataAtTimeFrame(self.raw_filename, self.raw_path, self.raw_axes, intT)
+            else:
+                rawImage = labelImage.astype(np.float32)
+
+            # keep only the objects of the resolved graph in this frame
+            objectIds = [idx for _, idx in nodesPerTimestep[intT]]
+            labelImage[np.logical_not(np.in1d(labelImage, objectIds).reshape(labelImage.shape))] = 0
 
             # compute features, transform to one dict for frame
             frameFeatureDicts, ignoreNames = self.pluginManager.applyObjectFeatureComputationPlugins(
-                ndims, rawImages[str(intT)], mask, intT, self.raw_filename)
+                ndims, rawImage, labelImage, intT, self.raw_filename)
             frameFeatureItems = []
             for f in frameFeatureDicts:
                 frameFeatureItems = frameFeatureItems + f.items()
             frameFeatures = dict(frameFeatureItems)
 
-            # extract all features for this one object
-            objectFeatureDict = {}
-            for k, v in frameFeatures.iteritems():
-                if k in ignoreNames:
-                    continue
-                elif 'Polygon' in k:
-                    objectFeatureDict[k] = v[1]
-                else:
-                    objectFeatureDict[k] = v[1, ...]
-            objectFeatures[node] = objectFeatureDict
+            # extract all features for each object
+            for node in nodesPerTimestep[intT]:
+                idx = node[1]
+                objectFeatureDict = {}
+                for k, v in frameFeatures.iteritems():
+                    if k in ignoreNames:
+                        continue
+                    elif 'Polygon' in k:
+                        objectFeatureDict[k] = v[idx]
+                    else:
+                        objectFeatureDict[k] = v[idx, ...]
+                objectFeatures[node] = objectFeatureDict
 
         return objectFeatures
     
@@ -112,8 +124,16 @@ class JsonMergerResolver(hytra.core.mergerresolver.MergerResolver):
         return self.imageProvider.getLabelImageForFrame(self.label_image_filename, self.label_image_path, timeframe)
 
     def _exportRefinedSegmentation(self, timesteps):
+        '''
+        Relabel the mergers in all frames and stream them to the output label image file,
+        the image provider can write one frame while the next one is relabeled
+        '''
+        self.imageProvider.releaseResource(self.out_label_image)
         h5py.File(self.out_label_image, 'w').close()
-        for t in timesteps:
-            labelImage = self._readLabelImage(int(t))
-            self.relabelMergers(labelImage, int(t))
-            self.imageProvider.exportLabelImage(labelImage, int(t), self.out_label_image, self.label_image_path)
\ No newline at end of file
+        intTimesteps = sorted(int(t) for t in timesteps)
+        timeRange = (intTimesteps[0], intTimesteps[-1] + 1)
+        with self.imageProvider.openLabelImageExport(self.out_label_image, self.label_image_path, timeRange) as exporter:
+            for t in intTimesteps:
+                labelImage = self._readLabelImage(t)
+                self.relabelMergers(labelImage, t)
+                exporter.write(labelImage, t)
\ No newline at end of file
@@ -0,0 +1,126 @@
+'''
+Export a tracking result as a single label image volume (dataset `exported_data` with axes `txyz`),
+in which every track keeps its label over time.
+
+The relabeled frames are written one at a time, so only the label images of two frames are kept in memory.
+'''
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import os
+import logging
+import numpy as np
+import h5py
+from hytra.util.progressbar import ProgressBar
+from hytra.util.relabeling import relabel
+
+def getLogger():
+    ''' logger to be used in this module '''
+    return logging.getLogger(__name__)
+
+def getUuidToTraxelMap(traxelIdPerTimestepToUniqueIdMap):
+    '''
+    **returns** a dictionary from every UUID of the model to the list of `(timestep, objectId)` tuples it represents,
+    sorted by timestep
+    '''
+    uuidToTraxelMap = {}
+    for t in traxelIdPerTimestepToUniqueIdMap.keys():
+        for i in traxelIdPerTimestepToUniqueIdMap[t].keys():
+            uuid = traxelIdPerTimestepToUniqueIdMap[t][i]
+            uuidToTraxelMap.setdefault(uuid, []).append((int(t), int(i)))
+
+    # sort the list of traxels per UUID by their timesteps
+    for v in uuidToTraxelMap.values():
+        v.sort(key=lambda timestepIdTuple: timestepIdTuple[0])
+
+    return uuidToTraxelMap
+
+def getLabelImageForFrame(labelImageFilename, labelImagePath, timeframe, shape):
+    """
+    Get the label image(volume) of one time frame
+    """
+    with h5py.File(labelImageFilename, 'r') as h5file:
+        labelImage = h5file[labelImagePath % (timeframe, timeframe+1, shape[0], shape[1], shape[2])][0, ..., 0].squeeze().astype(np.uint32)
+        return labelImage
+
+def getShape(labelImageFilename, labelImagePath):
+    """
+    extract the shape from the labelimage
+    """
+    with h5py.File(labelImageFilename, 'r') as h5file:
+        shape = list(h5file['/'.join(labelImagePath.split('/')[:-1])].values())[0].shape[1:4]
+        return shape
+
+def getLinksPerTimestep(model, result):
+    '''
+    **returns** a dictionary from every timestep between the first and last frame of the `model` to the list of
+    active links `(objectIdAtPreviousFrame, objectIdAtThisFrame)` ending there, including the links within tracklets
+    '''
+    traxelIdPerTimestepToUniqueIdMap = model['traxelToUniqueId']
+    uuidToTraxelMap = getUuidToTraxelMap(traxelIdPerTimestepToUniqueIdMap)
+
+    # load links and map indices
+    links = [(uuidToTraxelMap[int(entry['src'])][-1], uuidToTraxelMap[int(entry['dest'])][0])
+             for entry in result['linkingResults'] if entry['value'] > 0]
+
+    # add all internal links of tracklets
+    for v in uuidToTraxelMap.values():
+        prev = None
+        for timestepIdTuple in v:
+            if prev is not None:
+                links.append((prev, timestepIdTuple))
+            prev = timestepIdTuple
+
+    # there might be empty frames, we want them as output too
+    timesteps = [int(t) for t in traxelIdPerTimestepToUniqueIdMap.keys()]
+    linksPerTimestep = dict((t, []) for t in range(min(timesteps), max(timesteps) + 1))
+    for a, b in links:
+        linksPerTimestep[b[0]].append((a[1], b[1]))
+    return linksPerTimestep
+
+def exportLabelImage(model, result, labelImageFilename, labelImagePath, outFilename):
+    '''
+    Relabel the segmentation given by `labelImageFilename` and `labelImagePath` such that every track of the
+    `result` gets its own label, and write it to the dataset `exported_data` in `outFilename`.
+    Objects that are not part of a track are set to 0.
+    '''
+    shape = getShape(labelImageFilename, labelImagePath)
+    linksPerTimestep = getLinksPerTimestep(model, result)
+    numTimesteps = len(linksPerTimestep)
+    assert(len(linksPerTimestep[0]) == 0)
+
+    # create output dataset, the relabeled frames are written one at a time
+    if os.path.exists(outFilename):
+        os.remove(outFilename)
+    with h5py.File(outFilename, 'w') as outFile:
+        resultVolume = outFile.create_dataset('exported_data', shape=(numTimesteps,) + tuple(shape), dtype='uint32',
+                                              chunks=True, compression='gzip')
+        getLogger().info("resulting volume shape: {}".format(resultVolume.shape))
+        progressBar = ProgressBar(stop=numTimesteps)
+        progressBar.show(0)
+
+        # iterate over timesteps and label tracks from front to back in a distinct color
+        nextUnusedColor = 1
+        lastFrameColorMap = {}
+        lastFrameLabelImage = getLabelImageForFrame(labelImageFilename, labelImagePath, 0, shape)
+        for t in range(1, numTimesteps):
+            progressBar.show()
+            thisFrameColorMap = {}
+            thisFrameLabelImage = getLabelImageForFrame(labelImageFilename, labelImagePath, t, shape)
+            for a, b in linksPerTimestep[t]:
+                # propagate color if possible, otherwise assign a new one
+                if a in lastFrameColorMap:
+                    thisFrameColorMap[b] = lastFrameColorMap[a]
+                else:
+                    thisFrameColorMap[b] = nextUnusedColor
+                    lastFrameColorMap[a] = thisFrameColorMap[b]  # also store in last frame's color map as it must have been present to participate in a link
+                    nextUnusedColor += 1
+
+            # write relabeled image, objects that have not been assigned a color in the last frame are set to 0
+            resultVolume[t-1] = relabel(lastFrameLabelImage, lastFrameColorMap).reshape(shape)
+
+            # swap the color maps so that in the next frame we use "this" as "last"
+            lastFrameColorMap, thisFrameColorMap = thisFrameColorMap, lastFrameColorMap
+            lastFrameLabelImage = thisFrameLabelImage
+
+        # write last frame relabeled image
+        resultVolume[numTimesteps - 1] = relabel(lastFrameLabelImage, lastFrameColorMap).reshape(shape)
+        progressBar.show()
@@ -2,18 +2,75 @@ from __future__ import print_function, absolute_import, nested_scopes, generator
 import logging
 import itertools
 import os
+import multiprocessing
+import concurrent.futures
 import numpy as np
 import networkx as nx
+from scipy import ndimage
 from hytra.pluginsystem.plugin_manager import TrackingPluginManager
+from hytra.pluginsystem.transition_feature_vector_construction_plugin import stackObjectFeatures
 import hytra.core.probabilitygenerator as probabilitygenerator
 import hytra.core.jsongraph
 from hytra.core.jsongraph import negLog, listify, JsonTrackingGraph
+from hytra.core.anytimetracking import solveWithTimeBudget
 
 
 def getLogger():
     ''' logger to be used in this module '''
     return logging.getLogger(__name__)
 
+def getObjectSlicings(labelImage):
+    '''
+    Find the bounding boxes of all objects in the `labelImage` in a single pass over the image.
+
+    **returns** a dictionary with a tuple of slices per object id
+    '''
+    return dict((idx + 1, slicing) for idx, slicing in enumerate(ndimage.find_objects(labelImage)) if slicing is not None)
+
+def cropToObject(labelImage, objectSlicings, objectId):
+    '''
+    **returns** a view of the `labelImage` restricted to the bounding box of the object (or the full image if the
+    object is not in `objectSlicings`), and the offset of that view in the image
+    '''
+    if objectId not in objectSlicings:
+        return labelImage, None
+    slicing = objectSlicings[objectId]
+    return labelImage[slicing], np.array([s.start for s in slicing])
+
+def getObjectCoordinates(labelImage, objectSlicings, objectId):
+    '''
+    **returns** the coordinates of all pixels of the object in the `labelImage` as array with one row per pixel,
+    only looking at the pixels in its bounding box
+    '''
+    objectImage, offset = cropToObject(labelImage, objectSlicings, objectId)
+    coordinates = np.transpose(np.vstack(np.where(objectImage == objectId)))
+    if offset is not None:
+        coordinates += offset
+    return coordinates
+
+# plugin managers of a worker process, such that the plugins are only loaded once per process
+_workerPluginManagers = {}
+
+def _getWorkerPluginManager(pluginPaths, imageProviderName, mergerResolverName):
+    key = (tuple(pluginPaths), imageProviderName, mergerResolverName)
+    if key not in _workerPluginManagers:
+        pluginManager = TrackingPluginManager(pluginPaths=pluginPaths, verbose=False)
+        pluginManager.setImageProvider(imageProviderName)
+        pluginManager.setMergerResolver(mergerResolverName)
+        _workerPluginManagers[key] = pluginManager
+    return _workerPluginManagers[key]
+
+def fitCoordinatesOnCloud(coordinatesList, counts, initializationsList, pluginPaths, mergerResolverName):
+    '''
+    Fit `counts[i]` objects to the pixel coordinates `coordinatesList[i]` of every object in a batch.
+    Meant to be run in a worker process, which sets up its plugin manager only once for all batches.
+
+    **returns** the list of fitted objects per entry of `coordinatesList`
+    '''
+    pluginManager = _getWorkerPluginManager(pluginPaths, 'LocalImageLoader', mergerResolverName)
+    fittedObjects = pluginManager.getMergerResolver().resolveMergersForCoords(coordinatesList, counts, initializationsList)
+    return [list(f) for f in fittedObjects]
+
 
 class MergerResolver(object):
     """
@@ -21,11 +78,19 @@ class MergerResolver(object):
     that handle reading/writing data to the respective sources.
     """
 
-    def __init__(self, pluginPaths=[os.path.abspath('../hytra/plugins')], verbose=False):
+    def __init__(self, pluginPaths=[os.path.abspath('../hytra/plugins')], verbose=False, useMultiprocessing=False):
+        '''
+        If `useMultiprocessing` is `True`, the mergers of each frame are fitted in parallel processes,
+        which are kept alive until `close` is called.
+        '''
         self.unresolvedGraph = None
         self.resolvedGraph = None
         self.mergersPerTimestep = None
         self.detectionsPerTimestep = None
+        self.pluginPaths = pluginPaths
+        self.useMultiprocessing = useMultiprocessing
+        self._numWorkers = multiprocessing.cpu_count()
+        self._executor = None
         self.pluginManager = TrackingPluginManager(
             verbose=verbose, pluginPaths=pluginPaths)
         self.mergerResolverPlugin = self.pluginManager.getMergerResolver()
@@ -34,6 +99,13 @@ class MergerResolver(object):
         self.model = None
         self.result = None
 
+    def setMergerResolverPlugin(self, mergerResolverName):
+        '''
+        Choose the merger resolver plugin by name, e.g. `GMMMergerResolver` (default) or `EMMergerResolver`
+        '''
+        self.pluginManager.setMergerResolver(mergerResolverName)
+        self.mergerResolverPlugin = self.pluginManager.getMergerResolver()
+
     def _createUnresolvedGraph(self, divisionsPerTimestep, mergersPerTimestep, mergerLinks, withFullGraph=False):
         """
         Set up a networkx graph consisting of mergers that need to be resolved (not resolved yet!)
@@ -115,6 +187,105 @@ class MergerResolver(object):
         '''
         raise NotImplementedError()
 
+    def _getObjectsToFit(self, detectionsPerTimestep, mergersPerTimestep, t):
+        '''
+        **returns** a list of `(objectId, count)` of all objects in timestep `t` that are part of the resolved graph
+        '''
+        objectsToFit = []
+        for idx in detectionsPerTimestep[t]:
+            if (int(t), idx) not in self.resolvedGraph:
+                continue
+            count = 1
+            if idx in mergersPerTimestep[t]:
+                count = mergersPerTimestep[t][idx]
+            objectsToFit.append((idx, count))
+        return objectsToFit
+
+    def _refineNode(self, node, count, fittedObjects, nextObjectId):
+        '''
+        Store the `fittedObjects` at the `node` in the `unresolvedGraph`, and if `count > 1`, replace the node in
+        the `resolvedGraph` by `count` new nodes with IDs starting at `nextObjectId`.
+        Links to merger nodes are duplicated to all new nodes.
+
+        **returns** the next free object ID
+        '''
+        assert(len(fittedObjects) == count)
+        intT = node[0]
+
+        # split up node if count > 1, duplicate incoming and outgoing arcs
+        if count > 1:
+            for idx in range(nextObjectId, nextObjectId + count):
+                newNode = (intT, idx)
+                self.resolvedGraph.add_node(newNode, division=False, count=1, origin=node)
+
+                for e in self.unresolvedGraph.out_edges(node):
+                    self.resolvedGraph.add_edge(newNode, e[1])
+                for e in self.unresolvedGraph.in_edges(node):
+                    if 'newIds' in self.unresolvedGraph.node[e[0]]:
+                        for newId in self.unresolvedGraph.node[e[0]]['newIds']:
+                            self.resolvedGraph.add_edge((e[0][0], newId), newNode)
+                    else:
+                        self.resolvedGraph.add_edge(e[0], newNode)
+
+            self.resolvedGraph.remove_node(node)
+            self.unresolvedGraph.node[node]['newIds'] = range(nextObjectId, nextObjectId + count)
+            nextObjectId += count
+
+        # each unresolved node stores its fitted shape(s) to be used
+        # as initialization in the next frame, this way division duplicates
+        # and de-merged nodes in the resolved graph do not need to store a fit as well
+        self.unresolvedGraph.node[node]['fits'] = fittedObjects
+        return nextObjectId
+
+    def _getInitializations(self, node):
+        ''' collect the fits of all incoming nodes as initializations '''
+        initializations = []
+        for predecessor, _ in self.unresolvedGraph.in_edges(node):
+            initializations.extend(self.unresolvedGraph.node[predecessor]['fits'])
+        # TODO: what shall we do if e.g. a 2-merger and a single object merge to 2 + 1,
+        # so there are 3 initializations for the 2-merger, and two initializations for the 1 merger?
+        # What does pgmlink do in that case?
+        return initializations
+
+    def _getExecutor(self):
+        ''' the pool of worker processes used to fit mergers, created on first use '''
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self._numWorkers)
+        return self._executor
+
+    def close(self):
+        ''' shut down the worker processes used to fit mergers, if any '''
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _fitObjects(self, coordinatesList, counts, initializationsList):
+        '''
+        Fit `counts[i]` objects to the pixel coordinates `coordinatesList[i]`, initialized by `initializationsList[i]`.
+
+        If `self.useMultiprocessing` is set, the objects are distributed to one batch per worker process.
+
+        **returns** the list of fitted objects per entry of `coordinatesList`
+        '''
+        numObjects = len(coordinatesList)
+        if not self.useMultiprocessing or numObjects < 2:
+            return self.mergerResolverPlugin.resolveMergersForCoords(coordinatesList, counts, initializationsList)
+
+        # every worker gets one batch, objects are distributed round robin to balance the batch sizes
+        numBatches = min(self._numWorkers, numObjects)
+        executor = self._getExecutor()
+        jobs = [executor.submit(fitCoordinatesOnCloud,
+                                coordinatesList[b::numBatches],
+                                counts[b::numBatches],
+                                initializationsList[b::numBatches],
+                                self.pluginPaths,
+                                self.pluginManager.chosen_merger_resolver)
+                for b in range(numBatches)]
+        fittedObjects = [None] * numObjects
+        for b, job in enumerate(jobs):
+            fittedObjects[b::numBatches] = job.result()
+        return fittedObjects
+
     def _fitAndRefineNodes(self,
                             detectionsPerTimestep,
                             mergersPerTimestep,
@@ -124,72 +295,83 @@ class MergerResolver(object):
         and create new nodes in `resolvedGraph`. Links to merger nodes are duplicated to all new nodes.
 
         Uses the mergerResolver plugin to update the segmentations in the labelImages.
+
+        The frames are processed in temporal order, such that mergers get initialized by the fits of their
+        predecessors. If `self.useMultiprocessing` is set, the objects within each frame are fitted in parallel.
         '''
 
         intTimesteps = [int(t) for t in timesteps]
         intTimesteps.sort()
 
-        for intT in intTimesteps:
-            t = str(intT)
-            # use image provider plugin to load labelimage
-            labelImage = self._readLabelImage(int(t))
-            nextObjectId = labelImage.max() + 1
-
-            for idx in detectionsPerTimestep[t]:
-                node = (intT, idx)
-                if node not in self.resolvedGraph:
-                    continue
-
-                count = 1
-                if idx in mergersPerTimestep[t]:
-                    count = mergersPerTimestep[t][idx]
-                getLogger().debug("Looking at node {} in timestep {} with count {}".format(idx, t, count))
-                
-                # collect initializations from incoming
-                initializations = []
-                for predecessor, _ in self.unresolvedGraph.in_edges(node):
-                    initializations.extend(self.unresolvedGraph.node[predecessor]['fits'])
-                # TODO: what shall we do if e.g. a 2-merger and a single object merge to 2 + 1,
-                # so there are 3 initializations for the 2-merger, and two initializations for the 1 merger?
-                # What does pgmlink do in that case?
-
-                # use merger resolving plugin to fit `count` objects, also updates labelimage!
-                fittedObjects = self.mergerResolverPlugin.resolveMerger(labelImage, idx, nextObjectId, count, initializations)
-                assert(len(fittedObjects) == count)
-
-                # split up node if count > 1, duplicate incoming and outgoing arcs
-                if count > 1:
-                    for idx in range(nextObjectId, nextObjectId + count):
-                        newNode = (intT, idx)
-                        self.resolvedGraph.add_node(newNode, division=False, count=1, origin=node)
-
-                        for e in self.unresolvedGraph.out_edges(node):
-                            self.resolvedGraph.add_edge(newNode, e[1])
-                        for e in self.unresolvedGraph.in_edges(node):
-                            if 'newIds' in self.unresolvedGraph.node[e[0]]:
-                                for newId in self.unresolvedGraph.node[e[0]]['newIds']:
-                                    self.resolvedGraph.add_edge((e[0][0], newId), newNode)
-                            else:
-                                self.resolvedGraph.add_edge(e[0], newNode)
-
-                    self.resolvedGraph.remove_node(node)
-                    self.unresolvedGraph.node[node]['newIds'] = range(nextObjectId, nextObjectId + count)
-                    nextObjectId += count
-
-                # each unresolved node stores its fitted shape(s) to be used
-                # as initialization in the next frame, this way division duplicates
-                # and de-merged nodes in the resolved graph do not need to store a fit as well
-                self.unresolvedGraph.node[node]['fits'] = fittedObjects
+        try:
+            for intT in intTimesteps:
+                t = str(intT)
+                # use image provider plugin to load labelimage
+                labelImage = self._readLabelImage(int(t))
+                objectSlicings = getObjectSlicings(labelImage)
+                nextObjectId = labelImage.max() + 1
+
+                objectsToFit = self._getObjectsToFit(detectionsPerTimestep, mergersPerTimestep, t)
+                for idx, count in objectsToFit:
+                    getLogger().debug("Looking at node {} in timestep {} with count {}".format(idx, t, count))
+
+                # use merger resolving plugin to fit `count` objects to each object of this frame at once,
+                # only looking at the pixels in their bounding boxes
+                fittedObjects = self._fitObjects(
+                    [getObjectCoordinates(labelImage, objectSlicings, idx) for idx, _ in objectsToFit],
+                    [count for _, count in objectsToFit],
+                    [self._getInitializations((intT, idx)) for idx, _ in objectsToFit])
+
+                for (idx, count), fits in zip(objectsToFit, fittedObjects):
+                    nextObjectId = self._refineNode((intT, idx), count, fits, nextObjectId)
+        finally:
+            self.close()
 
         # import matplotlib.pyplot as plt
         # nx.draw_networkx(resolvedGraph)
         # plt.savefig("/Users/chaubold/test.pdf")
 
-    def _minCostMaxFlowMergerResolving(self, objectFeatures, transitionClassifier=None, transitionParameter=5.0):
+    def _getTransitionProbabilities(self, edges, objectFeatures, transitionClassifier=None, transitionParameter=5.0):
+        """
+        Predict the probabilities of all `edges` of the `resolvedGraph` at once, using the `transitionClassifier`
+        on the transition features of all edges, or distance-based probabilities if no classifier is given.
+
+        **returns** an array with one row `[1 - p, p]` per edge
+        """
+        if len(edges) == 0:
+            transitionProbabilities = np.zeros((0, 2))
+        elif transitionClassifier is not None:
+            featuresAtSrc = stackObjectFeatures([objectFeatures[edge[0]] for edge in edges],
+                                                transitionClassifier.selectedFeatures)
+            featuresAtDest = stackObjectFeatures([objectFeatures[edge[1]] for edge in edges],
+                                                 transitionClassifier.selectedFeatures)
+            try:
+                featureMatrix = self.pluginManager.applyTransitionFeatureMatrixConstructionPlugins(
+                    featuresAtSrc, featuresAtDest, transitionClassifier.selectedFeatures)
+            except:
+                getLogger().error("Could not compute transition features of the {} links".format(len(edges)))
+                getLogger().error(featuresAtSrc)
+                getLogger().error(featuresAtDest)
+                raise
+            if featureMatrix.shape[0] != len(edges):
+                raise ValueError("Transition feature matrix has {} rows for {} links".format(featureMatrix.shape[0], len(edges)))
+            transitionProbabilities = transitionClassifier.predictProbabilities(featureMatrix, numThreads=None)
+        else:
+            srcCenters = np.array([objectFeatures[edge[0]]['RegionCenter'] for edge in edges])
+            destCenters = np.array([objectFeatures[edge[1]]['RegionCenter'] for edge in edges])
+            dist = np.linalg.norm(destCenters - srcCenters, axis=1)
+            prob = np.exp(-dist / transitionParameter)
+            transitionProbabilities = np.column_stack([1.0 - prob, prob])
+        return transitionProbabilities
+
+    def _minCostMaxFlowMergerResolving(self, objectFeatures, transitionClassifier=None, transitionParameter=5.0, timeBudget=None):
         """
         Find the optimal assignments within the `resolvedGraph` by running min-cost max-flow from the
         `dpct` module.
 
+        If a `timeBudget` (in seconds) is given and min-cost max-flow does not finish in time, all de-merged objects
+        are kept as separate tracks without any links, and `self.mergerResolvingProvenOptimal` is set to `False`.
+
         Converts the `resolvedGraph` to our JSON model structure, predicts the transition probabilities
         either using the given transitionClassifier, or using distance-based probabilities.
 
@@ -217,35 +399,27 @@ class MergerResolver(object):
             uuid = trackingGraph.addDetectionHypotheses(features, **additionalFeatures)
             self.resolvedGraph.node[node]['id'] = uuid
 
-        for edge in self.resolvedGraph.edges_iter():
+        # score all transitions at once
+        edges = list(self.resolvedGraph.edges_iter())
+        transitionProbabilities = self._getTransitionProbabilities(edges, objectFeatures, transitionClassifier, transitionParameter)
+        for edge, probs in zip(edges, transitionProbabilities):
             src = self.resolvedGraph.node[edge[0]]['id']
             dest = self.resolvedGraph.node[edge[1]]['id']
-
-            featuresAtSrc = objectFeatures[edge[0]]
-            featuresAtDest = objectFeatures[edge[1]]
-
-            if transitionClassifier is not None:
-                try:
-                    featVec = self.pluginManager.applyTransitionFeatureVectorConstructionPlugins(
-                        featuresAtSrc, featuresAtDest, transitionClassifier.selectedFeatures)
-                except:
-                    getLogger().error("Could not compute transition features of link {}->{}:".format(src, dest))
-                    getLogger().error(featuresAtSrc)
-                    getLogger().error(featuresAtDest)
-                    raise
-                featVec = np.expand_dims(np.array(featVec), axis=0)
-                probs = transitionClassifier.predictProbabilities(featVec)[0]
-            else:
-                dist = np.linalg.norm(featuresAtDest['RegionCenter'] - featuresAtSrc['RegionCenter'])
-                prob = np.exp(-dist / transitionParameter)
-                probs = [1.0 - prob, prob]
-
             trackingGraph.addLinkingHypotheses(src, dest, listify(negLog(probs)))
 
         # track
         import dpct
         weights = {"weights": [1, 1, 1, 1]}
-        mergerResult = dpct.trackMaxFlow(trackingGraph.model, weights)
+        if timeBudget is None:
+            mergerResult = dpct.trackMaxFlow(trackingGraph.model, weights)
+        else:
+            mergerResult = solveWithTimeBudget(dpct.trackMaxFlow, (trackingGraph.model, weights), timeBudget)
+        self.mergerResolvingProvenOptimal = mergerResult is not None
+
+        if mergerResult is None:
+            getLogger().warning("Min-cost max-flow did not finish in time, keeping all de-merged objects without links")
+            mergerResult = {'detectionResults': [{'id': d['id'], 'value': 1} for d in trackingGraph.model['segmentationHypotheses']],
+                            'linkingResults': [{'src': l['src'], 'dest': l['dest'], 'value': 0} for l in trackingGraph.model['linkingHypotheses']]}
 
         # transform results to dictionaries that can be indexed by id or (src,dest)
         nodeFlowMap = dict([(int(d['id']), int(d['value'])) for d in mergerResult['detectionResults']])
@@ -364,7 +538,7 @@ class MergerResolver(object):
         pass
 
     # ------------------------------------------------------------
-    def run(self, transition_classifier_filename=None, transition_classifier_path=None):
+    def run(self, transition_classifier_filename=None, transition_classifier_path=None, timeBudget=None):
         """
         Run merger resolving
 
@@ -374,6 +548,9 @@ class MergerResolver(object):
         4. run min-cost max-flow tracking to find the fate of all the de-merged objects
         5. export refined segmentation, update member variables `model` and `result`
 
+        If min-cost max-flow does not finish within the `timeBudget` (in seconds), the resulting `result`
+        gets an entry `provenOptimal` set to `False`.
+
         **Returns** a nested dictionary, indexed first by time, then object Id, containing a list of new segmentIDs per merger
         """
 
@@ -425,7 +602,7 @@ class MergerResolver(object):
             # run min-cost max-flow to find merger assignments
             getLogger().info("Running min-cost max-flow to find resolved merger assignments")
 
-            nodeFlowMap, arcFlowMap = self._minCostMaxFlowMergerResolving(objectFeatures, transitionClassifier)
+            nodeFlowMap, arcFlowMap = self._minCostMaxFlowMergerResolving(objectFeatures, transitionClassifier, timeBudget=timeBudget)
 
             # ------------------------------------------------------------
             # fuse results into a new solution
@@ -461,6 +638,8 @@ class MergerResolver(object):
                                              traxelIdPerTimestepToUniqueIdMap,
                                              mergerNodeFilter,
                                              mergerLinkFilter)
+            if not self.mergerResolvingProvenOptimal:
+                self.result['provenOptimal'] = False
 
             # 3.) export refined segmentation
             self._exportRefinedSegmentation(timesteps)
@@ -483,6 +662,7 @@ class MergerResolver(object):
         t = str(time)
         
         if self.detectionsPerTimestep is not None and t in self.detectionsPerTimestep:
+            objectSlicings = getObjectSlicings(labelImage)
             for idx in self.detectionsPerTimestep[t]:
                 node = (time, idx)
 
@@ -493,7 +673,9 @@ class MergerResolver(object):
                 fits = self.unresolvedGraph.node[node]['fits']
                 newIds = self.unresolvedGraph.node[node]['newIds']
                 
-                # use merger resolving plugin to update labelImage with merger IDs
-                self.mergerResolverPlugin.updateLabelImage(labelImage, idx, fits, newIds)
+                # use merger resolving plugin to update labelImage with merger IDs,
+                # the cropped view is updated in place
+                objectImage, offset = cropToObject(labelImage, objectSlicings, idx)
+                self.mergerResolverPlugin.updateLabelImage(objectImage, idx, fits, newIds, offset)
           
         return labelImage
\ No newline at end of file
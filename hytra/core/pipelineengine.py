@@ -0,0 +1,266 @@
+'''
+Running the stages of a tracking pipeline in a single process.
+
+Each stage is a python function whose inputs are the (in memory) outputs of the stages it depends on.
+Stages whose dependencies are all done are run in parallel threads, except for exclusive stages that start worker
+processes: those run in the main thread while no other stage is running. To skip stages whose inputs have not changed
+when the pipeline is run again, every stage gets a key that is a content hash of its configuration, its input files,
+and the keys of all stages it depends on. If a `cacheDirectory` is given, the outputs of all stages are
+pickled there under that key. Outputs that a stage marks as not cacheable (e.g. a best-effort result obtained under
+a time budget) are neither stored, nor are the outputs of the stages depending on them.
+'''
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import logging
+import os
+import hashlib
+import json
+import time
+import multiprocessing
+import concurrent.futures
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+def getLogger():
+    ''' logger to be used in this module '''
+    return logging.getLogger(__name__)
+
+def hashFile(filename, blockSize=2**20):
+    ''' **returns** the sha1 hex digest of the contents of the given file '''
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class Stage(object):
+    '''
+    A single step of the pipeline, see `Pipeline.addStage`.
+    '''
+    def __init__(self, name, function, dependencies=(), config=None, inputFiles=(), outputFiles=(),
+                 isCacheable=None, exclusive=False):
+        self.name = name
+        self.function = function
+        self.dependencies = list(dependencies)
+        self.config = config
+        self.inputFiles = list(inputFiles)
+        self.outputFiles = list(outputFiles)
+        self.isCacheable = isCacheable
+        self.exclusive = exclusive
+
+
+class Pipeline(object):
+    """
+    Dependency aware scheduler for pipeline stages with caching of the stage outputs.
+
+    Usage:
+
+        pipeline = Pipeline(cacheDirectory='cache')
+        pipeline.addStage('weights', readWeights, config={'filename': weightFilename}, inputFiles=[weightFilename])
+        pipeline.addStage('graph', createGraph, config=graphParams, inputFiles=[labelImageFilename])
+        pipeline.addStage('tracking', track, dependencies=['graph', 'weights'], config={'solver': 'flow-based'})
+        outputs = pipeline.run()
+
+    where `track(graph, weights)` is called with the outputs of the stages `graph` and `weights` as keyword arguments.
+    """
+
+    def __init__(self, cacheDirectory=None, numWorkers=None):
+        '''
+        **Parameters:**
+
+        * `cacheDirectory`: directory where stage outputs are stored. If `None`, outputs are only kept in memory,
+          which still skips unchanged stages when `run` is called repeatedly on the same `Pipeline`.
+        * `numWorkers`: maximum number of stages that run at the same time, defaults to the number of CPUs
+        '''
+        self.cacheDirectory = cacheDirectory
+        if cacheDirectory is not None and not os.path.exists(cacheDirectory):
+            os.makedirs(cacheDirectory)
+        self.numWorkers = numWorkers
+        self.stages = {}
+        self._memoryCache = {}
+        self._fileHashes = {}
+
+    def addStage(self, name, function, dependencies=(), config=None, inputFiles=(), outputFiles=(),
+                 isCacheable=None, exclusive=False):
+        '''
+        Add a stage to the pipeline.
+
+        **Parameters:**
+
+        * `name`: unique name of the stage, under which its output is passed to the stages depending on it
+        * `function`: called with the outputs of the `dependencies` as keyword arguments, returns the stage output
+        * `dependencies`: list of names of stages that need to be run before this one
+        * `config`: JSON serializable configuration of the stage. The stage is re-run when this changes
+        * `inputFiles`: files read by the stage. The stage is re-run when their contents change
+        * `outputFiles`: files written by the stage. The stage is re-run if one of them does not exist
+        * `isCacheable`: function that is called with the output of the stage and returns `False` if that output
+          must not be cached, e.g. because it is a best-effort result that was not proven optimal.
+          Such stages and all stages depending on them are run again the next time.
+        * `exclusive`: set to `True` if the stage starts worker processes. It is then run in the main thread while no
+          other stage is running, because a process forked while another thread holds a lock
+          (e.g. the one of h5py or of the logging module) would wait for that lock forever
+        '''
+        if name in self.stages:
+            raise ValueError("Pipeline already contains a stage named {}".format(name))
+        self.stages[name] = Stage(name, function, dependencies, config, inputFiles, outputFiles, isCacheable, exclusive)
+
+    def _getRequiredStages(self, targets):
+        ''' **returns** the names of all stages needed for `targets` in topological order '''
+        order = []
+        visiting = set()
+
+        def visit(name):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError("Pipeline stages contain a cyclic dependency at {}".format(name))
+            if name not in self.stages:
+                raise ValueError("Unknown pipeline stage {}".format(name))
+            visiting.add(name)
+            for d in self.stages[name].dependencies:
+                visit(d)
+            visiting.remove(name)
+            order.append(name)
+
+        for t in targets:
+            visit(t)
+        return order
+
+    def _hashInputFile(self, filename):
+        '''
+        content hash of a file, only recomputed if its size or modification time changed.
+        Directories (e.g. of tiff images) are hashed by the names and contents of the files in them.
+        '''
+        if not os.path.exists(filename):
+            return None
+        if os.path.isdir(filename):
+            sha = hashlib.sha1()
+            for f in sorted(os.listdir(filename)):
+                sha.update(f.encode('utf-8'))
+                sha.update(str(self._hashInputFile(os.path.join(filename, f))).encode('utf-8'))
+            return sha.hexdigest()
+        stat = os.stat(filename)
+        signature = (stat.st_size, stat.st_mtime)
+        if filename not in self._fileHashes or self._fileHashes[filename][0] != signature:
+            self._fileHashes[filename] = (signature, hashFile(filename))
+        return self._fileHashes[filename][1]
+
+    def _getStageKey(self, stage, dependencyKeys):
+        ''' content hash of everything that determines the output of the `stage` '''
+        sha = hashlib.sha1()
+        sha.update(stage.name.encode('utf-8'))
+        sha.update(json.dumps(stage.config, sort_keys=True, default=str).encode('utf-8'))
+        for filename in stage.inputFiles:
+            sha.update(filename.encode('utf-8'))
+            sha.update(str(self._hashInputFile(filename)).encode('utf-8'))
+        for d in stage.dependencies:
+            sha.update(dependencyKeys[d].encode('utf-8'))
+        return sha.hexdigest()
+
+    def _getCacheFilename(self, stage, key):
+        return os.path.join(self.cacheDirectory, '{}-{}.pickle'.format(stage.name, key))
+
+    def _isCached(self, stage, key):
+        if not all(os.path.exists(f) for f in stage.outputFiles):
+            return False
+        if key in self._memoryCache:
+            return True
+        return self.cacheDirectory is not None and os.path.exists(self._getCacheFilename(stage, key))
+
+    def _loadOutput(self, stage, key):
+        if key not in self._memoryCache:
+            getLogger().debug("Loading cached output of stage {}".format(stage.name))
+            with open(self._getCacheFilename(stage, key), 'rb') as f:
+                self._memoryCache[key] = pickle.load(f)
+        return self._memoryCache[key]
+
+    def _storeOutput(self, stage, key, output):
+        self._memoryCache[key] = output
+        if self.cacheDirectory is None:
+            return
+        filename = self._getCacheFilename(stage, key)
+        try:
+            with open(filename + '.tmp', 'wb') as f:
+                pickle.dump(output, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(filename + '.tmp', filename)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            getLogger().warning("Output of stage {} can not be cached on disk: {}".format(stage.name, e))
+            os.remove(filename + '.tmp')
+
+    def _runStage(self, stage, inputs):
+        getLogger().info("Running stage {}".format(stage.name))
+        startTime = time.time()
+        output = stage.function(**inputs)
+        getLogger().info("Stage {} finished in {:.2f} secs".format(stage.name, time.time() - startTime))
+        return output
+
+    def run(self, targets=None):
+        '''
+        Run all stages needed to compute the `targets` (default: all stages), skipping those with cached outputs.
+
+        **returns** a dictionary of the outputs of all stages that were run or loaded from the cache
+        '''
+        if targets is None:
+            targets = sorted(self.stages.keys())
+        order = self._getRequiredStages(targets)
+
+        # the keys only depend on configuration and input files, so we know up front which stages can be skipped
+        keys = {}
+        for name in order:
+            keys[name] = self._getStageKey(self.stages[name], keys)
+        toRun = [name for name in order if not self._isCached(self.stages[name], keys[name])]
+        for name in order:
+            if name not in toRun:
+                getLogger().info("Skipping stage {}, its inputs did not change".format(name))
+
+        outputs = {}
+        def getOutput(name):
+            if name not in outputs:
+                outputs[name] = self._loadOutput(self.stages[name], keys[name])
+            return outputs[name]
+
+        uncacheable = set()
+        def finishStage(name, output):
+            stage = self.stages[name]
+            outputs[name] = output
+            if any(d in uncacheable for d in stage.dependencies) or \
+                    (stage.isCacheable is not None and not stage.isCacheable(output)):
+                getLogger().info("Not caching the output of stage {}".format(name))
+                uncacheable.add(name)
+            else:
+                self._storeOutput(stage, keys[name], output)
+
+        pending = list(toRun)
+        running = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.numWorkers or multiprocessing.cpu_count()) as executor:
+            while len(pending) > 0 or len(running) > 0:
+                ready = [name for name in pending
+                         if not any(d in pending or d in running.values() for d in self.stages[name].dependencies)]
+                exclusive = [name for name in ready if self.stages[name].exclusive]
+                if len(exclusive) > 0 and len(running) == 0:
+                    # no other stage runs now, and none is started until this one is done
+                    name = exclusive[0]
+                    stage = self.stages[name]
+                    pending.remove(name)
+                    finishStage(name, self._runStage(stage, dict((d, getOutput(d)) for d in stage.dependencies)))
+                    continue
+
+                for name in ready:
+                    stage = self.stages[name]
+                    if stage.exclusive:
+                        continue
+                    inputs = dict((d, getOutput(d)) for d in stage.dependencies)
+                    running[executor.submit(self._runStage, stage, inputs)] = name
+                    pending.remove(name)
+
+                done, _ = concurrent.futures.wait(running.keys(), return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    finishStage(name, future.result())
+
+        for name in targets:
+            getOutput(name)
+        return outputs
@@ -82,7 +82,8 @@ def computeRegionFeaturesOnCloud(frame,
                                  pluginPaths=['hytra/plugins'],
                                  featuresPerFrame = None,
                                  imageProviderPluginName='LocalImageLoader',
-                                 featureSerializerPluginName='LocalFeatureSerializer'
+                                 featureSerializerPluginName='LocalFeatureSerializer',
+                                 featureDirectory=None
                                 ):
     '''
     Allow to use dispy to schedule feature computation to nodes running a dispynode,
@@ -97,9 +98,11 @@ def computeRegionFeaturesOnCloud(frame,
     * `labelImageFilename`: the base filename of the label image volume, or a dvid server address
     * `labelImagePath`: path inside the label image HDF5 file, or DVID dataset UUID
     * `pluginPaths`: where all yapsy plugins are stored (should be absolute for DVID)
+    * `featureDirectory`: where the npz feature serializer stores the features of each frame
 
-    **returns** the feature dictionary for this frame if `featureSerializerPluginName == 'LocalFeatureSerializer'`
-    and `featuresPerFrame == None`.
+    **returns** a tuple of the frame and its feature dictionary if `featureSerializerPluginName == 'LocalFeatureSerializer'`
+    and `featuresPerFrame == None`. Otherwise the features are stored by the feature serializer and `(frame, None)`
+    is returned.
     '''
 
     # set up plugin manager
@@ -146,11 +149,15 @@ def computeRegionFeaturesOnCloud(frame,
         featureSerializer.server_address = labelImageFilename
         featureSerializer.uuid = labelImagePath
 
+        # directory of the feature files used by the npz serializer
+        featureSerializer.feature_directory = featureDirectory
+
         # feature dictionary used by local serializer
         featureSerializer.features_per_frame = featuresPerFrame
 
         # store
         featureSerializer.storeFeaturesForFrame(frameFeatures, frame)
+        return frame, None
 
 def computeDivisionFeaturesOnCloud(frameT,
                                    featuresAtT,
@@ -176,13 +183,20 @@ def computeDivisionFeaturesOnCloud(frameT,
     features for `frameT`
     '''
 
-    # get the label image of the next frame
-    if frameT + 1 < imageProviderPlugin.getTimeRange(labelImageFilename, labelImagePath):
-        labelImageAtTPlus1 = imageProviderPlugin.getLabelImageForFrame(labelImageFilename, labelImagePath, frameT + 1)
+    fm = hytra.core.divisionfeatures.FeatureManager(ndim=numDimensions)
+
+    # get the part of the label image of the next frame that contains the templates around all objects
+    labelImageAtTPlus1 = None
+    region = None
+    if frameT + 1 < imageProviderPlugin.getTimeRange(labelImageFilename, labelImagePath)[1]:
+        imageShape = imageProviderPlugin.getImageShape(labelImageFilename, labelImagePath)
+        region = fm.getTemplateRegion(featuresAtT, tuple(imageShape)[:numDimensions])
+        if region is not None:
+            labelImageAtTPlus1 = imageProviderPlugin.getLabelImageRegion(labelImageFilename, labelImagePath, frameT + 1, *region)
 
     # compute features
-    fm = hytra.core.divisionfeatures.FeatureManager(ndim=numDimensions)
-    feats = fm.computeFeatures_at(featuresAtT, featuresAtTPlus1, labelImageAtTPlus1, divisionFeatureNames, labelImageFilename)
+    feats = fm.computeFeatures_at(featuresAtT, featuresAtTPlus1, labelImageAtTPlus1, divisionFeatureNames, labelImageFilename,
+                                  img_next_offset=region[0] if region is not None else None)
 
     return frameT, feats
 
@@ -247,6 +261,7 @@ class IlpProbabilityGenerator(ProbabilityGenerator):
                                                     pluginPaths=pluginPaths)
         self._pluginManager.setImageProvider(ilpOptions.imageProviderName)
         self._pluginManager.setFeatureSerializer(ilpOptions.featureSerializerName)
+        self._setUpFeatureSerializer()
 
         self._countClassifier = None
         self._divisionClassifier = None
@@ -274,6 +289,13 @@ class IlpProbabilityGenerator(ProbabilityGenerator):
         self.TraxelsPerFrame = {}
         ''' this public variable contains all traxels if we're not using pgmlink '''
     
+    def _setUpFeatureSerializer(self):
+        ''' configure the feature serializer the same way as `computeRegionFeaturesOnCloud` does in the workers '''
+        featureSerializer = self._pluginManager.getFeatureSerializer()
+        featureSerializer.server_address = self._options.labelImageFilename
+        featureSerializer.uuid = self._options.labelImagePath
+        featureSerializer.feature_directory = self._options.featureDirectory
+
     def _loadClassifiers(self):
         if self._options.objectCountClassifierPath != None and self._options.objectCountClassifierFilename != None:
             self._countClassifier = RandomForestClassifier(self._options.objectCountClassifierPath,
@@ -457,11 +479,17 @@ class IlpProbabilityGenerator(ProbabilityGenerator):
                                                 self._options.labelImageFilename,
                                                 self._options.labelImagePath,
                                                 turnOffFeatures,
-                                                self._pluginPaths
+                                                self._pluginPaths,
+                                                imageProviderPluginName=self._options.imageProviderName,
+                                                featureSerializerPluginName=self._options.featureSerializerName,
+                                                featureDirectory=self._options.featureDirectory
                     ))
                 for job in concurrent.futures.as_completed(jobs):
                     progressBar.show()
                     frame, feats = job.result()
+                    if feats is None:
+                        # the worker stored the features with the chosen serializer
+                        feats = self._pluginManager.getFeatureSerializer().loadFeaturesForFrame(None, frame)
                     featuresPerFrame[frame] = feats
 
                 # 2nd pass for division features
@@ -508,7 +536,10 @@ class IlpProbabilityGenerator(ProbabilityGenerator):
                                      self._options.labelImageFilename,
                                      self._options.labelImagePath,
                                      turnOffFeatures,
-                                     pluginPaths=['/home/carstenhaubold/embryonic/plugins'])
+                                     pluginPaths=['/home/carstenhaubold/embryonic/plugins'],
+                                     imageProviderPluginName=self._options.imageProviderName,
+                                     featureSerializerPluginName=self._options.featureSerializerName,
+                                     featureDirectory=self._options.featureDirectory)
                 job.id = frame
                 jobs.append(job)
 
@@ -704,6 +735,8 @@ if __name__ == '__main__':
     parser.add_argument('--image-provider', type=str, dest='image_provider_name', default="LocalImageLoader")
     parser.add_argument('--feature-serializer', type=str, dest='feature_serializer_name', 
                         default='LocalFeatureSerializer')
+    parser.add_argument('--feature-directory', type=str, dest='feature_directory', default=None,
+                        help='Directory where the NpzFeatureSerializer stores the features of every frame')
     parser.add_argument('--disable-multiprocessing', dest='disableMultiprocessing', action='store_true',
                         help='Do not use multiprocessing to speed up computation',
                         default=False)
@@ -726,6 +759,7 @@ if __name__ == '__main__':
 
     ilpOptions.imageProviderName = args.image_provider_name
     ilpOptions.featureSerializerName = args.feature_serializer_name
+    ilpOptions.featureDirectory = args.feature_directory
 
     if(not args.labelImageFilename):
         ilpOptions.labelImageFilename = args.ilpFilename
@@ -4,6 +4,8 @@ import numpy as np
 import h5py
 import os
 import logging
+import multiprocessing
+import concurrent.futures
 from hytra.pluginsystem.plugin_manager import TrackingPluginManager
 from hytra.core.ilastik_project_options import IlastikProjectOptions
 
@@ -106,12 +108,15 @@ class RandomForestClassifier:
 
         return featureVectors
 
-    def predictProbabilities(self, features, featureDict=None):
+    def predictProbabilities(self, features, featureDict=None, numThreads=1):
         """
         Given a matrix of features, where each row represents one object and each column is a specific feature,
         this method predicts the probabilities for all classes that this RF knows.
 
         If features=None but a featureDict is given, the selected features for this random forest are automatically extracted
+
+        If `numThreads` is not 1, the rows are split into chunks, which are predicted by all forests in parallel threads.
+        `numThreads=None` uses one thread per CPU core.
         """
         assert (len(self._randomForests) > 0)
 
@@ -127,10 +132,24 @@ class RandomForestClassifier:
             print(features)
             raise AssertionError()
 
-        # predict by summing the probabilities of all the given random forests (not in parallel - not optimized for speed)
+        features = features.astype('float32')
         probabilities = np.zeros((features.shape[0], self._randomForests[0].labelCount()))
-        for rf in self._randomForests:
-            probabilities += rf.predictProbabilities(features.astype('float32'))
+        if numThreads is None:
+            numThreads = multiprocessing.cpu_count()
+
+        if numThreads == 1 or features.shape[0] == 0:
+            # predict by summing the probabilities of all the given random forests
+            for rf in self._randomForests:
+                probabilities += rf.predictProbabilities(features)
+        else:
+            # vigra releases the GIL during prediction, so every (forest, chunk of rows) pair can run in its own thread
+            numChunks = max(1, min(features.shape[0], numThreads // len(self._randomForests)))
+            chunks = np.array_split(np.arange(features.shape[0]), numChunks)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=numThreads) as executor:
+                jobs = [(chunk, executor.submit(rf.predictProbabilities, features[chunk]))
+                        for rf in self._randomForests for chunk in chunks]
+                for chunk, job in jobs:
+                    probabilities[chunk] += job.result()
 
         return probabilities
 
@@ -0,0 +1,410 @@
+'''
+Temporal decomposition of tracking problems that are too large to be solved at once.
+
+A hypotheses graph in our JSON (or python dictionary) format is split into (possibly overlapping)
+time windows, which are tracked independently -- and in parallel processes if desired.
+Afterwards, the tracks found in the core of each window are contracted into tracklets and
+stitched together by solving a much smaller tracking problem on the tracklet graph.
+'''
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import logging
+import copy
+import concurrent.futures
+import numpy as np
+import networkx as nx
+import hytra.core.jsongraph
+from hytra.core.jsongraph import JsonTrackingGraph
+from hytra.core.probabilitygenerator import DummyExecutor
+
+
+def getLogger():
+    ''' logger to be used in this module '''
+    return logging.getLogger(__name__)
+
+def trackFlowBased(model, weights):
+    '''
+    Solver that runs min-cost flow based tracking from the `dpct` module.
+    Solvers passed to `SplitTracking` must be module level functions like this one,
+    so that they can be sent to the worker processes.
+    '''
+    import dpct
+    return dpct.trackFlowBased(model, weights)
+
+def trackIlp(model, weights):
+    '''
+    Solver that runs the multi hypotheses tracking ILP, using CPLEX or Gurobi - whichever is available.
+    '''
+    try:
+        import multiHypoTracking_with_cplex as mht
+    except ImportError:
+        try:
+            import multiHypoTracking_with_gurobi as mht
+        except ImportError:
+            raise ImportError("Could not find multi hypotheses tracking ilp solver")
+    return mht.track(model, weights)
+
+def solveWindow(solver, submodel, weights, windowIdx):
+    '''
+    Track one time window using the given `solver`. Meant to be run in its own process
+    using `concurrent.futures.ProcessPoolExecutor`.
+
+    **returns** a tuple of `windowIdx` and the tracking result
+    '''
+    return windowIdx, solver(submodel, weights)
+
+def _relaxedBoundaryFeatures(numStates):
+    ''' (almost) zero appearance/disappearance costs for detections at the artificial border of a time window '''
+    return [[0.0000001 * sum(range(i + 1))] for i in range(numStates)]
+
+
+class SplitTracking(object):
+    """
+    Track a long movie by splitting its hypotheses graph into time windows, solving each of them
+    with a pluggable `solver` and stitching the resulting tracks.
+
+    Each window consists of a *core* range of frames, which is extended by `overlap` frames on both sides.
+    The overlap only serves as context for the solver, the solution is taken from the core of each window
+    so that every detection is decided by exactly one window.
+
+    Usage:
+
+        splitTracking = SplitTracking(model, weights, solver=trackFlowBased)
+        result = splitTracking.track(numSplits=4, overlap=5)
+    """
+
+    def __init__(self, model, weights, solver=trackFlowBased, useMultiprocessing=True, numWorkers=None):
+        '''
+        Set up the split tracking.
+
+        **Parameters:**
+
+        * `model`: the tracking model as dictionary, or a `JsonTrackingGraph` or `HypothesesGraph` with inserted energies
+        * `weights`: the weights dictionary that is passed on to the solver
+        * `solver`: a function that takes a model and weights and returns a result dictionary.
+          Must be defined at module level to be usable with multiprocessing.
+        * `useMultiprocessing`: whether to track the windows in parallel processes
+        * `numWorkers`: number of processes to use (defaults to the number of CPU cores). At most
+          this many windows are held in memory at the same time.
+        '''
+        if isinstance(model, JsonTrackingGraph):
+            model = model.model
+        elif hasattr(model, 'toTrackingGraph'):
+            model = model.toTrackingGraph().model
+
+        self.model = model
+        self.weights = weights
+        self._solver = solver
+        self._useMultiprocessing = useMultiprocessing
+        self._numWorkers = numWorkers
+
+        self._buildIndices()
+
+    def _buildIndices(self):
+        '''
+        Index detections by the timestep they start in and links by their source, such that
+        submodels can be extracted and tracks be contracted in time linear in the size of the model.
+        '''
+        _, uuidToTraxelMap = hytra.core.jsongraph.getMappingsBetweenUUIDsAndTraxels(self.model)
+
+        self._detectionsById = {}
+        self._timestepRangePerDetection = {}
+        self._detectionIdsPerTimestep = {}
+        for d in self.model['segmentationHypotheses']:
+            traxels = uuidToTraxelMap[int(d['id'])]
+            self._detectionsById[d['id']] = d
+            self._timestepRangePerDetection[d['id']] = (traxels[0][0], traxels[-1][0])
+            self._detectionIdsPerTimestep.setdefault(traxels[0][0], []).append(d['id'])
+
+        self._linksByIdTuple = {}
+        self._linkDestsPerSrc = {}
+        for l in self.model['linkingHypotheses']:
+            self._linksByIdTuple[(l['src'], l['dest'])] = l
+            self._linkDestsPerSrc.setdefault(l['src'], []).append(l['dest'])
+
+        self.timeRange = (min(self._detectionIdsPerTimestep.keys()), max(self._detectionIdsPerTimestep.keys()) + 1)
+
+    def _getLinksWithin(self, detectionIds):
+        ''' return the (src, dest) tuples of all links where both ends are in the set `detectionIds` '''
+        return [(s, d) for s in detectionIds for d in self._linkDestsPerSrc.get(s, []) if d in detectionIds]
+
+    def getEvenSplitPoints(self, numSplits):
+        '''
+        **returns** a list of `numSplits - 1` frames after which the movie is split, such that all parts
+        have roughly the same length.
+        '''
+        numFramesPerSplit = (self.timeRange[1] - self.timeRange[0]) // numSplits
+        return [self.timeRange[0] + s * numFramesPerSplit - 1 for s in range(1, numSplits)]
+
+    def findSplitPoints(self, numSplits, border=10):
+        '''
+        Find frames after which the movie should be split into `numSplits` parts. Close to the evenly spaced
+        split locations (within `border` frames), we look for two consecutive frames where the cost of
+        having anything but one object per detection is high, so that there are few mergers
+        whose fate would be decided by two different windows.
+
+        **returns** a sorted list of `numSplits - 1` frames after which the movie is split
+        '''
+        nonSingletonCostsPerFrame = []
+        for t in range(*self.timeRange):
+            nonSingletonCosts = [np.inf]
+            for i in self._detectionIdsPerTimestep.get(t, []):
+                f = self._detectionsById[i]['features'][:]
+                del f[1]
+                nonSingletonCosts.extend([c[0] for c in f])
+            nonSingletonCostsPerFrame.append(min(nonSingletonCosts))
+
+        # sum of 2 neighboring elements (has len = len(nonSingletonCostsPerFrame) - 1)
+        nonSingletonCostsPerFrameGap = np.array([i + j for i, j in zip(nonSingletonCostsPerFrame[:-1], nonSingletonCostsPerFrame[1:])])
+
+        numFramesPerSplit = (self.timeRange[1] - self.timeRange[0]) // numSplits
+        if numFramesPerSplit < border * 2:
+            border = 1
+
+        splitPoints = []
+        for desiredSplitPoint in self.getEvenSplitPoints(numSplits):
+            desiredSplitPoint -= self.timeRange[0]
+            start = max(0, desiredSplitPoint - border)
+            subrange = nonSingletonCostsPerFrameGap[start : desiredSplitPoint + border]
+            splitPoints.append(self.timeRange[0] + start + int(np.argmax(subrange)))
+
+        return sorted(set(splitPoints))
+
+    def getWindows(self, splitPoints, overlap=0):
+        '''
+        **returns** a list of `(windowStart, windowEnd, coreStart, coreEnd)` tuples (all end frames exclusive),
+        where the cores are separated at the given `splitPoints` and the windows extend the cores by `overlap` frames.
+        '''
+        windows = []
+        coreStart = self.timeRange[0]
+        for splitPoint in list(splitPoints) + [self.timeRange[1] - 1]:
+            coreEnd = splitPoint + 1
+            windows.append((max(self.timeRange[0], coreStart - overlap),
+                            min(self.timeRange[1], coreEnd + overlap),
+                            coreStart,
+                            coreEnd))
+            coreStart = coreEnd
+        return windows
+
+    def getSubmodel(self, windowStart, windowEnd):
+        '''
+        Extract the model of all detections starting in the time window `[windowStart, windowEnd)` and
+        the links among them. Appearance and disappearance costs at the artificial window borders are
+        (almost) zero, so that tracks can leave and enter the window there.
+        '''
+        segmentationHypotheses = []
+        uuidsInSubmodel = set()
+        for t in range(windowStart, windowEnd):
+            for i in self._detectionIdsPerTimestep.get(t, []):
+                d = self._detectionsById[i]
+                firstTimestep, lastTimestep = self._timestepRangePerDetection[i]
+                relaxAppearance = firstTimestep == windowStart and windowStart > self.timeRange[0]
+                relaxDisappearance = lastTimestep >= windowEnd - 1 and windowEnd < self.timeRange[1]
+                if relaxAppearance or relaxDisappearance:
+                    d = copy.copy(d)
+                    if relaxAppearance:
+                        d['appearanceFeatures'] = _relaxedBoundaryFeatures(len(d['features']))
+                    if relaxDisappearance:
+                        d['disappearanceFeatures'] = _relaxedBoundaryFeatures(len(d['features']))
+                segmentationHypotheses.append(d)
+                uuidsInSubmodel.add(i)
+
+        submodel = {}
+        submodel['segmentationHypotheses'] = segmentationHypotheses
+        submodel['linkingHypotheses'] = [self._linksByIdTuple[idTuple] for idTuple in self._getLinksWithin(uuidsInSubmodel)]
+        submodel['divisionHypotheses'] = []
+        if 'exclusions' in self.model:
+            submodel['exclusions'] = [e for e in self.model['exclusions'] if all(i in uuidsInSubmodel for i in e)]
+        submodel['settings'] = self.model['settings']
+        return submodel
+
+    def _contractWindowResult(self, windowIdx, result):
+        '''
+        Store the values of all detections in the core of the window, and contract the tracks of the
+        window's solution into tracklets. Nodes of a tracklet are connected by links that carry the same
+        number of objects as both of their end points (and where the source does not divide).
+        Active links that are not contracted are inserted into the stitching graph.
+        '''
+        _, _, coreStart, coreEnd = self._windows[windowIdx]
+        coreIds = set(i for t in range(coreStart, coreEnd) for i in self._detectionIdsPerTimestep.get(t, []))
+
+        dividingIds = set()
+        if 'divisionResults' in result and result['divisionResults'] is not None:
+            dividingIds.update(d['id'] for d in result['divisionResults'] if d['value'] == True)
+
+        g = nx.Graph()
+        for d in result['detectionResults']:
+            if d['id'] not in coreIds:
+                continue
+            self._valuePerDetection[d['id']] = d['value']
+            if 'divisionValue' in d and d['divisionValue']:
+                dividingIds.add(d['id'])
+            g.add_node(d['id'])
+        for i in coreIds:
+            self._divisionPerDetection[i] = i in dividingIds
+
+        coreLinks = [l for l in result['linkingResults'] if l['src'] in coreIds and l['dest'] in coreIds]
+        for l in coreLinks:
+            s, d = l['src'], l['dest']
+            if l['value'] > 0 and not self._divisionPerDetection[s] and self._valuePerDetection[s] == l['value'] and self._valuePerDetection[d] == l['value']:
+                g.add_edge(s, d)
+
+        # for every connected component, insert a node into the stitching graph
+        for c in nx.connected_components(g):
+            c = sorted(c, key=lambda i: (self._timestepRangePerDetection[i][0], i))
+            cSet = set(c)
+
+            # sum over features of dets + links
+            linkFeatures = [self._linksByIdTuple[idTuple]['features'] for idTuple in self._getLinksWithin(cSet)]
+            detFeatures = [self._detectionsById[i]['features'] for i in c]
+            accumulatedFeatures = np.sum([hytra.core.jsongraph.delistify(f) for f in linkFeatures + detFeatures], axis=0)
+
+            first = self._detectionsById[c[0]]
+            last = self._detectionsById[c[-1]]
+            trackletId = c[0]
+            contractedNode = {
+                'id' : trackletId,
+                'features' : hytra.core.jsongraph.listify(accumulatedFeatures),
+            }
+            if 'appearanceFeatures' in first:
+                contractedNode['appearanceFeatures'] = first['appearanceFeatures']
+            if 'disappearanceFeatures' in last:
+                contractedNode['disappearanceFeatures'] = last['disappearanceFeatures']
+            if 'divisionFeatures' in last:
+                contractedNode['divisionFeatures'] = last['divisionFeatures']
+            self._tracklets.append(contractedNode)
+            self._trackletContents[trackletId] = c
+
+            for n in c:
+                self._nodeIdRemapping[n] = trackletId
+
+        # add the remaining active links of this window's core with adjusted source and destination
+        for l in coreLinks:
+            s, d = l['src'], l['dest']
+            if l['value'] > 0 and (self._valuePerDetection[s] != l['value'] or self._valuePerDetection[d] != l['value'] or self._divisionPerDetection[s]):
+                self._addStitchingLink(s, d)
+
+    def _addStitchingLink(self, s, d):
+        ''' insert the original link `(s, d)` into the stitching graph, between the tracklets containing `s` and `d` '''
+        trackletLink = (self._nodeIdRemapping[s], self._nodeIdRemapping[d])
+        if trackletLink in self._stitchingLinkOrigins:
+            return
+        self._stitchingLinkOrigins[trackletLink] = (s, d)
+        self._stitchingLinks.append({
+            'src' : trackletLink[0],
+            'dest' : trackletLink[1],
+            'features' : self._linksByIdTuple[(s, d)]['features']
+        })
+
+    def _trackWindows(self):
+        '''
+        Track all windows, in parallel if configured. To bound the memory consumption, submodels
+        are created lazily and at most as many windows as there are workers are in flight at the same time.
+        '''
+        if self._useMultiprocessing:
+            # use ProcessPoolExecutor, which instanciates as many processes as there CPU cores by default
+            ExecutorType = concurrent.futures.ProcessPoolExecutor
+            getLogger().info('Tracking {} time windows in parallel via multiprocessing'.format(len(self._windows)))
+        else:
+            ExecutorType = DummyExecutor
+            getLogger().info('Tracking {} time windows on a single core'.format(len(self._windows)))
+
+        numWorkers = self._numWorkers
+        if numWorkers is None:
+            import multiprocessing
+            numWorkers = multiprocessing.cpu_count()
+
+        def collect(jobs):
+            for job in jobs:
+                windowIdx, result = job.result()
+                getLogger().debug("Contracting tracks of window {}/{}".format(windowIdx, len(self._windows)))
+                self._contractWindowResult(windowIdx, result)
+
+        with ExecutorType(max_workers=numWorkers) as executor:
+            pending = set()
+            for windowIdx, (windowStart, windowEnd, _, _) in enumerate(self._windows):
+                submodel = self.getSubmodel(windowStart, windowEnd)
+                if len(submodel['segmentationHypotheses']) == 0:
+                    getLogger().warning("Skipping window {}/{} as it does not contain any detections".format(windowIdx, len(self._windows)))
+                    continue
+                getLogger().info("Tracking window {}/{} from t={} to t={} with {} nodes and {} edges".format(
+                    windowIdx, len(self._windows), windowStart, windowEnd,
+                    len(submodel['segmentationHypotheses']), len(submodel['linkingHypotheses'])))
+                pending.add(executor.submit(solveWindow, self._solver, submodel, self.weights, windowIdx))
+                if len(pending) >= numWorkers:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    collect(done)
+            collect(concurrent.futures.as_completed(pending))
+
+    def _extractFullResult(self, stitchingResult):
+        ''' expand the solution of the stitching graph to all detections and links of the original model '''
+        fullResult = {'detectionResults' : [], 'linkingResults' : [], 'divisionResults' : []}
+
+        dividingTracklets = set()
+        if 'divisionResults' in stitchingResult and stitchingResult['divisionResults'] is not None:
+            dividingTracklets.update(d['id'] for d in stitchingResult['divisionResults'] if d['value'] == True)
+
+        for dr in stitchingResult['detectionResults']:
+            v = dr['value']
+            contents = self._trackletContents[dr['id']]
+            for originalUuid in contents:
+                fullResult['detectionResults'].append({'id': originalUuid, 'value': v})
+            if v > 0:
+                for s, d in self._getLinksWithin(set(contents)):
+                    fullResult['linkingResults'].append({'src': s, 'dest' : d, 'value': v})
+            if ('divisionValue' in dr and dr['divisionValue']) or dr['id'] in dividingTracklets:
+                fullResult['divisionResults'].append({'id': contents[-1], 'value': True})
+
+        for lr in stitchingResult['linkingResults']:
+            v = lr['value']
+            if v > 0:
+                s, d = self._stitchingLinkOrigins[(lr['src'], lr['dest'])]
+                fullResult['linkingResults'].append({'src': s, 'dest' : d, 'value': v})
+
+        return fullResult
+
+    def track(self, numSplits=None, splitPoints=None, overlap=0):
+        '''
+        Run tracking on the time windows and stitch the results.
+
+        **Parameters:**
+
+        * `numSplits`: into how many windows the movie should be split, split points are found by `findSplitPoints`
+        * `splitPoints`: alternatively, give the frames after which the movie should be split explicitly
+        * `overlap`: number of frames by which the windows are extended on both sides
+
+        **returns** the result dictionary for the full model
+        '''
+        assert(numSplits is not None or splitPoints is not None)
+        if splitPoints is None:
+            splitPoints = self.findSplitPoints(numSplits)
+        getLogger().info("Going to split hypotheses graph at frames {}".format(splitPoints))
+        self._windows = self.getWindows(splitPoints, overlap)
+
+        self._valuePerDetection = {}
+        self._divisionPerDetection = {}
+        self._nodeIdRemapping = {}
+        self._tracklets = []
+        self._trackletContents = {}
+        self._stitchingLinks = []
+        self._stitchingLinkOrigins = {}
+
+        self._trackWindows()
+        getLogger().info("\tgot {} links from within the windows".format(len(self._stitchingLinks)))
+
+        # insert all links crossing the window cores that connect active detections
+        windowCoreIdx = np.searchsorted([w[3] for w in self._windows], [self._timestepRangePerDetection[i][0] for i in self._detectionsById.keys()], side='right')
+        windowCorePerDetection = dict(zip(self._detectionsById.keys(), windowCoreIdx))
+        for s, d in self._linksByIdTuple.keys():
+            if windowCorePerDetection[s] != windowCorePerDetection[d] and self._valuePerDetection.get(s, 0) > 0 and self._valuePerDetection.get(d, 0) > 0:
+                self._addStitchingLink(s, d)
+
+        stitchingModel = {
+            'segmentationHypotheses': self._tracklets,
+            'linkingHypotheses': self._stitchingLinks,
+            'divisionHypotheses' : [],
+            'settings' : self.model['settings']
+        }
+        getLogger().info("Stitching graph contains {} nodes and {} edges".format(len(self._tracklets), len(self._stitchingLinks)))
+        stitchingResult = self._solver(stitchingModel, self.weights)
+
+        return self._extractFullResult(stitchingResult)
@@ -0,0 +1,316 @@
+'''
+Train the transition classifier from a ground truth, given as one HDF5 file per frame containing the
+`segmentation/labels` and the `tracking/Moves` that end in this frame, and the corresponding raw data.
+
+The frames of all datasets are walked in order twice, with at most the frames t and t+1 in memory:
+
+1. `computeTrainingFeatures` reads one frame of raw data and ground truth after the other, computes the object
+   features, stores them with a feature serializer, determines which features are free of NaNs,
+   and collects the positive and negative object pairs of every pair of consecutive frames.
+2. `collectTrainingSamples` loads the selected features of frames t and t+1 again and writes the feature vectors
+   of all pairs into a `TransitionClassifier` whose sample matrix was allocated once with the final number of samples.
+'''
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import logging
+import numpy as np
+import h5py
+import vigra
+from sklearn.neighbors import KDTree
+import hytra.util.axesconversion
+
+def getLogger():
+    ''' logger to be used in this module '''
+    return logging.getLogger(__name__)
+
+forbiddenFeatures = ["Global<Maximum >", "Global<Minimum >", 'Histogram', 'Polygon', 'Defect Center',
+                     'Center', 'Input Center', 'Weighted<RegionCenter>']
+''' features that are never used for the transition classifier '''
+
+def getValidRegionCentersAndTheirIDs(featureDict,
+                                     countFeatureName='Count',
+                                     regionCenterName='RegionCenter'):
+    """
+    From the feature dictionary of a certain frame,
+    find all objects with pixel count > 0, and return their
+    region centers and ids.
+    """
+    validObjectMask = np.asarray(featureDict[countFeatureName]) > 0
+    validObjectMask[0] = False
+
+    regionCenters = np.asarray(featureDict[regionCenterName])[validObjectMask, :]
+    objectIds = np.where(validObjectMask)[0]
+    return regionCenters, objectIds
+
+def getNegativePairs(featuresAtT, featuresAtTPlusOne, positivePairs, numNeighbors=3):
+    """
+    Compute negative samples by finding the `numNeighbors` nearest neighbors in the next frame of every object,
+    and filtering out those pairings that are part of the `positivePairs`.
+
+    **returns** an array with one row `(objectIdAtT, objectIdAtTPlusOne)` per negative sample
+    """
+    centersAtT, objectIdsAtT = getValidRegionCentersAndTheirIDs(featuresAtT)
+    centersAtTPlusOne, objectIdsAtTPlusOne = getValidRegionCentersAndTheirIDs(featuresAtTPlusOne)
+    numNeighbors = min(numNeighbors, len(objectIdsAtTPlusOne))
+    if len(objectIdsAtT) == 0 or numNeighbors == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    kdt = KDTree(centersAtTPlusOne, metric='euclidean')
+    neighbors = kdt.query(centersAtT, k=numNeighbors, return_distance=False)
+    pairs = np.column_stack([np.repeat(objectIdsAtT, numNeighbors),
+                             objectIdsAtTPlusOne[neighbors.ravel()]]).astype(np.int64)
+
+    # look up all candidates at once by encoding every pair as a single integer
+    positivePairs = np.asarray(positivePairs, dtype=np.int64).reshape(-1, 2)
+    base = max(pairs.max(), positivePairs.max() if len(positivePairs) > 0 else 0) + 1
+    isPositive = np.in1d(pairs[:, 0] * base + pairs[:, 1], positivePairs[:, 0] * base + positivePairs[:, 1])
+    getLogger().debug("Discarding {} negative examples which are positive annotations".format(np.count_nonzero(isPositive)))
+    return pairs[~isPositive]
+
+def getFeaturesWithoutNaNs(featureDict):
+    """
+    **returns** the set of feature names of `featureDict` that contain neither NaNs nor infinite values,
+    and are not excluded from the transition classifier
+    """
+    selectedFeatures = set()
+    for key, value in featureDict.items():
+        if key in forbiddenFeatures:
+            continue
+        if isinstance(value, list) or not (np.any(np.isnan(value)) or np.any(np.isinf(value))):
+            selectedFeatures.add(key)
+    return selectedFeatures
+
+def readPositivePairs(groundTruthFilename):
+    """
+    **returns** the annotated moves that end in the frame of `groundTruthFilename`
+    as array with one row `(objectIdAtPreviousFrame, objectIdAtThisFrame)` per move
+    """
+    with h5py.File(groundTruthFilename, 'r') as h5file:
+        if 'tracking/Moves' not in h5file:
+            return np.zeros((0, 2), dtype=np.int64)
+        return h5file['tracking/Moves'][()].astype(np.int64).reshape(-1, 2)
+
+def iterateFrames(rawFilename, rawPath, rawAxes, groundTruthFiles, groundTruthAxes, timeframes):
+    """
+    Read the raw data and ground truth segmentation of one of the `timeframes` after the other,
+    where `groundTruthFiles[t]` contains the segmentation of frame `t`.
+
+    **yields** tuples `(timeframe, rawImage, labelImage)`, where both images have axes `xyzc`
+    """
+    with h5py.File(rawFilename, 'r') as h5raw:
+        rawDataset = h5raw[rawPath]
+        for timeframe in timeframes:
+            rawImage = rawDataset[hytra.util.axesconversion.getFrameSlicing(rawAxes, timeframe)]
+            rawImage = hytra.util.axesconversion.adjustOrder(rawImage, rawAxes.replace('t', ''), 'xyzc')
+            with h5py.File(groundTruthFiles[timeframe], 'r') as h5gt:
+                labelImage = h5gt['segmentation/labels'][()]
+            labelImage = hytra.util.axesconversion.adjustOrder(labelImage, groundTruthAxes, 'xyzc')
+            yield timeframe, rawImage, labelImage
+
+def computeFrameFeatures(rawImage, labelImage, timeframe, pluginManager, rawFilename):
+    """
+    Compute the features of all objects in one frame (given with axes `xyzc`) with the object feature plugins
+
+    **returns** a dictionary with one array per feature, indexed by object ID
+    """
+    rawImage = rawImage[..., 0]
+    labelImage = labelImage[..., 0]
+    moreFeats, _ = pluginManager.applyObjectFeatureComputationPlugins(
+        len(rawImage.squeeze().shape), rawImage, labelImage, timeframe, rawFilename)
+    featureDict = {}
+    for f in moreFeats:
+        featureDict.update(f)
+    return featureDict
+
+def computeTrainingFeatures(datasets, pluginManager, featureSerializer):
+    """
+    First pass over all frames of all `datasets`, each given as dictionary with the keys
+    `rawFilename`, `rawPath`, `rawAxes`, `groundTruthFiles`, `groundTruthAxes` and `timeframes`.
+
+    The features of every frame are stored with the `featureSerializer` under a running frame index,
+    such that only the previous and the current frame are kept in memory.
+
+    **returns** a tuple of
+
+    * the sorted list of features that are available and free of NaNs in all frames,
+    * the total number of samples, where every positive pair is used in both directions,
+    * a list of `(frameIndexAtT, frameIndexAtTPlusOne, positivePairs, negativePairs)` per pair of consecutive frames
+    """
+    selectedFeatures = None
+    numSamples = 0
+    framePairs = []
+    frameIndex = 0
+
+    for datasetIndex, dataset in enumerate(datasets):
+        previousFeatures = None
+        for timeframe, rawImage, labelImage in iterateFrames(dataset['rawFilename'],
+                                                             dataset['rawPath'],
+                                                             dataset['rawAxes'],
+                                                             dataset['groundTruthFiles'],
+                                                             dataset['groundTruthAxes'],
+                                                             dataset['timeframes']):
+            features = computeFrameFeatures(rawImage, labelImage, timeframe, pluginManager, dataset['rawFilename'])
+            del rawImage, labelImage
+
+            # only features that can be stored as typed arrays are kept
+            validFeatures = set(k for k in getFeaturesWithoutNaNs(features) if np.asarray(features[k]).dtype != np.object)
+            selectedFeatures = validFeatures if selectedFeatures is None else selectedFeatures & validFeatures
+            featureSerializer.storeFeaturesForFrame(dict((k, features[k]) for k in validFeatures), frameIndex)
+
+            if previousFeatures is not None:
+                positivePairs = readPositivePairs(dataset['groundTruthFiles'][timeframe])
+                negativePairs = getNegativePairs(previousFeatures, features, positivePairs)
+                framePairs.append((frameIndex - 1, frameIndex, positivePairs, negativePairs))
+                numSamples += 2 * len(positivePairs) + len(negativePairs)
+
+            previousFeatures = features
+            frameIndex += 1
+
+        getLogger().info('Done computing features from dataset {}, found {} samples so far'.format(datasetIndex, numSamples))
+
+    return sorted(selectedFeatures if selectedFeatures is not None else []), numSamples, framePairs
+
+def getObjectFeatureMatrices(featureDict, objectIds):
+    """
+    **returns** a dictionary with one row per object of `objectIds` for every feature in the features of its frame,
+    as needed by `TrackingPluginManager.applyTransitionFeatureMatrixConstructionPlugins`
+    """
+    return dict((key, np.asarray(value)[objectIds]) for key, value in featureDict.items()
+                if key != "Global<Maximum >" and key != "Global<Minimum >")
+
+def collectTrainingSamples(transitionClassifier, framePairs, pluginManager, featureSerializer):
+    """
+    Second pass: add the samples of all `framePairs` from `computeTrainingFeatures` to the `transitionClassifier`,
+    loading only the selected features of the two frames of each pair,
+    and constructing the feature vectors of all samples of a pair of frames at once.
+    """
+    selectedFeatures = transitionClassifier.selectedFeatures
+    featuresAtT = None
+    featuresAtTPlusOne = None
+    loadedFrame = None
+
+    for frameIndexAtT, frameIndexAtTPlusOne, positivePairs, negativePairs in framePairs:
+        # consecutive pairs share a frame, which is only loaded once
+        if loadedFrame == frameIndexAtT:
+            featuresAtT = featuresAtTPlusOne
+        else:
+            featuresAtT = featureSerializer.loadFeaturesForFrame(selectedFeatures, frameIndexAtT)
+        featuresAtTPlusOne = featureSerializer.loadFeaturesForFrame(selectedFeatures, frameIndexAtTPlusOne)
+        loadedFrame = frameIndexAtTPlusOne
+
+        # every positive pair is used in both directions, followed by the negative pairs
+        forward = pluginManager.applyTransitionFeatureMatrixConstructionPlugins(
+            getObjectFeatureMatrices(featuresAtT, positivePairs[:, 0]),
+            getObjectFeatureMatrices(featuresAtTPlusOne, positivePairs[:, 1]),
+            selectedFeatures)
+        backward = pluginManager.applyTransitionFeatureMatrixConstructionPlugins(
+            getObjectFeatureMatrices(featuresAtTPlusOne, positivePairs[:, 1]),
+            getObjectFeatureMatrices(featuresAtT, positivePairs[:, 0]),
+            selectedFeatures)
+        negative = pluginManager.applyTransitionFeatureMatrixConstructionPlugins(
+            getObjectFeatureMatrices(featuresAtT, negativePairs[:, 0]),
+            getObjectFeatureMatrices(featuresAtTPlusOne, negativePairs[:, 1]),
+            selectedFeatures)
+        if len(positivePairs) > 0:
+            positive = np.empty((2 * len(positivePairs), forward.shape[1]))
+            positive[0::2] = forward
+            positive[1::2] = backward
+            transitionClassifier.addSamples(positive, 1)
+        if len(negativePairs) > 0:
+            transitionClassifier.addSamples(negative, 0)
+
+class TransitionClassifier(object):
+    def __init__(self, selectedFeatures, numSamples=None):
+        """
+        Set up a transition classifier class that makes it easy to add samples, train and store the RF.
+        :param selectedFeatures: list of feature names that are supposed to be used
+        :param numSamples: if given, the data array for the samples is allocated with the proper dimensions,
+                            otherwise it needs to be resized whenever new samples are added.
+        """
+        self.rf = vigra.learning.RandomForest()
+        self.mydata = None
+        self.labels = [] if numSamples is None else np.zeros(numSamples, dtype=np.uint32)
+        self.selectedFeatures = selectedFeatures
+        self._numSamples = numSamples
+        self._nextIdx = 0
+
+    def addSample(self, f1, f2, label, pluginManager):
+        features = self.constructSampleFeatureVector(f1, f2, pluginManager)
+
+        if self._numSamples is None:
+            # use vstack
+            self.labels.append(label)
+            if self.mydata is None:
+                self.mydata = features
+            else:
+                self.mydata = np.vstack((self.mydata, features))
+        else:
+            # allocate full array once, then fill in row by row
+            if self.mydata is None:
+                self.mydata = np.zeros((self._numSamples, features.shape[0]), dtype=np.float32)
+
+            assert(self._nextIdx < self._numSamples)
+            self.mydata[self._nextIdx, :] = features
+            self.labels[self._nextIdx] = label
+            self._nextIdx += 1
+
+    def addSamples(self, features, label):
+        """
+        Add one sample with the given `label` per row of the transition feature matrix `features`
+        """
+        if self._numSamples is None:
+            self.labels.extend([label] * len(features))
+            self.mydata = features if self.mydata is None else np.vstack((self.mydata, features))
+        else:
+            if self.mydata is None:
+                self.mydata = np.zeros((self._numSamples, features.shape[1]), dtype=np.float32)
+
+            assert(self._nextIdx + len(features) <= self._numSamples)
+            self.mydata[self._nextIdx:self._nextIdx + len(features), :] = features
+            self.labels[self._nextIdx:self._nextIdx + len(features)] = label
+            self._nextIdx += len(features)
+
+    def constructSampleFeatureVector(self, f1, f2, pluginManager):
+        featVec = pluginManager.applyTransitionFeatureVectorConstructionPlugins(f1, f2, self.selectedFeatures)
+        return np.array(featVec)
+
+    # adding a comfortable function, where one can easily introduce the data
+    def add_allData(self, mydata, labels):
+        self.mydata = mydata
+        self.labels = labels
+
+    def train(self, withFeatureImportance=False):
+        getLogger().info(
+            "Training classifier from {} positive and {} negative labels".format(
+                np.count_nonzero(np.asarray(self.labels)), len(self.labels) - np.count_nonzero(np.asarray(self.labels))))
+        getLogger().info("Training classifier from a feature vector of length {}".format(self.mydata.shape))
+
+        if withFeatureImportance:
+            oob, featImportance = self.rf.learnRFWithFeatureSelection(
+                self.mydata.astype("float32"),
+                (np.asarray(self.labels)).astype("uint32").reshape(-1, 1))
+            getLogger().debug("RF feature importance: {}".format(featImportance))
+        else:
+            oob = self.rf.learnRF(
+                self.mydata.astype("float32"),
+                (np.asarray(self.labels)).astype("uint32").reshape(-1, 1))
+        getLogger().info("RF trained with OOB Error {}".format(oob))
+
+    def predictLabels(self, test_data, threshold=0.5):
+        prob = self.rf.predictProbabilities(test_data.astype('float32'))
+        res = np.copy(prob)
+        for i in range(0, len(prob)):
+            if prob[i][1] >= threshold:
+                res[i] = 1.
+            else:
+                res[i] = 0
+        return np.delete(res, 0, 1)
+
+    def writeRF(self, outputFilename):
+        self.rf.writeHDF5(outputFilename, pathInFile='/ClassifierForests/Forest0000')
+
+        # write selected features
+        with h5py.File(outputFilename, 'r+') as f:
+            featureNamesH5 = f.create_group('SelectedFeatures')
+            featureNamesH5 = featureNamesH5.create_group('Standard Object Features')
+            for feature in self.selectedFeatures:
+                featureNamesH5.create_group(feature)
@@ -1,10 +1,10 @@
 from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
 import logging
-from libdvid import DVIDNodeService, DVIDServerService
 import h5py
 import numpy as np
 import json_tricks.np as json
-from pluginsystem.plugin_manager import TrackingPluginManager
+import concurrent.futures
+from hytra.dvid.dvidclient import DvidNodeService
 
 if __name__ == '__main__':
     """
@@ -31,6 +31,8 @@ if __name__ == '__main__':
                         default='/TrackingFeatureExtraction/LabelImage/0000/[[%d, 0, 0, 0, 0], [%d, %d, %d, %d, 1]]')
     parser.add_argument('--time-range', type=int, nargs=2, dest='timeRange',
                         help='Set time range to download (inclusive!)')
+    parser.add_argument('--num-threads', type=int, dest='numThreads', default=8,
+                        help='Number of frames that are downloaded concurrently')
     parser.add_argument('--verbose', type=bool, dest='verbose', default=False,
                         help='verbose logs')
 
@@ -42,7 +44,7 @@ if __name__ == '__main__':
 
     # get node service
     server_address = args.dvidAddress
-    node_service = DVIDNodeService(server_address, args.uuid)
+    node_service = DvidNodeService(server_address, args.uuid)
 
     keyvalue_store = "config"
     settings = json.loads(node_service.get(keyvalue_store, "imageInfo"))
@@ -56,19 +58,23 @@ if __name__ == '__main__':
 
     raw_data = np.zeros((time_range[1] - time_range[0], shape[0], shape[1], shape[2]))
 
-    # download all frames
-    with h5py.File(args.ilpFilename, 'w') as seg_h5:
-        for frame in range(time_range[0], time_range[1]):
-            logging.info("Downloading frame {}".format(frame))
-            
-            raw_name = "raw-{}".format(frame)
-            seg_name = "seg-{}".format(frame)
-            raw_image = node_service.get_gray3D(raw_name, shape, (0,0,0))
-            seg_image = node_service.get_labels3D(seg_name, shape, (0,0,0))
+    def downloadFrame(frame):
+        logging.info("Downloading frame {}".format(frame))
+        raw_name = "raw-{}".format(frame)
+        seg_name = "seg-{}".format(frame)
+        # every thread uses its own persistent connection
+        frame_node_service = DvidNodeService(server_address, args.uuid)
+        raw_image = frame_node_service.get_gray3D(raw_name, shape, (0,0,0))
+        seg_image = frame_node_service.get_labels3D(seg_name, shape, (0,0,0))
+        return frame, raw_image, seg_image
 
-            group_name = args.labelImagePath % (frame, frame+1, shape[0], shape[1], shape[2])
-            seg_h5.create_dataset(group_name, data=seg_image, dtype=np.uint32)
-            raw_data[frame, ...] = raw_image
+    # download all frames concurrently, and store them in order
+    with h5py.File(args.ilpFilename, 'w') as seg_h5:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.numThreads) as executor:
+            for frame, raw_image, seg_image in executor.map(downloadFrame, range(time_range[0], time_range[1])):
+                group_name = args.labelImagePath % (frame, frame+1, shape[0], shape[1], shape[2])
+                seg_h5.create_dataset(group_name, data=seg_image, dtype=np.uint32)
+                raw_data[frame - time_range[0], ...] = raw_image
 
     with h5py.File(args.rawFilename, 'w') as raw_h5:
         raw_h5.create_dataset(args.rawPath, data=raw_data, dtype=np.uint8)
@@ -0,0 +1,154 @@
+'''
+A small client for the parts of the [DVID](https://github.com/janelia-flyem/dvid) REST API that hytra uses.
+
+The classes mirror the methods of `libdvid.DVIDNodeService` and `libdvid.DVIDServerService`, so they can be used
+as drop-in replacement, but keep one persistent HTTP connection per server, thread and process
+instead of connecting again for every request. Volumes are numpy arrays in C-order, whose last axis
+is DVID's x axis, as in libdvid.
+'''
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import os
+import json
+import logging
+import threading
+import numpy as np
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+
+
+def getLogger():
+    ''' logger to be used in this module '''
+    return logging.getLogger(__name__)
+
+class DvidError(Exception):
+    ''' raised when the DVID server answers a request with an error '''
+    pass
+
+_connections = threading.local()
+
+def getConnection(serverAddress):
+    '''
+    **returns** the persistent `HTTPConnection` to `serverAddress` (`host:port`) of the calling thread.
+    Connections are never shared between threads or forked processes.
+    '''
+    if getattr(_connections, 'pid', None) != os.getpid():
+        _connections.pid = os.getpid()
+        _connections.byServer = {}
+    if serverAddress not in _connections.byServer:
+        getLogger().debug("Connecting to DVID server at {}".format(serverAddress))
+        _connections.byServer[serverAddress] = httplib.HTTPConnection(serverAddress)
+    return _connections.byServer[serverAddress]
+
+def closeConnections():
+    ''' close all connections of the calling thread '''
+    if getattr(_connections, 'pid', None) == os.getpid():
+        for connection in _connections.byServer.values():
+            connection.close()
+    _connections.byServer = {}
+
+def request(serverAddress, method, url, body=None):
+    '''
+    Send a request over the persistent connection, reconnecting once if the server closed it meanwhile.
+
+    **returns** the tuple `(status, responseBody)`
+    '''
+    for attempt in range(2):
+        connection = getConnection(serverAddress)
+        try:
+            # native strings, python 2's httplib fails to join unicode headers with a binary body
+            connection.request(str(method), str(url), body)
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (httplib.HTTPException, IOError):
+            connection.close()
+            del _connections.byServer[serverAddress]
+            if attempt == 1:
+                raise
+
+def _checkedRequest(serverAddress, method, url, body=None):
+    status, data = request(serverAddress, method, url, body)
+    if status >= 400:
+        raise DvidError("{} {} failed with status {}: {}".format(method, url, status, data))
+    return data
+
+
+class DvidServerService(object):
+    '''
+    Server level requests, see `libdvid.DVIDServerService`
+    '''
+
+    def __init__(self, serverAddress):
+        self.serverAddress = serverAddress
+
+    def create_new_repo(self, alias, description):
+        ''' **returns** the UUID of the root node of a new repository '''
+        data = _checkedRequest(self.serverAddress, 'POST', '/api/repos',
+                               json.dumps({'alias': alias, 'description': description}))
+        return json.loads(data.decode('utf-8'))['root']
+
+
+class DvidNodeService(object):
+    '''
+    Requests to the data instances of one version node (`uuid`), see `libdvid.DVIDNodeService`
+    '''
+
+    def __init__(self, serverAddress, uuid):
+        self.serverAddress = serverAddress
+        self.uuid = uuid
+
+    def _url(self, dataName, *parts):
+        return '/'.join(['/api/node', self.uuid, dataName] + [str(p) for p in parts])
+
+    def _createInstance(self, typename, dataName):
+        ''' **returns** `False` if the instance already existed, `True` if it was created '''
+        status, _ = request(self.serverAddress, 'GET', self._url(dataName, 'info'))
+        if status == 200:
+            return False
+        _checkedRequest(self.serverAddress, 'POST', '/api/repo/{}/instance'.format(self.uuid),
+                        json.dumps({'typename': typename, 'dataname': dataName}))
+        return True
+
+    def create_keyvalue(self, dataName):
+        return self._createInstance('keyvalue', dataName)
+
+    def create_grayscale8(self, dataName):
+        return self._createInstance('grayscale8', dataName)
+
+    def create_labelblk(self, dataName):
+        return self._createInstance('labelblk', dataName)
+
+    def put(self, dataName, key, value):
+        if not isinstance(value, bytes):
+            value = value.encode('utf-8')
+        _checkedRequest(self.serverAddress, 'POST', self._url(dataName, 'key', key), value)
+
+    def get(self, dataName, key):
+        return _checkedRequest(self.serverAddress, 'GET', self._url(dataName, 'key', key))
+
+    def _rawUrl(self, dataName, shape, offset):
+        # DVID expects sizes and offsets in x, y, z order, which are the reversed numpy axes
+        return self._url(dataName, 'raw', '0_1_2',
+                         '_'.join(str(int(s)) for s in reversed(shape)),
+                         '_'.join(str(int(o)) for o in reversed(offset)))
+
+    def _getVolume(self, dataName, shape, offset, dtype):
+        data = _checkedRequest(self.serverAddress, 'GET', self._rawUrl(dataName, shape, offset))
+        return np.frombuffer(data, dtype=dtype).reshape(tuple(shape))
+
+    def _putVolume(self, dataName, volume, offset, dtype):
+        volume = np.ascontiguousarray(volume, dtype=dtype)
+        _checkedRequest(self.serverAddress, 'POST', self._rawUrl(dataName, volume.shape, offset), volume.tobytes())
+
+    def get_gray3D(self, dataName, shape, offset):
+        return self._getVolume(dataName, shape, offset, np.dtype('<u1'))
+
+    def put_gray3D(self, dataName, volume, offset):
+        self._putVolume(dataName, volume, offset, np.dtype('<u1'))
+
+    def get_labels3D(self, dataName, shape, offset):
+        return self._getVolume(dataName, shape, offset, np.dtype('<u8'))
+
+    def put_labels3D(self, dataName, volume, offset):
+        self._putVolume(dataName, volume, offset, np.dtype('<u8'))
@@ -0,0 +1,182 @@
+'''
+A minimal in-process stand-in for a DVID server, serving volumes from numpy arrays, such that
+the DVID image provider and feature serializer can be tested and benchmarked without a real server.
+
+Only the requests used by `hytra.dvid.dvidclient` are supported: creating repositories and
+`keyvalue`, `grayscale8` and `labelblk` instances, getting and putting keys, and reading and writing
+subvolumes via the `raw/0_1_2` endpoint. Connections are kept alive like by a real DVID server.
+
+Usage:
+
+    with MockDvidServer() as server:
+        uuid = server.createRepo()
+        server.addVolume(uuid, 'seg-0', 'labelblk', labelImage)
+        loader.getLabelImageForFrame(server.address, uuid, 0)
+'''
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import re
+import json
+import uuid as uuidlib
+import threading
+import numpy as np
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+_dtypes = {'grayscale8': np.dtype('<u1'), 'labelblk': np.dtype('<u8')}
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        # one handler instance serves all requests of a connection
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.mock._lock:
+            self.server.mock.numConnections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status, body=b'', contentType='application/octet-stream'):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _readBody(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length > 0 else b''
+
+    def do_GET(self):
+        self._handle('GET', b'')
+
+    def do_POST(self):
+        self._handle('POST', self._readBody())
+
+    def _handle(self, method, body):
+        try:
+            status, response = self.server.mock.handle(method, self.path.split('?')[0], body)
+        except Exception as e:
+            status, response = 400, str(e)
+        self._respond(status, response)
+
+
+class MockDvidServer(object):
+    '''
+    DVID-compatible HTTP server running in a background thread of this process, see module documentation.
+    The data is kept in `self.repos`, a dictionary from UUID to a dictionary of data instances,
+    where each instance is a tuple `(typename, data)` with a dictionary of keys or a numpy volume (in z, y, x order).
+    '''
+
+    def __init__(self, port=0):
+        self.repos = {}
+        self.numRequests = 0
+        self.numConnections = 0
+        self._lock = threading.Lock()
+        self._server = _ThreadingHTTPServer(('127.0.0.1', port), _RequestHandler)
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def address(self):
+        ''' `host:port` of the server, as expected by the DVID clients '''
+        return '{}:{}'.format(*self._server.server_address[:2])
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def createRepo(self):
+        ''' **returns** the UUID of a new empty repository '''
+        uuid = uuidlib.uuid4().hex
+        self.repos[uuid] = {}
+        return uuid
+
+    def addVolume(self, uuid, dataName, typename, volume):
+        ''' serve the numpy array `volume` (in z, y, x order like in the clients) as data instance `dataName` '''
+        self.repos[uuid][dataName] = (typename, np.array(volume, dtype=_dtypes[typename]))
+
+    def handle(self, method, path, body):
+        ''' **returns** the tuple `(status, body)` of the response to a request '''
+        with self._lock:
+            self.numRequests += 1
+            if method == 'POST' and path == '/api/repos':
+                return 200, json.dumps({'root': self.createRepo()})
+
+            match = re.match(r'^/api/repo/(\w+)/instance$', path)
+            if match is not None and method == 'POST':
+                settings = json.loads(body.decode('utf-8'))
+                instances = self.repos[match.group(1)]
+                if settings['dataname'] in instances:
+                    return 400, 'data instance {} already exists'.format(settings['dataname'])
+                data = {} if settings['typename'] == 'keyvalue' else np.zeros((0, 0, 0), dtype=_dtypes[settings['typename']])
+                instances[settings['dataname']] = (settings['typename'], data)
+                return 200, ''
+
+            match = re.match(r'^/api/node/(\w+)/([^/]+)/(.*)$', path)
+            if match is None or match.group(1) not in self.repos:
+                return 404, 'unknown path {}'.format(path)
+            instances = self.repos[match.group(1)]
+            dataName, request = match.group(2), match.group(3).split('/')
+            if dataName not in instances:
+                return 404, 'unknown data instance {}'.format(dataName)
+            typename, data = instances[dataName]
+
+            if request == ['info']:
+                return 200, json.dumps({'Base': {'TypeName': typename, 'Name': dataName}})
+            if request[0] == 'key' and typename == 'keyvalue':
+                key = '/'.join(request[1:])
+                if method == 'POST':
+                    data[key] = body
+                    return 200, ''
+                if key not in data:
+                    return 404, 'unknown key {}'.format(key)
+                return 200, data[key]
+            if request[0] == 'raw' and typename in _dtypes and request[1] == '0_1_2':
+                shape = tuple(reversed([int(s) for s in request[2].split('_')]))
+                offset = tuple(reversed([int(o) for o in request[3].split('_')]))
+                return 200, self._handleRaw(instances, dataName, method, shape, offset, body)
+            return 400, 'unsupported request {}'.format(path)
+
+    def _handleRaw(self, instances, dataName, method, shape, offset, body):
+        typename, volume = instances[dataName]
+        end = tuple(o + s for o, s in zip(offset, shape))
+        slicing = tuple(slice(o, e) for o, e in zip(offset, end))
+        if method == 'POST':
+            if any(e > v for e, v in zip(end, volume.shape)):
+                enlarged = np.zeros(tuple(max(e, v) for e, v in zip(end, volume.shape)), dtype=volume.dtype)
+                enlarged[tuple(slice(0, v) for v in volume.shape)] = volume
+                volume = enlarged
+                instances[dataName] = (typename, volume)
+            volume[slicing] = np.frombuffer(body, dtype=volume.dtype).reshape(shape)
+            return b''
+
+        # voxels outside of the stored volume are zero
+        region = np.zeros(shape, dtype=volume.dtype)
+        available = tuple(slice(0, max(0, min(e, v) - o)) for o, e, v in zip(offset, end, volume.shape))
+        region[available] = volume[tuple(slice(o, o + a.stop) for o, a in zip(offset, available))]
+        return region.tobytes()
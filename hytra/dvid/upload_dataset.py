@@ -1,10 +1,11 @@
 from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
 import logging
-from libdvid import DVIDNodeService, DVIDServerService
 import h5py
 import numpy as np
 import json_tricks.np as json
-from pluginsystem.plugin_manager import TrackingPluginManager
+import concurrent.futures
+from hytra.dvid.dvidclient import DvidNodeService, DvidServerService
+from hytra.pluginsystem.plugin_manager import TrackingPluginManager
 
 def dataToBlock(data, dtype=np.uint8, block_size=32):
     if len(data.shape) == 2:
@@ -45,6 +46,8 @@ if __name__ == '__main__':
                         help='Filename of the hdf5 file containing the raw data')
     parser.add_argument('--raw-path', required=True, type=str, dest='rawPath',
                         help='Path inside HDF5 file to raw volume')
+    parser.add_argument('--raw-axes', type=str, dest='rawAxes', default='txyzc',
+                        help='Axes ordering of the raw volume')
     parser.add_argument('--label-image-path', type=str, dest='labelImagePath',
                         help='Path inside ilastik project file to the label image',
                         default='/TrackingFeatureExtraction/LabelImage/0000/[[%d, 0, 0, 0, 0], [%d, %d, %d, %d, 1]]')
@@ -58,6 +61,8 @@ if __name__ == '__main__':
                         help='Number of digits per forest index inside the ClassifierForests HDF5 group')
     parser.add_argument('--time-range', type=int, nargs=2, dest='timeRange',
                         help='Set time range to upload (inclusive!)')
+    parser.add_argument('--num-threads', type=int, dest='numThreads', default=8,
+                        help='Number of frames that are uploaded concurrently')
     parser.add_argument('--verbose', type=bool, dest='verbose', default=False,
                         help='verbose logs')
 
@@ -73,12 +78,12 @@ if __name__ == '__main__':
 
     # create dataset on server and get uuid
     server_address = args.dvidAddress
-    server_service = DVIDServerService(server_address)
+    server_service = DvidServerService(server_address)
     uuid = server_service.create_new_repo(args.datasetName, "description")
     logging.info('UUID:\n{}'.format(uuid))
 
     # get node service
-    node_service = DVIDNodeService(server_address, uuid)
+    node_service = DvidNodeService(server_address, uuid)
 
     # get dataset size and store in dvid
     shape = image_provider.getImageShape(args.ilpFilename, args.labelImagePath)
@@ -91,17 +96,22 @@ if __name__ == '__main__':
     settings = { "shape": shape, "time_range": time_range }
     node_service.put(keyvalue_store, "imageInfo", json.dumps(settings))
 
-    # upload all frames
-    for frame in range(time_range[0], time_range[1]):
+    def uploadFrame(frame):
         logging.info("Uploading frame {}".format(frame))
         label_image = image_provider.getLabelImageForFrame(args.ilpFilename, args.labelImagePath, frame)
-        raw_image = image_provider.getImageDataAtTimeFrame(args.rawFilename, args.rawPath, frame)
+        raw_image = image_provider.getImageDataAtTimeFrame(args.rawFilename, args.rawPath, args.rawAxes, frame)
 
         raw_name = "raw-{}".format(frame)
         seg_name = "seg-{}".format(frame)
-        node_service.create_grayscale8(raw_name)
-        node_service.put_gray3D(raw_name, dataToBlock(raw_image, dtype=np.uint8), (0,0,0))
-        node_service.create_labelblk(seg_name)
-        node_service.put_labels3D(seg_name, dataToBlock(label_image, dtype=np.uint64), (0,0,0))
+        # every thread uses its own persistent connection
+        frame_node_service = DvidNodeService(server_address, uuid)
+        frame_node_service.create_grayscale8(raw_name)
+        frame_node_service.put_gray3D(raw_name, dataToBlock(raw_image, dtype=np.uint8), (0,0,0))
+        frame_node_service.create_labelblk(seg_name)
+        frame_node_service.put_labels3D(seg_name, dataToBlock(label_image, dtype=np.uint64), (0,0,0))
+
+    # upload all frames concurrently
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.numThreads) as executor:
+        list(executor.map(uploadFrame, range(time_range[0], time_range[1])))
 
     # TODO: upload classifier
@@ -2,7 +2,7 @@ from __future__ import print_function, absolute_import, nested_scopes, generator
 from hytra.pluginsystem import feature_serializer_plugin
 import numpy as np
 import json_tricks as json
-from libdvid import DVIDNodeService, DVIDServerService
+from hytra.dvid.dvidclient import DvidNodeService
 
 class DvidFeatureSerializer(feature_serializer_plugin.FeatureSerializerPlugin):
     """
@@ -17,7 +17,7 @@ class DvidFeatureSerializer(feature_serializer_plugin.FeatureSerializerPlugin):
         """
         assert(self.server_address is not None)
         assert(self.uuid is not None)
-        node_service = DVIDNodeService(self.server_address, self.uuid)
+        node_service = DvidNodeService(self.server_address, self.uuid)
         node_service.create_keyvalue(self.keyvalue_store)
         node_service.put(self.keyvalue_store, "frame-{}".format(timeframe), json.dumps(features))
 
@@ -27,6 +27,6 @@ class DvidFeatureSerializer(feature_serializer_plugin.FeatureSerializerPlugin):
         """
         assert(self.server_address is not None)
         assert(self.uuid is not None)
-        node_service = DVIDNodeService(self.server_address, self.uuid)
+        node_service = DvidNodeService(self.server_address, self.uuid)
         node_service.create_keyvalue(self.keyvalue_store)
         return json.loads(node_service.get(self.keyvalue_store, "frame-{}".format(timeframe)))
\ No newline at end of file
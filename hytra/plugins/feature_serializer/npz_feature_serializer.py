@@ -0,0 +1,55 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+from hytra.pluginsystem import feature_serializer_plugin
+import os
+import numpy as np
+
+class NpzFeatureSerializer(feature_serializer_plugin.FeatureSerializerPlugin):
+    """
+    serializes the features of every frame to a separate uncompressed `.npz` file in `feature_directory`,
+    with one typed array per feature.
+
+    Frames can be stored by several processes at the same time and loaded in any order,
+    and loading only reads the arrays of the requested features.
+    """
+
+    # minimal number of digits of the frame number in the filenames
+    filenameZeroPadding = 5
+
+    def _getFilename(self, timeframe):
+        assert(self.feature_directory is not None)
+        return os.path.join(self.feature_directory,
+                            "frame-{}.npz".format(format(timeframe, "0{}".format(self.filenameZeroPadding))))
+
+    def storeFeaturesForFrame(self, features, timeframe):
+        """
+        Stores feature data, every feature must be convertible to a numeric numpy array
+        """
+        filename = self._getFilename(timeframe)
+        if not os.path.exists(self.feature_directory):
+            try:
+                os.makedirs(self.feature_directory)
+            except OSError:
+                # created by another process meanwhile
+                pass
+
+        arrays = {}
+        for name, value in features.items():
+            array = np.asarray(value)
+            if array.dtype == np.object:
+                raise ValueError("Feature {} of frame {} can not be stored as typed array".format(name, timeframe))
+            arrays[name] = array
+
+        # write to a temporary file first, such that readers never see a partially written frame
+        temporaryFilename = "{}.{}.tmp".format(filename, os.getpid())
+        with open(temporaryFilename, 'wb') as f:
+            np.savez(f, **arrays)
+        os.rename(temporaryFilename, filename)
+
+    def loadFeaturesForFrame(self, features, timeframe):
+        """
+        loads feature data. If `features` is a list of feature names, only those are loaded, otherwise all.
+        """
+        with np.load(self._getFilename(timeframe)) as npzFile:
+            if features is None:
+                features = npzFile.files
+            return dict((name, npzFile[name]) for name in features)
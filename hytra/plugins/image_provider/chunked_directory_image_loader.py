@@ -0,0 +1,122 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+from hytra.pluginsystem import image_provider_plugin
+from hytra.util.chunkedarray import ChunkedArray
+import hytra.util.axesconversion
+import os
+import numpy as np
+import logging
+
+
+class ChunkedDirectoryImageLoader(image_provider_plugin.ImageProviderPlugin):
+    """
+    Loads images from directories of compressed chunks, see `hytra.util.chunkedarray`.
+
+    `Resource` is the root directory and `PathInResource` the path of the array inside it.
+    Label images are stored as one array with axes `txyzc`, raw data keeps the axes of the original dataset.
+    Use `scripts/h5_to_chunked_directory.py` to convert HDF5 inputs.
+    """
+
+    shape = None
+    # chunk shape of newly exported label images, in xyz. Frames are always chunked separately.
+    exportChunks = (256, 256, 32)
+
+    def _openArray(self, Resource, PathInResource):
+        return ChunkedArray(os.path.join(Resource, PathInResource.strip('/')))
+
+    def getImageDataAtTimeFrame(self, Resource, PathInResource, axes, timeframe):
+        """
+        Loads image data from a chunked directory.
+        PathInResource provides the path of the array inside the directory
+        Return numpy array of image data at timeframe.
+        """
+        array = self._openArray(Resource, PathInResource)
+        offset = [timeframe if a == 't' else 0 for a in axes]
+        shape = [1 if a == 't' else s for a, s in zip(axes, array.shape)]
+        rawImage = array.read(offset, shape)[hytra.util.axesconversion.getFrameSlicing(axes, 0)]
+        remainingAxes = axes.replace('t', '')
+        return hytra.util.axesconversion.adjustOrder(rawImage, remainingAxes).squeeze()
+
+    def getImageDataRegion(self, Resource, PathInResource, axes, timeframe, offset, shape):
+        """
+        Loads the part of the image data at `timeframe` that starts at `offset` and has the given `shape`,
+        only decompressing the chunks that overlap the region. Channels are kept.
+        """
+        array = self._openArray(Resource, PathInResource)
+        regionOffset = {'t': timeframe}
+        regionShape = {'t': 1}
+        for axis, o, s in zip('xyz', offset, shape):
+            regionOffset[axis] = o
+            regionShape[axis] = s
+        rawRegion = array.read([regionOffset.get(a, 0) for a in axes],
+                               [regionShape.get(a, s) for a, s in zip(axes, array.shape)])
+        rawRegion = rawRegion[hytra.util.axesconversion.getFrameSlicing(axes, 0)]
+        rawRegion = hytra.util.axesconversion.adjustOrder(rawRegion, axes.replace('t', ''), 'xyzc')
+        rawRegion = rawRegion[(slice(None),) * len(shape) + (0,) * (3 - len(shape))]
+        if rawRegion.shape[-1] == 1:
+            rawRegion = rawRegion[..., 0]
+        return rawRegion
+
+    def getLabelImageForFrame(self, Resource, PathInResource, timeframe):
+        """
+        Loads the label image of `timeframe` from a `txyzc` array in a chunked directory.
+        Return numpy array of image data at timeframe.
+        """
+        if (self.shape == None):
+            self.getImageShape(Resource, PathInResource)
+        return self.getLabelImageRegion(Resource, PathInResource, timeframe, (0, 0, 0), self.shape).squeeze()
+
+    def getLabelImageRegion(self, Resource, PathInResource, timeframe, offset, shape):
+        """
+        Loads the part of the label image of `timeframe` that starts at `offset` and has the given `shape`,
+        only decompressing the chunks that overlap the region.
+        """
+        array = self._openArray(Resource, PathInResource)
+        begin = [timeframe, 0, 0, 0, 0]
+        size = [1, 1, 1, 1, 1]
+        begin[1:1 + len(offset)] = offset
+        size[1:1 + len(shape)] = shape
+        labelImage = array.read(begin, size)
+        return labelImage.reshape(tuple(shape)).astype(np.uint32)
+
+    def getImageShape(self, Resource, PathInResource):
+        """
+        Derive Image Shape from label image.
+        Return list with image dimensions.
+        """
+        self.shape = self._openArray(Resource, PathInResource).shape[1:4]
+        return self.shape
+
+    def getTimeRange(self, Resource, PathInResource):
+        """
+        Return tuple of (first frame, last frame)
+        """
+        return (0, self._openArray(Resource, PathInResource).shape[0])
+
+    def getImageDataTimeRange(self, Resource, PathInResource, axes):
+        """
+        Return tuple of (first frame, last frame) of the image data, from the length of its time axis
+        """
+        return (0, self._openArray(Resource, PathInResource).shape[axes.index('t')])
+
+    def exportLabelImage(self, labelimage, timeframe, Resource, PathInResource):
+        """
+        export labelimage of timeframe, the label image array is created or enlarged as needed
+        """
+        if len(labelimage.shape) == 2:
+            labelimage = labelimage[:, :, np.newaxis]
+        elif len(labelimage.shape) != 3:
+            raise NotImplementedError()
+
+        path = os.path.join(Resource, PathInResource.strip('/'))
+        if ChunkedArray.exists(path):
+            array = ChunkedArray(path)
+            assert(array.shape[1:4] == labelimage.shape)
+            if timeframe >= array.shape[0]:
+                array.resize((timeframe + 1,) + array.shape[1:])
+        else:
+            logging.getLogger("ChunkedDirectoryImageLoader").debug("Creating label image array at {}".format(path))
+            array = ChunkedArray.create(path, (timeframe + 1,) + labelimage.shape + (1,),
+                                        (1,) + self.exportChunks + (1,), np.uint16, attrs={'axes': 'txyzc'})
+        # saturate like HDF5 does when converting to the 16 bit type of the LocalImageLoader's label images
+        labelimage = np.minimum(labelimage, np.iinfo(array.dtype).max).astype(array.dtype)
+        array.write((timeframe, 0, 0, 0, 0), labelimage[np.newaxis, ..., np.newaxis])
@@ -0,0 +1,156 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+from hytra.pluginsystem import image_provider_plugin
+import hytra.util.axesconversion
+import os
+import re
+import glob
+import threading
+import collections
+import numpy as np
+import logging
+from skimage.external import tifffile
+
+
+class CTCTiffImageLoader(image_provider_plugin.ImageProviderPlugin):
+    """
+    Reads image sequences in the format of the Cell Tracking Challenge directly, one TIFF file per frame,
+    without converting them to HDF5 first.
+
+    `Resource` is the directory of the sequence (e.g. `01` or `01_GT/SEG`) and `PathInResource` a filename pattern
+    inside it with a `*` at the position of the frame number, e.g. `t*.tif`, `man_seg*.tif` or `mask*.tif`.
+    The list of files is indexed once per directory and pattern, and re-indexed when the directory changes.
+    Every request only decodes the file of the requested frame, the last `decodeCacheSize` decoded frames are kept.
+    The index and the decoded frames are shared by all threads (e.g. the read-ahead of `CachingImageProvider`),
+    files are decoded outside of the lock.
+    """
+
+    shape = None
+    # axes of a single 2D or 3D TIFF frame, following the conventions of the scripts in `scripts/ctc`
+    tiffAxes = {2: 'xy', 3: 'zyx'}
+    # number of decoded frames to keep in memory, 0 disables the cache
+    decodeCacheSize = 2
+    # minimal number of digits of the frame number in exported filenames
+    filenameZeroPadding = 3
+
+    def __init__(self):
+        super(CTCTiffImageLoader, self).__init__()
+        self._initializeCaches()
+
+    def _initializeCaches(self):
+        self._lock = threading.Lock()
+        self._frameIndices = {}
+        self._decodedFrames = collections.OrderedDict()
+
+    def __getstate__(self):
+        ''' the lock and the caches are not pickled, e.g. when the plugin is sent to worker processes '''
+        state = self.__dict__.copy()
+        for name in ['_lock', '_frameIndices', '_decodedFrames']:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._initializeCaches()
+
+    def _getFrameIndex(self, Resource, PathInResource):
+        """ **returns** a dictionary from frame number to filename of all files matching the pattern """
+        directory = os.path.abspath(Resource)
+        key = (directory, PathInResource)
+        modificationTime = os.stat(directory).st_mtime
+        with self._lock:
+            entry = self._frameIndices.get(key)
+        if entry is not None and entry[0] == modificationTime:
+            return entry[1]
+
+        logging.getLogger("CTCTiffImageLoader").debug("Indexing {} in {}".format(PathInResource, directory))
+        prefix, suffix = PathInResource.split('*')
+        frameNumber = re.compile(re.escape(prefix) + r'(\d+)' + re.escape(suffix) + '$')
+        index = {}
+        for filename in glob.glob(os.path.join(directory, PathInResource)):
+            match = frameNumber.match(os.path.basename(filename))
+            if match is not None:
+                index[int(match.group(1))] = filename
+        with self._lock:
+            self._frameIndices[key] = (modificationTime, index)
+        return index
+
+    def _readFrame(self, Resource, PathInResource, timeframe):
+        """ decode the TIFF file of `timeframe` and **returns** it with axes xyzc """
+        index = self._getFrameIndex(Resource, PathInResource)
+        if timeframe not in index:
+            raise ValueError("No file matching {} for frame {} in {}".format(PathInResource, timeframe, Resource))
+        filename = index[timeframe]
+        key = (filename, os.stat(filename).st_mtime)
+        with self._lock:
+            frame = self._decodedFrames.pop(key, None)
+        if frame is None:
+            frame = tifffile.imread(filename)
+            frame = hytra.util.axesconversion.adjustOrder(frame, self.tiffAxes[frame.ndim], 'xyzc')
+        if self.decodeCacheSize > 0:
+            with self._lock:
+                self._decodedFrames[key] = frame
+                while len(self._decodedFrames) > self.decodeCacheSize:
+                    self._decodedFrames.popitem(last=False)
+        return frame.copy()
+
+    def getImageDataAtTimeFrame(self, Resource, PathInResource, axes, timeframe):
+        """
+        Loads the raw image of `timeframe` from its TIFF file. The `axes` are ignored,
+        as the axes of the file are given by `tiffAxes`.
+        Return numpy array of image data at timeframe.
+        """
+        return self._readFrame(Resource, PathInResource, timeframe).squeeze()
+
+    def getLabelImageForFrame(self, Resource, PathInResource, timeframe):
+        """
+        Loads the segmentation of `timeframe` from its TIFF file, e.g. `man_seg001.tif` or `mask001.tif`.
+        Return numpy array of image data at timeframe.
+        """
+        return self._readFrame(Resource, PathInResource, timeframe)[..., 0].squeeze().astype(np.uint32)
+
+    def getImageShape(self, Resource, PathInResource):
+        """
+        Derive Image Shape from the first frame.
+        Return list with image dimensions.
+        """
+        index = self._getFrameIndex(Resource, PathInResource)
+        self.shape = self._readFrame(Resource, PathInResource, min(index.keys())).shape[:3]
+        return self.shape
+
+    def getTimeRange(self, Resource, PathInResource):
+        """
+        Return tuple of (first frame, last frame) from the frame numbers in the filenames
+        """
+        index = self._getFrameIndex(Resource, PathInResource)
+        if len(index) == 0:
+            raise ValueError("No files matching {} in {}".format(PathInResource, Resource))
+        return (0, max(index.keys()) + 1)
+
+    def getImageDataTimeRange(self, Resource, PathInResource, axes):
+        """
+        Return tuple of (first frame, last frame) of the raw images, see `getTimeRange`
+        """
+        return self.getTimeRange(Resource, PathInResource)
+
+    def exportLabelImage(self, labelimage, timeframe, Resource, PathInResource):
+        """
+        export labelimage of timeframe to a 16 bit TIFF file, named by replacing the `*` in `PathInResource`
+        with the frame number
+        """
+        if not os.path.exists(Resource):
+            os.makedirs(Resource)
+        frameNumber = format(timeframe, "0{}".format(self.filenameZeroPadding))
+        filename = os.path.join(Resource, PathInResource.replace('*', frameNumber))
+
+        if len(labelimage.shape) == 2 or labelimage.shape[2] == 1:
+            labelimage = labelimage.reshape(labelimage.shape[:2])
+        elif len(labelimage.shape) != 3:
+            raise NotImplementedError()
+        tiffAxes = self.tiffAxes[labelimage.ndim]
+        labelimage = hytra.util.axesconversion.adjustOrder(labelimage, 'xyz'[:labelimage.ndim], tiffAxes)
+        labelimage = np.minimum(labelimage, np.iinfo(np.uint16).max).astype(np.uint16)
+        tifffile.imsave(filename, labelimage)
+
+        # the new file must be found even if the modification time of the directory did not change visibly
+        with self._lock:
+            self._frameIndices.pop((os.path.abspath(Resource), PathInResource), None)
@@ -1,15 +1,40 @@
 from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
 from hytra.pluginsystem import image_provider_plugin
+from hytra.dvid.dvidclient import DvidNodeService
 import numpy as np
 import json_tricks as json
-from libdvid import DVIDNodeService, DVIDServerService
+import os
+import concurrent.futures
 
 class DvidImageLoader(image_provider_plugin.ImageProviderPlugin):
     """
-    Computes the subtraction of features in the feature vector
+    Loads images from a DVID server. `Resource` is the server address and `PathInResource` the UUID of the dataset.
+
+    Every thread keeps one persistent connection per server (see `hytra.dvid.dvidclient`),
+    and batches of regions are requested concurrently by `numThreads` threads.
     """
 
     shape = None
+    numThreads = 8
+
+    def __init__(self):
+        super(DvidImageLoader, self).__init__()
+        self._imageInfos = {}
+        self._executor = None
+        self._executorPid = None
+
+    def __getstate__(self):
+        ''' the thread pool can not be pickled, e.g. when the plugin is sent to worker processes '''
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        return state
+
+    def _getExecutor(self):
+        ''' the threads used for batched requests live as long as the plugin, so they can reuse their connections '''
+        if self._executor is None or self._executorPid != os.getpid():
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.numThreads)
+            self._executorPid = os.getpid()
+        return self._executor
 
     def _getRawImageName(self, timeframe):
         return "raw-"+str(timeframe)
@@ -18,57 +43,88 @@ class DvidImageLoader(image_provider_plugin.ImageProviderPlugin):
     def _getSegmentationName(self, timeframe):
         return "seg-"+str(timeframe)
 
+    def _getImageInfo(self, Resource, PathInResource):
+        ''' the dataset description with `shape` and `time_range`, which is only requested once per dataset '''
+        if (Resource, PathInResource) not in self._imageInfos:
+            node_service = DvidNodeService(Resource, PathInResource)
+            self._imageInfos[(Resource, PathInResource)] = json.loads(node_service.get("config", "imageInfo"))
+        return self._imageInfos[(Resource, PathInResource)]
 
     def getImageDataAtTimeFrame(self, Resource, PathInResource, axes, timeframe):
         """
-        Loads image data from local resource file in hdf5 format.
-        PathInResource provides the internal image path 
+        Loads image data from a DVID server.
+        PathInResource provides the UUID of the dataset
         Return numpy array of image data at timeframe.
         """
-        node_service = DVIDNodeService(Resource, PathInResource)
-
         if (self.shape == None):
             self.getImageShape(Resource, PathInResource)
 
-        raw_frame = node_service.get_gray3D(self._getRawImageName(timeframe), tuple(self.shape), (0,0,0))
-        return raw_frame
+        return self.getImageDataRegion(Resource, PathInResource, axes, timeframe, (0, 0, 0), self.shape)
 
 
     def getLabelImageForFrame(self, Resource, PathInResource, timeframe):
         """
-        Loads label image data from local resource file in hdf5 format.
-        PathInResource provides the internal image path 
+        Loads label image data from a DVID server.
+        PathInResource provides the UUID of the dataset
         Return numpy array of image data at timeframe.
         """
 
         if (self.shape == None):
             self.getImageShape(Resource, PathInResource)
 
-        node_service = DVIDNodeService(Resource, PathInResource)
-        seg_frame = np.array(node_service.get_labels3D(self._getSegmentationName(timeframe),
-                            tuple(self.shape), (0,0,0))).astype(np.uint32)
-        return seg_frame
+        return self.getLabelImageRegion(Resource, PathInResource, timeframe, (0, 0, 0), self.shape)
+
+    def _getSubvolume(self, offset, shape):
+        """ pad `offset` and `shape` of a 2D region to the 3D subvolume requested from DVID """
+        offset3D = tuple(offset) + (0,) * (3 - len(offset))
+        shape3D = tuple(shape) + (1,) * (3 - len(shape))
+        return offset3D, shape3D
+
+    def getImageDataRegion(self, Resource, PathInResource, axes, timeframe, offset, shape):
+        """
+        Loads only the region of the image data at `timeframe` that starts at `offset` and has the given `shape`,
+        by requesting the corresponding subvolume from DVID
+        """
+        node_service = DvidNodeService(Resource, PathInResource)
+        offset3D, shape3D = self._getSubvolume(offset, shape)
+        raw_region = node_service.get_gray3D(self._getRawImageName(timeframe), shape3D, offset3D)
+        return np.array(raw_region).reshape(tuple(shape))
+
+    def getLabelImageRegion(self, Resource, PathInResource, timeframe, offset, shape):
+        """
+        Loads only the region of the label image at `timeframe` that starts at `offset` and has the given `shape`,
+        by requesting the corresponding subvolume from DVID
+        """
+        node_service = DvidNodeService(Resource, PathInResource)
+        offset3D, shape3D = self._getSubvolume(offset, shape)
+        seg_region = node_service.get_labels3D(self._getSegmentationName(timeframe), shape3D, offset3D)
+        return np.array(seg_region).reshape(tuple(shape)).astype(np.uint32)
+
+    def getLabelImageRegions(self, Resource, PathInResource, regions):
+        """
+        Request several label image regions given as `(timeframe, offset, shape)` concurrently
+        """
+        return list(self._getExecutor().map(lambda r: self.getLabelImageRegion(Resource, PathInResource, *r), regions))
+
+    def getImageDataRegions(self, Resource, PathInResource, axes, regions):
+        """
+        Request several image data regions given as `(timeframe, offset, shape)` concurrently
+        """
+        return list(self._getExecutor().map(lambda r: self.getImageDataRegion(Resource, PathInResource, axes, *r), regions))
 
     def getImageShape(self, Resource, PathInResource):
         """
-        Derive Image Shape from label image.
-        Loads label image data from local resource file in hdf5 format.
-        PathInResource provides the internal image path 
+        Derive Image Shape from the dataset description stored on the DVID server.
+        PathInResource provides the UUID of the dataset
         Return list with image dimensions
         """
-
-        node_service = DVIDNodeService(Resource, PathInResource)
-        config = json.loads(node_service.get("config", "imageInfo"))
-        self.shape =  config["shape"]
+        self.shape = self._getImageInfo(Resource, PathInResource)["shape"]
         return self.shape
 
     def getTimeRange(self, Resource, PathInResource):
         """
-        Count Label images to derive the total number of frames
-        Loads label image data from local resource file in hdf5 format.
-        PathInResource provides the internal image path 
+        Read the time range from the dataset description stored on the DVID server.
+        PathInResource provides the UUID of the dataset
         Return tuple of (first frame, last frame)
         """
-        node_service = DVIDNodeService(Resource, PathInResource)
-        config = json.loads(node_service.get("config", "imageInfo"))
-        return config["time_range"]
\ No newline at end of file
+        return self._getImageInfo(Resource, PathInResource)["time_range"]
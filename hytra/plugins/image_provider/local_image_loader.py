@@ -1,9 +1,249 @@
 from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
 from hytra.pluginsystem import image_provider_plugin
 import hytra.util.axesconversion
+from hytra.util.chunkedarray import getDefaultChunks
+import os
 import numpy as np
 import h5py
 import logging
+import zlib
+import itertools
+import threading
+import concurrent.futures
+
+
+class H5FilePool(object):
+    """
+    Keeps HDF5 files open for reading, so that repeated reads of frames do not need to open the file
+    and parse its metadata again.
+
+    Handles are only valid in the process that opened them: after a fork the pool starts over,
+    without touching the handles inherited from the parent. A file is also reopened when it was modified
+    on disk since it was opened, and should be released via `release` before it is opened for writing.
+    """
+
+    def __init__(self):
+        self._pid = os.getpid()
+        self._handles = {}
+        self._inheritedHandles = []
+        # the pool is shared by all threads of the process, e.g. read-ahead threads
+        self._lock = threading.RLock()
+
+    def _checkProcess(self):
+        if os.getpid() != self._pid:
+            # keep references, so the parent's handles are not closed by the garbage collector of this process
+            self._inheritedHandles.extend(h[0] for h in self._handles.values())
+            self._handles = {}
+            self._lock = threading.RLock()
+            self._pid = os.getpid()
+
+    def get(self, filename):
+        """ **returns** an open (read only) `h5py.File` for `filename` """
+        self._checkProcess()
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+        signature = (stat.st_ino, stat.st_size, stat.st_mtime)
+        with self._lock:
+            if filename in self._handles:
+                h5file, openedSignature, _ = self._handles[filename]
+                if openedSignature == signature and h5file.id.valid:
+                    return h5file
+                self.release(filename)
+            h5file = h5py.File(filename, 'r')
+            self._handles[filename] = (h5file, signature, {})
+            return h5file
+
+    def getCache(self, filename):
+        """
+        **returns** a dictionary to store information derived from the contents of `filename`,
+        which is emptied when the file is reopened because it changed
+        """
+        with self._lock:
+            self.get(filename)
+            return self._handles[os.path.abspath(filename)][2]
+
+    def release(self, filename):
+        """ close the handle of `filename` if it is open, e.g. because it is about to be written """
+        self._checkProcess()
+        filename = os.path.abspath(filename)
+        with self._lock:
+            if filename in self._handles:
+                h5file = self._handles.pop(filename)[0]
+                if h5file.id.valid:
+                    h5file.close()
+
+    def releaseAll(self):
+        """ close all open handles """
+        for filename in list(self._handles.keys()):
+            self.release(filename)
+
+# one pool per process
+h5FilePool = H5FilePool()
+
+
+class LabelImageBlockIndex(object):
+    """
+    Index of the blocks of an ilastik `LabelImage_v2` group. The `blockSlice` attributes
+    (strings like `[t0:t1,x0:x1,y0:y1,z0:z1,c0:c1]`) are parsed once, and the blocks are sorted by the frames they contain,
+    such that the blocks overlapping a region of a frame can be found without looking at all blocks.
+    """
+
+    def __init__(self, group):
+        self.names = []
+        begins = []
+        ends = []
+        for name, block in group.items():
+            assert 'blockSlice' in block.attrs
+            blockSlice = block.attrs['blockSlice']
+            if isinstance(blockSlice, bytes):
+                blockSlice = blockSlice.decode('utf-8')
+            roi = [(int(r.split(':')[0]), int(r.split(':')[1])) for r in blockSlice[1:-1].split(',')]
+            self.names.append(name)
+            begins.append([r[0] for r in roi])
+            ends.append([r[1] for r in roi])
+        self.begins = np.array(begins, dtype=np.int64).reshape(-1, 5)
+        self.ends = np.array(ends, dtype=np.int64).reshape(-1, 5)
+
+        self._blocksPerFrame = {}
+        for i in range(len(self.names)):
+            for t in range(self.begins[i, 0], self.ends[i, 0]):
+                self._blocksPerFrame.setdefault(t, []).append(i)
+        self._blocksPerFrame = dict((t, np.array(b)) for t, b in self._blocksPerFrame.items())
+
+    def getTimeRange(self):
+        """ **returns** the tuple (first frame, last frame + 1) covered by the blocks """
+        return (int(self.begins[:, 0].min()), int(self.ends[:, 0].max()))
+
+    def getShape(self):
+        """ **returns** the spatial shape (x, y, z) covered by the blocks """
+        return tuple(int(e) for e in self.ends[:, 1:4].max(axis=0))
+
+    def getBlocks(self, timeframe, begin, end):
+        """ **returns** the indices of all blocks that overlap the spatial region `[begin, end)` of frame `timeframe` """
+        candidates = self._blocksPerFrame.get(timeframe, np.zeros(0, dtype=np.int64))
+        overlaps = np.logical_and(np.all(self.begins[candidates, 1:4] < end, axis=1),
+                                  np.all(self.ends[candidates, 1:4] > begin, axis=1))
+        return candidates[overlaps]
+
+    def readRegion(self, group, timeframe, begin, end):
+        """
+        Assemble the spatial region `[begin, end)` of frame `timeframe` from the blocks overlapping it,
+        reading only the overlapping part of each block. Voxels that are not covered by any block are zero.
+
+        **returns** the region as array of shape `end - begin` (x, y, z)
+        """
+        begin = np.array(begin, dtype=np.int64)
+        end = np.array(end, dtype=np.int64)
+        blocks = self.getBlocks(timeframe, begin, end)
+        assert len(blocks) > 0, "No block contains frame {}".format(timeframe)
+        region = None
+        for i in blocks:
+            dataset = group[self.names[i]]
+            if region is None:
+                region = np.zeros(end - begin, dtype=dataset.dtype)
+            overlapBegin = np.maximum(begin, self.begins[i, 1:4])
+            overlapEnd = np.minimum(end, self.ends[i, 1:4])
+            blockSlicing = tuple(slice(b, e) for b, e in zip(overlapBegin - self.begins[i, 1:4], overlapEnd - self.begins[i, 1:4]))
+            regionSlicing = tuple(slice(b, e) for b, e in zip(overlapBegin - begin, overlapEnd - begin))
+            t = timeframe - self.begins[i, 0]
+            region[regionSlicing] = dataset[(slice(t, t + 1),) + blockSlicing + (0,)][0]
+        return region
+
+
+class StreamingLabelImageExport(object):
+    """
+    Writes label images frame by frame into one open HDF5 file. Each frame is split into tiles (see `getDefaultChunks`),
+    which are compressed in parallel background threads (zlib releases the GIL) while the caller prepares the next frame,
+    and then written directly as gzip compressed chunks into the pre-created dataset.
+
+    For `LabelImage_v2` paths, all frames go into one block covering the whole `timeRange`,
+    otherwise every frame gets its own dataset at the path expected by `LocalImageLoader.getLabelImageForFrame`.
+    """
+
+    # gzip level that h5py uses by default
+    compressionLevel = 4
+
+    def __init__(self, Resource, PathInResource, timeRange, numThreads=4, maxPendingFrames=4):
+        if not (PathInResource.count('%') == 5 or 'LabelImage_v2' in PathInResource):
+            raise ValueError("Invalid PathInResource: {}".format(PathInResource))
+        h5FilePool.release(Resource)
+        self._h5file = h5py.File(Resource, 'a')
+        self._pathInResource = PathInResource
+        self._timeRange = timeRange
+        self._shape = None
+        self._chunks = None
+        self._block = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=numThreads)
+        self._maxPendingFrames = maxPendingFrames
+        self._pending = []
+
+    def _getDataset(self, timeframe):
+        """ dataset and chunk offset at which the given frame is stored, datasets are created on demand """
+        if 'LabelImage_v2' in self._pathInResource:
+            if self._block is None:
+                numFrames = self._timeRange[1] - self._timeRange[0]
+                self._block = self._h5file.create_dataset('/'.join([self._pathInResource, 'block0000']),
+                                                          shape=(numFrames,) + self._shape + (1,),
+                                                          chunks=self._chunks, dtype='<u2', compression='gzip')
+                self._block.attrs['blockSlice'] = "[{}:{},{}:{},{}:{},{}:{},{}:{}]".format(
+                    self._timeRange[0], self._timeRange[1], 0, self._shape[0], 0, self._shape[1], 0, self._shape[2], 0, 1)
+            return self._block, (timeframe - self._timeRange[0], 0, 0, 0, 0)
+        else:
+            internalPath = self._pathInResource % (timeframe, timeframe + 1, self._shape[0], self._shape[1], self._shape[2])
+            dataset = self._h5file.create_dataset(internalPath, shape=(1,) + self._shape + (1,), chunks=self._chunks,
+                                                  dtype='<u2', compression='gzip')
+            return dataset, (0, 0, 0, 0, 0)
+
+    def _compressTile(self, data, tileBegin):
+        """ compress the tile of the frame `data` starting at `tileBegin`, tiles at the border are padded with zeros """
+        tileShape = self._chunks[1:4]
+        tile = data[tuple(slice(b, b + s) for b, s in zip(tileBegin, tileShape))]
+        if tile.shape != tileShape:
+            padded = np.zeros(tileShape, dtype=data.dtype)
+            padded[tuple(slice(0, s) for s in tile.shape)] = tile
+            tile = padded
+        return zlib.compress(np.ascontiguousarray(tile).tobytes(), self.compressionLevel)
+
+    def _writeOldestFrame(self):
+        timeframe, jobs = self._pending.pop(0)
+        dataset, offset = self._getDataset(timeframe)
+        for tileBegin, job in jobs:
+            dataset.id.write_direct_chunk((offset[0],) + tileBegin + (0,), job.result())
+
+    def write(self, labelimage, timeframe):
+        """ queue the label image of the given frame for compression, and write frames whose compression has finished """
+        if len(labelimage.shape) == 2:
+            labelimage = labelimage[:, :, np.newaxis]
+        elif len(labelimage.shape) != 3:
+            raise NotImplementedError()
+        if self._shape is None:
+            self._shape = labelimage.shape
+            self._chunks = getDefaultChunks((1,) + self._shape + (1,), 'txyzc')
+        assert(labelimage.shape == self._shape)
+
+        # saturate like HDF5 does when converting to the 16 bit dataset type
+        data = np.minimum(labelimage, np.iinfo(np.uint16).max).astype('<u2')
+        tileBegins = itertools.product(*[range(0, s, c) for s, c in zip(self._shape, self._chunks[1:4])])
+        self._pending.append((timeframe, [(tileBegin, self._executor.submit(self._compressTile, data, tileBegin))
+                                          for tileBegin in tileBegins]))
+        while len(self._pending) > self._maxPendingFrames or (len(self._pending) > 0 and all(job.done() for _, job in self._pending[0][1])):
+            self._writeOldestFrame()
+
+    def close(self):
+        """ write all remaining frames and close the file """
+        try:
+            while len(self._pending) > 0:
+                self._writeOldestFrame()
+        finally:
+            self._executor.shutdown()
+            self._h5file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 
 class LocalImageLoader(image_provider_plugin.ImageProviderPlugin):
     """
@@ -19,12 +259,32 @@ class LocalImageLoader(image_provider_plugin.ImageProviderPlugin):
         Return numpy array of image data at timeframe.
         """
         logging.getLogger("LocalImageLoader").debug("opening {}".format(Resource))
-        with h5py.File(Resource, 'r') as rawH5:
-            logging.getLogger("LocalImageLoader").debug("PathInResource {}".format(timeframe))
-            rawImage = rawH5[PathInResource][hytra.util.axesconversion.getFrameSlicing(axes, timeframe)]
-            remainingAxes = axes.replace('t', '')
-            rawImage = hytra.util.axesconversion.adjustOrder(rawImage, remainingAxes).squeeze()
-            return rawImage
+        rawH5 = h5FilePool.get(Resource)
+        logging.getLogger("LocalImageLoader").debug("PathInResource {}".format(timeframe))
+        rawImage = rawH5[PathInResource][hytra.util.axesconversion.getFrameSlicing(axes, timeframe)]
+        remainingAxes = axes.replace('t', '')
+        rawImage = hytra.util.axesconversion.adjustOrder(rawImage, remainingAxes).squeeze()
+        return rawImage
+
+    def getImageDataRegion(self, Resource, PathInResource, axes, timeframe, offset, shape):
+        """
+        Loads the part of the image data at `timeframe` that starts at `offset` and has the given `shape`,
+        where `offset` and `shape` have one entry per spatial axis (x, y and optionally z).
+        Only the hyperslab of the region is read from the file, channels are kept.
+
+        Return numpy array of the given shape (plus the channel axis if there is more than one channel).
+        """
+        regionSlicing = {'t': timeframe}
+        for axis, o, s in zip('xyz', offset, shape):
+            regionSlicing[axis] = slice(o, o + s)
+        rawH5 = h5FilePool.get(Resource)
+        rawRegion = rawH5[PathInResource][tuple(regionSlicing.get(a, slice(None)) for a in axes)]
+        # convert to xyzc, axes missing in the file get size one
+        rawRegion = hytra.util.axesconversion.adjustOrder(rawRegion, axes.replace('t', ''), 'xyzc')
+        rawRegion = rawRegion[(slice(None),) * len(shape) + (0,) * (3 - len(shape))]
+        if rawRegion.shape[-1] == 1:
+            rawRegion = rawRegion[..., 0]
+        return rawRegion
 
     def getLabelImageForFrame(self, Resource, PathInResource, timeframe):
         """
@@ -38,30 +298,47 @@ class LocalImageLoader(image_provider_plugin.ImageProviderPlugin):
 
         if (self.shape == None):
             self.getImageShape(Resource, PathInResource)
+        return self.getLabelImageRegion(Resource, PathInResource, timeframe, (0, 0, 0), self.shape).squeeze()
 
-        with h5py.File(Resource, 'r') as h5file:
-            if PathInResource.count('%') == 5 and not 'LabelImage_v2' in PathInResource:
-                internalPath = PathInResource % (timeframe, timeframe + 1, self.shape[0], self.shape[1], self.shape[2])
-                logging.getLogger("LocalImageLoader").debug("Opening label image at {}".format(internalPath))
-                labelImage = h5file[internalPath][0, ..., 0]
-            elif 'LabelImage_v2' in PathInResource:
-                # loop though all blocks in h5 file and read the blockshape, and figure out whether this frame is in there.
-                labelImage = None
-                for block in h5file[PathInResource].values():
-                    assert 'blockSlice' in block.attrs
-                    blockSlice = block.attrs['blockSlice']
-                    bs = blockSlice[1:-1]
-                    roi = [(int(r.split(':')[0]), int(r.split(':')[1])) for r in bs.split(',')]
-                    if timeframe in range(roi[0][0], roi[0][1]):
-                        timeStart = timeframe - roi[0][0]
-                        # WARNING we assume that every block captures the full image extent or more timeframes, 
-                        # which might not always be true (are 3D frames separated into multiple blocks?)
-                        labelImage = block[timeStart:timeStart+1, ..., 0]
-                        break
-                assert labelImage is not None
-            else:
-                raise ValueError("Invalid PathInResource: {}".format(PathInResource))
-            return labelImage.squeeze().astype(np.uint32)
+    def _getBlockIndex(self, Resource, PathInResource):
+        """
+        **returns** the `LabelImageBlockIndex` of a `LabelImage_v2` group,
+        which is built once per file and group and cached while the file stays unchanged
+        """
+        cache = h5FilePool.getCache(Resource)
+        groupPath = PathInResource.rstrip('/')
+        if ('blockIndex', groupPath) not in cache:
+            logging.getLogger("LocalImageLoader").debug("Building block index of {}".format(groupPath))
+            cache[('blockIndex', groupPath)] = LabelImageBlockIndex(h5FilePool.get(Resource)[groupPath])
+        return cache[('blockIndex', groupPath)]
+
+    def getLabelImageRegion(self, Resource, PathInResource, timeframe, offset, shape):
+        """
+        Loads the part of the label image of `timeframe` that starts at `offset` and has the given `shape`,
+        where `offset` and `shape` have one entry per spatial axis (x, y and optionally z).
+        Only the voxels within the region are read from the file.
+        See `getLabelImageForFrame` for the supported `PathInResource` styles.
+
+        Return numpy array of the given shape.
+        """
+        if (self.shape == None):
+            self.getImageShape(Resource, PathInResource)
+        begin = np.zeros(3, dtype=np.int64)
+        end = np.ones(3, dtype=np.int64)
+        begin[:len(offset)] = offset
+        end[:len(shape)] = np.array(offset) + np.array(shape)
+
+        h5file = h5FilePool.get(Resource)
+        if PathInResource.count('%') == 5 and not 'LabelImage_v2' in PathInResource:
+            internalPath = PathInResource % (timeframe, timeframe + 1, self.shape[0], self.shape[1], self.shape[2])
+            logging.getLogger("LocalImageLoader").debug("Opening label image at {}".format(internalPath))
+            labelImage = h5file[internalPath][(0,) + tuple(slice(b, e) for b, e in zip(begin, end)) + (0,)]
+        elif 'LabelImage_v2' in PathInResource:
+            blockIndex = self._getBlockIndex(Resource, PathInResource)
+            labelImage = blockIndex.readRegion(h5file[PathInResource.rstrip('/')], timeframe, begin, end)
+        else:
+            raise ValueError("Invalid PathInResource: {}".format(PathInResource))
+        return labelImage.reshape(tuple(shape)).astype(np.uint32)
 
     def getImageShape(self, Resource, PathInResource):
         """
@@ -72,10 +349,13 @@ class LocalImageLoader(image_provider_plugin.ImageProviderPlugin):
 
         Works with both `PathInResource` styles: LabelImage and LabelImage_v2
         """
-        with h5py.File(Resource, 'r') as h5file:
+        if 'LabelImage_v2' in PathInResource:
+            shape = self._getBlockIndex(Resource, PathInResource).getShape()
+        else:
+            h5file = h5FilePool.get(Resource)
             shape = h5file['/'.join(PathInResource.split('/')[:-1])].values()[0].shape[1:4]
-            self.shape = shape
-            return shape
+        self.shape = shape
+        return shape
 
 
     def getTimeRange(self, Resource, PathInResource):
@@ -85,14 +365,30 @@ class LocalImageLoader(image_provider_plugin.ImageProviderPlugin):
         PathInResource provides the internal image path
         Return tuple of (first frame, last frame)
         """
-        with h5py.File(Resource, 'r') as h5file:
-            maxTime = len(h5file['/'.join(PathInResource.split('/')[:-1])].keys())
-            return (0, maxTime)
+        if 'LabelImage_v2' in PathInResource:
+            # blocks may contain several frames
+            return (0, self._getBlockIndex(Resource, PathInResource).getTimeRange()[1])
+        h5file = h5FilePool.get(Resource)
+        maxTime = len(h5file['/'.join(PathInResource.split('/')[:-1])].keys())
+        return (0, maxTime)
+
+    def getImageDataTimeRange(self, Resource, PathInResource, axes):
+        """
+        Return tuple of (first frame, last frame) of the image data, from the length of its time axis
+        """
+        return (0, h5FilePool.get(Resource)[PathInResource].shape[axes.index('t')])
+
+    def releaseResource(self, Resource):
+        """
+        close the cached handle to `Resource`, such that it can be overwritten
+        """
+        h5FilePool.release(Resource)
 
     def exportLabelImage(self, labelimage, timeframe, Resource, PathInResource):
         """
         export labelimage of timeframe
         """
+        h5FilePool.release(Resource)
         with h5py.File(Resource, 'r+') as h5file:
             if PathInResource.count('%') == 5 and not 'LabelImage_v2' in PathInResource:
                 internalPath = PathInResource % (timeframe, timeframe + 1, self.shape[0], self.shape[1], self.shape[2])
@@ -120,3 +416,10 @@ class LocalImageLoader(image_provider_plugin.ImageProviderPlugin):
             
             if blockSlice is not None:
                 h5file[internalPath].attrs['blockSlice'] = blockSlice
+
+    def openLabelImageExport(self, Resource, PathInResource, timeRange):
+        """
+        Prepare the export of the label images of all frames in `timeRange` (first frame, last frame + 1)
+        into one open file, see `StreamingLabelImageExport`
+        """
+        return StreamingLabelImageExport(Resource, PathInResource, timeRange)
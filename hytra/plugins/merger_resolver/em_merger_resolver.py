@@ -0,0 +1,185 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+from hytra.pluginsystem import merger_resolver_plugin
+import numpy as np
+
+
+class EMMergerResolver(merger_resolver_plugin.MergerResolverPlugin):
+    """
+    Fits Gaussian mixtures with diagonal covariances to the pixel coordinates of mergers using a vectorized EM,
+    which is much faster than sklearn for the small problems we have here, and can fit all mergers of a frame at once.
+
+    The components are initialized at the centers of the fits of the predecessors where these are known,
+    the remaining ones are drawn with a fixed random seed, so the results are reproducible.
+    The fits have the same format `(weight, variances, mean)` as the ones of the `GMMMergerResolver`.
+    """
+
+    randomSeed = 42
+    maxIterations = 100
+    # stop when the mean log likelihood per pixel of every merger changes less than this
+    tolerance = 1e-4
+    # lower bound for the variances, prevents components from collapsing onto single pixels
+    minVariance = 0.1
+
+    def _initialize(self, coordinates, mergerCount, initializations, randomState):
+        """
+        Place the initial means at the centers of those `initializations` that are closest to the object,
+        and choose the remaining ones k-means++ style among the pixels.
+
+        **returns** the initial weights, means and variances
+        """
+        centroid = coordinates.mean(axis=0)
+        means = []
+        if initializations is not None and len(initializations) > 0:
+            centers = [np.array(i[2], dtype=np.float64) for i in initializations]
+            centers = [c for c in centers if c.shape == centroid.shape]
+            centers.sort(key=lambda c: np.linalg.norm(c - centroid))
+            means = centers[:mergerCount]
+
+        while len(means) < mergerCount:
+            if len(means) == 0:
+                means.append(coordinates[randomState.randint(len(coordinates))].astype(np.float64))
+            else:
+                sqDistances = np.min([((coordinates - m)**2).sum(axis=1) for m in means], axis=0)
+                if sqDistances.sum() > 0:
+                    index = randomState.choice(len(coordinates), p=sqDistances / sqDistances.sum())
+                else:
+                    index = randomState.randint(len(coordinates))
+                means.append(coordinates[index].astype(np.float64))
+
+        variances = np.tile(coordinates.var(axis=0) / mergerCount + self.minVariance, (mergerCount, 1))
+        weights = np.ones(mergerCount) / mergerCount
+        return weights, np.array(means), variances
+
+    def _logProbabilities(self, coordinates, owner, logWeights, means, variances):
+        """
+        Log of weight times gaussian density of every pixel (rows) for all components (columns) of the merger it belongs to
+        """
+        diff = coordinates[:, np.newaxis, :] - means[owner]
+        var = variances[owner]
+        return logWeights[owner] - 0.5 * (np.log(2.0 * np.pi * var) + diff**2 / var).sum(axis=2)
+
+    def _fitBatch(self, coordinatesList, mergerCounts, initializationsList):
+        """
+        Run EM for all mergers at once. The components of all mergers are stored in arrays padded to the
+        maximum count, the padding gets a weight of zero.
+
+        **returns** a list of fitted objects per merger
+        """
+        randomState = np.random.RandomState(self.randomSeed)
+        numMergers = len(coordinatesList)
+        numComponents = max(mergerCounts)
+        ndims = coordinatesList[0].shape[1]
+
+        coordinates = np.vstack(coordinatesList).astype(np.float64)
+        owner = np.repeat(np.arange(numMergers), [len(c) for c in coordinatesList])
+        pixelsPerMerger = np.bincount(owner, minlength=numMergers).astype(np.float64)
+
+        weights = np.zeros((numMergers, numComponents))
+        means = np.zeros((numMergers, numComponents, ndims))
+        variances = np.ones((numMergers, numComponents, ndims))
+        for m, (c, count, initializations) in enumerate(zip(coordinatesList, mergerCounts, initializationsList)):
+            weights[m, :count], means[m, :count], variances[m, :count] = self._initialize(
+                c.astype(np.float64), count, initializations, randomState)
+        valid = weights > 0
+
+        # index of (merger, component) for every entry of the responsibilities matrix
+        flatIndex = (owner[:, np.newaxis] * numComponents + np.arange(numComponents)).ravel()
+        def sumPerComponent(values):
+            return np.bincount(flatIndex, weights=values.ravel(), minlength=numMergers * numComponents).reshape(numMergers, numComponents)
+
+        previousLogLikelihood = None
+        for _ in range(self.maxIterations):
+            # E-step
+            with np.errstate(divide='ignore'):
+                logWeights = np.log(weights)
+            logProbs = self._logProbabilities(coordinates, owner, logWeights, means, variances)
+            maxLogProbs = logProbs.max(axis=1, keepdims=True)
+            probs = np.exp(logProbs - maxLogProbs)
+            normalization = probs.sum(axis=1, keepdims=True)
+            responsibilities = probs / normalization
+
+            logLikelihood = np.bincount(owner, weights=(np.log(normalization) + maxLogProbs).ravel(), minlength=numMergers) / pixelsPerMerger
+            if previousLogLikelihood is not None and np.all(np.abs(logLikelihood - previousLogLikelihood) < self.tolerance):
+                break
+            previousLogLikelihood = logLikelihood
+
+            # M-step, components without any responsibility keep their previous parameters
+            componentSizes = sumPerComponent(responsibilities)
+            updated = np.logical_and(valid, componentSizes > 0)
+            safeSizes = np.where(updated, componentSizes, 1.0)
+            newMeans = np.zeros_like(means)
+            newVariances = np.zeros_like(variances)
+            for d in range(ndims):
+                newMeans[..., d] = sumPerComponent(responsibilities * coordinates[:, d:d + 1]) / safeSizes
+                newVariances[..., d] = sumPerComponent(responsibilities * coordinates[:, d:d + 1]**2) / safeSizes - newMeans[..., d]**2
+            means[updated] = newMeans[updated]
+            variances[updated] = np.maximum(newVariances[updated], self.minVariance)
+            weights = np.where(valid, componentSizes / pixelsPerMerger[:, np.newaxis], 0.0)
+
+        return [list(zip(weights[m, :count], variances[m, :count], means[m, :count])) for m, count in enumerate(mergerCounts)]
+
+    def resolveMergersForCoords(self, coordinatesList, mergerCounts, initializationsList):
+        """
+        Fit all given objects of one frame together, see `resolveMergerForCoords`.
+
+        **returns** a list of the lists of fitted objects
+        """
+        if len(coordinatesList) == 0:
+            return []
+        return self._fitBatch(coordinatesList, mergerCounts, initializationsList)
+
+    def resolveMergerForCoords(self, coordinates, mergerCount, initializations=None):
+        """
+        Resolve the pixel coordinates belonging to an object ID, into `mergerCount`
+        new segments by fitting some kind of model. The `initializations` provide fits
+        in the preceding frame of all possible incomings (list may be empty, but could
+        also be more than `mergerCount`).
+
+        `coordinates` pixel coordinates that belong to a merger ID in labelImage
+
+        `mergerCount` number of gaussians to fit
+
+        **returns** a list of fitted objects
+        """
+        return self._fitBatch([coordinates], [mergerCount], [initializations])[0]
+
+    def resolveMerger(self, labelImage, objectId, nextId, mergerCount, initializations=None, offset=None):
+        """
+        Resolve the object with the ID `objectId` in the `labelImage` into `mergerCount`
+        new segments by fitting some kind of model. The `initializations` provide fits
+        in the preceding frame of all possible incomings (list may be empty, but could
+        also be more than `mergerCount`).
+
+        `labelImage` can be a cutout of the full frame (e.g. the bounding box of the object),
+        then `offset` is the position of the cutout in the frame, such that the fits are in frame coordinates.
+
+        `labelImage` is used read-only, use `updateLabelImage` to refine the segmentation
+
+        **returns** a list of fitted objects
+        """
+        coordinates = np.transpose(np.vstack(np.where(labelImage == objectId)))
+        if offset is not None:
+            assert(coordinates.shape[1] == len(offset))
+            coordinates = coordinates + offset
+        return self.resolveMergerForCoords(coordinates, mergerCount, initializations)
+
+    def updateLabelImage(self, labelImage, objectId, fits, newIds, offset=None):
+        """
+        Resolve the object with the ID `objectId` in the `labelImage` into the fitted models with the given new IDs.
+        `labelImage` should be updated by replacing all pixels that were labelled with `objectId`
+        to get a new Id depending on the fit.
+        """
+        if len(fits) > 1:
+            assert(len(fits) == len(newIds))
+            # edit labelimage in-place
+            mask = labelImage == objectId
+            coordinates = np.transpose(np.vstack(np.where(mask))).astype(np.float64)
+            if offset is not None:
+                assert(coordinates.shape[1] == len(offset))
+                coordinates = coordinates + offset
+            logWeights = np.log(np.array([[f[0] for f in fits]]))
+            means = np.array([[f[2] for f in fits]], dtype=np.float64)
+            variances = np.array([[f[1] for f in fits]], dtype=np.float64)
+            owner = np.zeros(len(coordinates), dtype=np.int64)
+            responsibilities = self._logProbabilities(coordinates, owner, logWeights, means, variances).argmax(axis=1)
+            labelImage[mask] = np.array(newIds)[responsibilities]
@@ -43,12 +43,15 @@ class GMMMergerResolver(merger_resolver_plugin.MergerResolverPlugin):
         return self.getObjectInitializationList(gmm)
 
 
-    def resolveMerger(self, labelImage, objectId, nextId, mergerCount, initializations=None):
+    def resolveMerger(self, labelImage, objectId, nextId, mergerCount, initializations=None, offset=None):
         """
         Resolve the object with the ID `objectId` in the `labelImage` into `mergerCount`
         new segments by fitting some kind of model. The `initializations` provide fits
         in the preceding frame of all possible incomings (list may be empty, but could
         also be more than `mergerCount`).
+
+        `labelImage` can be a cutout of the full frame (e.g. the bounding box of the object),
+        then `offset` is the position of the cutout in the frame, such that the fits are in frame coordinates.
   
         `labelImage` is used read-only, use `updateLabelImage` to refine the segmentation
   
@@ -57,6 +60,9 @@ class GMMMergerResolver(merger_resolver_plugin.MergerResolverPlugin):
   
         # fit GMM to label image data
         coordinates = np.transpose(np.vstack(np.where(labelImage == objectId)))
+        if offset is not None:
+            assert(coordinates.shape[1] == len(offset))
+            coordinates = coordinates + offset
         gmm = self.initGMM(mergerCount, initializations)
         gmm.fit(coordinates)
         assert(gmm.converged_)
@@ -73,7 +79,8 @@ class GMMMergerResolver(merger_resolver_plugin.MergerResolverPlugin):
         if len(fits) > 1:
             assert(len(fits) == len(newIds))
             # edit labelimage in-place
-            coordinates = np.transpose(np.vstack(np.where(labelImage == objectId)))
+            mask = labelImage == objectId
+            coordinates = np.transpose(np.vstack(np.where(mask)))
             if offset is not None:
                 assert(coordinates.shape[1] == len(offset))
                 coordinates = coordinates + offset
@@ -81,4 +88,4 @@ class GMMMergerResolver(merger_resolver_plugin.MergerResolverPlugin):
             responsibilities = gmm.predict(coordinates)
             newIds = np.array(newIds)
             newObjectIds = newIds[responsibilities]
-            labelImage[labelImage == objectId] = newObjectIds
\ No newline at end of file
+            labelImage[mask] = newObjectIds
\ No newline at end of file
@@ -1,5 +1,6 @@
 from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
 from hytra.pluginsystem import transition_feature_vector_construction_plugin
+from hytra.pluginsystem.transition_feature_vector_construction_plugin import asFeatureMatrix, getNumTransitions
 import numpy as np
 
 
@@ -15,6 +16,15 @@ class TransitionFeaturesDistance(transition_feature_vector_construction_plugin.T
                     np.linalg.norm(featureDictObjectA[key] * featureDictObjectB[key])]
         return []
 
+    def constructFeatureMatrix(self, featureDictObjectsA, featureDictObjectsB, selectedFeatures):
+        key = 'RegionCenter'
+        if key in selectedFeatures:
+            a = asFeatureMatrix(featureDictObjectsA[key])
+            b = asFeatureMatrix(featureDictObjectsB[key])
+            return np.column_stack([np.linalg.norm(a - b, axis=1),
+                                    np.linalg.norm(a * b, axis=1)])
+        return np.zeros((getNumTransitions(featureDictObjectsA), 0))
+
     def getFeatureNames(self, featureDictObjectA, featureDictObjectB, selectedFeatures):
         key = 'RegionCenter'
         if key in selectedFeatures:
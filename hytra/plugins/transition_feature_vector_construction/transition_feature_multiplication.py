@@ -1,7 +1,7 @@
 from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
 from hytra.pluginsystem import transition_feature_vector_construction_plugin
+from hytra.pluginsystem.transition_feature_vector_construction_plugin import asFeatureMatrix, getNumTransitions
 import numpy as np
-from compiler.ast import flatten
 
 
 class TransitionFeaturesMultiplication(transition_feature_vector_construction_plugin.TransitionFeatureVectorConstructionPlugin):
@@ -24,14 +24,41 @@ class TransitionFeaturesMultiplication(transition_feature_vector_construction_pl
                 if not isinstance(featureDictObjectA[key], np.ndarray) or featureDictObjectA[key].size == 1:
                     features.append(float(featureDictObjectA[key]) * float(featureDictObjectB[key]))
                 else:
-                    features.extend(flatten((featureDictObjectA[key].astype('float32') \
-                                     * featureDictObjectB[key].astype('float32')).tolist()))
+                    features.extend((featureDictObjectA[key].astype('float32') \
+                                     * featureDictObjectB[key].astype('float32')).ravel().tolist())
 
         # there should be no nans or infs
         assert (np.all(np.isfinite(np.array(features))))
 
         return features
 
+    def constructFeatureMatrix(self, featureDictObjectsA, featureDictObjectsB, selectedFeatures):
+        assert ("Global<Maximum >" not in selectedFeatures)
+        assert ("Global<Minimum >" not in selectedFeatures)
+        assert ("Histrogram" not in selectedFeatures)
+        assert ("Polygon" not in selectedFeatures)
+
+        features = [np.zeros((getNumTransitions(featureDictObjectsA), 0))]
+
+        for key in selectedFeatures:
+            if key == 'RegionCenter':
+                continue
+            else:
+                a = asFeatureMatrix(featureDictObjectsA[key])
+                b = asFeatureMatrix(featureDictObjectsB[key])
+                if a.shape[1] == 1:
+                    features.append(a.astype('float64') * b.astype('float64'))
+                else:
+                    # same precision as for single transitions
+                    features.append((a.astype('float32') * b.astype('float32')).astype('float64'))
+
+        features = np.hstack(features)
+
+        # there should be no nans or infs
+        assert (np.all(np.isfinite(features)))
+
+        return features
+
     def getFeatureNames(self, featureDictObjectA, featureDictObjectB, selectedFeatures):
         assert ("Global<Maximum >" not in selectedFeatures)
         assert ("Global<Minimum >" not in selectedFeatures)
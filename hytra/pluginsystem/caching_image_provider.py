@@ -0,0 +1,235 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import logging
+import threading
+import collections
+import concurrent.futures
+from hytra.pluginsystem.image_provider_plugin import cropRegion
+
+
+def getLogger():
+    ''' logger to be used in this module '''
+    return logging.getLogger(__name__)
+
+
+class CachingImageProvider(object):
+    """
+    Wraps any image provider plugin and keeps recently read frames in memory.
+
+    The cache holds at most `maxCacheBytes` of decoded frames and evicts the least recently used ones.
+    Whenever frame `t` is requested, a background thread starts reading the frames `t+1, ..., t+readAhead`
+    of the same image (up to its last frame), so that decoding the next frames overlaps with processing the current one.
+    Images whose frames are larger than the whole cache are neither cached nor read ahead.
+
+    The returned arrays are copies, so callers can modify them in place without spoiling the cache.
+    All other methods and attributes are forwarded to the wrapped plugin.
+
+    Usage:
+
+        imageProvider = CachingImageProvider(pluginManager.getImageProvider())
+        for t in range(*imageProvider.getTimeRange(filename, path)):
+            labelImage = imageProvider.getLabelImageForFrame(filename, path, t)
+    """
+
+    def __init__(self, imageProvider, maxCacheBytes=512 * 2**20, readAhead=2):
+        self._imageProvider = imageProvider
+        self._maxCacheBytes = maxCacheBytes
+        self._readAhead = readAhead
+        self._initializeCache()
+
+    def _initializeCache(self):
+        self._lock = threading.RLock()
+        self._frames = collections.OrderedDict()
+        self._cachedBytes = 0
+        self._pending = {}
+        self._timeRanges = {}
+        # images (keys without the frame) whose frames are too large to be cached
+        self._uncachedImages = set()
+        self._executor = None
+
+    def __getstate__(self):
+        '''
+        Exclude the cached frames, the lock and the read-ahead thread from being pickled,
+        e.g. when the image provider is sent to worker processes.
+        '''
+        return {'_imageProvider': self._imageProvider,
+                '_maxCacheBytes': self._maxCacheBytes,
+                '_readAhead': self._readAhead}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._initializeCache()
+
+    def __getattr__(self, name):
+        # only called for attributes that are not found on the wrapper itself
+        if name.startswith('__') or name == '_imageProvider':
+            raise AttributeError(name)
+        return getattr(self._imageProvider, name)
+
+    def _getExecutor(self):
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        return self._executor
+
+    def _readFrame(self, key):
+        ''' read the frame described by `key` from the wrapped plugin '''
+        if key[0] == 'label':
+            _, Resource, PathInResource, timeframe = key
+            return self._imageProvider.getLabelImageForFrame(Resource, PathInResource, timeframe)
+        else:
+            _, Resource, PathInResource, axes, timeframe = key
+            return self._imageProvider.getImageDataAtTimeFrame(Resource, PathInResource, axes, timeframe)
+
+    def _storeFrame(self, key, frame):
+        with self._lock:
+            if frame.nbytes > self._maxCacheBytes:
+                self._uncachedImages.add(key[:-1])
+                return
+            if key in self._frames:
+                return
+            self._frames[key] = frame
+            self._cachedBytes += frame.nbytes
+            while self._cachedBytes > self._maxCacheBytes:
+                _, evicted = self._frames.popitem(last=False)
+                self._cachedBytes -= evicted.nbytes
+
+    def _prefetch(self, key):
+        ''' read a frame in the background thread, errors are ignored as the frame might not exist '''
+        try:
+            self._storeFrame(key, self._readFrame(key))
+        except Exception as e:
+            getLogger().debug("Could not read ahead {}: {}".format(key, e))
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _scheduleReadAhead(self, key, lastFrame):
+        ''' queue the `readAhead` frames following the one described by `key` '''
+        with self._lock:
+            if key[:-1] in self._uncachedImages:
+                # the frames read ahead would be dropped right away
+                return
+            for t in range(key[-1] + 1, key[-1] + 1 + self._readAhead):
+                if lastFrame is not None and t >= lastFrame:
+                    break
+                nextKey = key[:-1] + (t,)
+                if nextKey not in self._frames and nextKey not in self._pending:
+                    self._pending[nextKey] = self._getExecutor().submit(self._prefetch, nextKey)
+
+    def _getFrame(self, key, lastFrame=None):
+        with self._lock:
+            future = self._pending.get(key)
+        if future is not None:
+            # the frame is being read ahead right now
+            future.result()
+
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.pop(key)
+                self._frames[key] = frame
+
+        if frame is None:
+            frame = self._readFrame(key)
+            self._storeFrame(key, frame)
+
+        if self._readAhead > 0:
+            self._scheduleReadAhead(key, lastFrame)
+        return frame.copy()
+
+    def getImageDataAtTimeFrame(self, Resource, PathInResource, axes, timeframe):
+        """
+        Return numpy array of image data at timeframe, see `ImageProviderPlugin.getImageDataAtTimeFrame`
+        """
+        lastFrame = self._getImageDataTimeRange(Resource, PathInResource, axes)[1]
+        return self._getFrame(('raw', Resource, PathInResource, axes, timeframe), lastFrame)
+
+    def getLabelImageForFrame(self, Resource, PathInResource, timeframe):
+        """
+        Return numpy array of the label image at timeframe, see `ImageProviderPlugin.getLabelImageForFrame`
+        """
+        lastFrame = self.getTimeRange(Resource, PathInResource)[1]
+        return self._getFrame(('label', Resource, PathInResource, timeframe), lastFrame)
+
+    def _getCachedFrame(self, key):
+        with self._lock:
+            return self._frames.get(key)
+
+    def getImageDataRegion(self, Resource, PathInResource, axes, timeframe, offset, shape):
+        """
+        Crop the region from the cached frame if available, otherwise only read the region from the wrapped plugin.
+        Regions are not cached.
+        """
+        frame = self._getCachedFrame(('raw', Resource, PathInResource, axes, timeframe))
+        if frame is not None:
+            return cropRegion(frame, offset, shape).copy()
+        return self._imageProvider.getImageDataRegion(Resource, PathInResource, axes, timeframe, offset, shape)
+
+    def getLabelImageRegion(self, Resource, PathInResource, timeframe, offset, shape):
+        """
+        Crop the region from the cached frame if available, otherwise only read the region from the wrapped plugin.
+        Regions are not cached.
+        """
+        frame = self._getCachedFrame(('label', Resource, PathInResource, timeframe))
+        if frame is not None:
+            return cropRegion(frame, offset, shape).copy()
+        return self._imageProvider.getLabelImageRegion(Resource, PathInResource, timeframe, offset, shape)
+
+    def getTimeRange(self, Resource, PathInResource):
+        """
+        Return tuple of (first frame, last frame), see `ImageProviderPlugin.getTimeRange`
+        """
+        key = (Resource, PathInResource)
+        if key not in self._timeRanges:
+            self._timeRanges[key] = self._imageProvider.getTimeRange(Resource, PathInResource)
+        return self._timeRanges[key]
+
+    def _getImageDataTimeRange(self, Resource, PathInResource, axes):
+        """
+        Return tuple of (first frame, last frame) of the image data, or `(None, None)` if the wrapped plugin cannot tell
+        """
+        key = (Resource, PathInResource, axes)
+        if key not in self._timeRanges:
+            try:
+                self._timeRanges[key] = self._imageProvider.getImageDataTimeRange(Resource, PathInResource, axes)
+            except NotImplementedError:
+                self._timeRanges[key] = (None, None)
+        return self._timeRanges[key]
+
+    def releaseResource(self, Resource):
+        """
+        Drop all cached frames of `Resource` and release it in the wrapped plugin, e.g. before it is overwritten
+        """
+        with self._lock:
+            pending = [f for k, f in self._pending.items() if k[1] == Resource]
+        for future in pending:
+            future.result()
+
+        with self._lock:
+            for key in [k for k in self._frames.keys() if k[1] == Resource]:
+                self._cachedBytes -= self._frames.pop(key).nbytes
+            for key in [k for k in self._timeRanges.keys() if k[0] == Resource]:
+                del self._timeRanges[key]
+            self._uncachedImages = set(k for k in self._uncachedImages if k[1] != Resource)
+        self._imageProvider.releaseResource(Resource)
+
+    def exportLabelImage(self, labelimage, timeframe, Resource, PathInResource):
+        """
+        export labelimage of timeframe, see `ImageProviderPlugin.exportLabelImage`
+        """
+        self.releaseResource(Resource)
+        self._imageProvider.exportLabelImage(labelimage, timeframe, Resource, PathInResource)
+
+    def openLabelImageExport(self, Resource, PathInResource, timeRange):
+        """
+        Prepare the export of label images, see `ImageProviderPlugin.openLabelImageExport`
+        """
+        self.releaseResource(Resource)
+        return self._imageProvider.openLabelImageExport(Resource, PathInResource, timeRange)
+
+    def close(self):
+        """
+        Stop the read-ahead thread and drop all cached frames
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+        self._initializeCache()
@@ -17,6 +17,9 @@ class FeatureSerializerPlugin(IPlugin):
     features_per_frame = None
     ''' dictionary of features per frame (only used by local serializer plugin) '''
 
+    feature_directory = None
+    ''' directory of the feature files of all frames (only used by the npz serializer plugin) '''
+
     def activate(self):
         """
         Activation of plugin could do something, but not needed here
@@ -38,7 +41,7 @@ class FeatureSerializerPlugin(IPlugin):
 
     def loadFeaturesForFrame(self, features, timeframe):
         """
-        loads feature data
+        loads feature data, plugins may restrict this to the feature names given in `features`
         """
         raise NotImplementedError()
         return []
\ No newline at end of file
@@ -2,6 +2,39 @@ from __future__ import print_function, absolute_import, nested_scopes, generator
 from yapsy.IPlugin import IPlugin
 
 
+def cropRegion(image, offset, shape):
+    """
+    Crop the region starting at `offset` with the given `shape` from the first (spatial) axes of `image`,
+    remaining axes (e.g. channels) are kept
+    """
+    assert(len(offset) == len(shape))
+    return image[tuple(slice(o, o + s) for o, s in zip(offset, shape))]
+
+
+class FrameByFrameLabelImageExport(object):
+    """
+    Exports label images by calling `exportLabelImage` of the image provider for every frame,
+    as returned by the default implementation of `ImageProviderPlugin.openLabelImageExport`
+    """
+
+    def __init__(self, imageProvider, Resource, PathInResource):
+        self._imageProvider = imageProvider
+        self._resource = Resource
+        self._pathInResource = PathInResource
+
+    def write(self, labelimage, timeframe):
+        self._imageProvider.exportLabelImage(labelimage, timeframe, self._resource, self._pathInResource)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 class ImageProviderPlugin(IPlugin):
     """
     This is the base class for all plugins that load images from a given location
@@ -35,6 +68,36 @@ class ImageProviderPlugin(IPlugin):
         raise NotImplementedError()
         return []
 
+    def getImageDataRegion(self, Resource, PathInResource, axes, timeframe, offset, shape):
+        """
+        Loads the part of the image data at `timeframe` that starts at `offset` and has the given `shape`,
+        where `offset` and `shape` have one entry per spatial axis (x, y and optionally z). Channels are kept.
+        Plugins should override this to read only the requested region, the default crops the full frame.
+        """
+        return cropRegion(self.getImageDataAtTimeFrame(Resource, PathInResource, axes, timeframe), offset, shape)
+
+    def getLabelImageRegion(self, Resource, PathInResource, timeframe, offset, shape):
+        """
+        Get the part of the label image of one time frame that starts at `offset` and has the given `shape`,
+        see `getImageDataRegion`
+        """
+        return cropRegion(self.getLabelImageForFrame(Resource, PathInResource, timeframe), offset, shape)
+
+    def getLabelImageRegions(self, Resource, PathInResource, regions):
+        """
+        Get several label image regions at once, given as list of `(timeframe, offset, shape)` tuples.
+        Plugins for remote data can override this to send the requests concurrently, the default reads one after the other.
+        Return a list of numpy arrays.
+        """
+        return [self.getLabelImageRegion(Resource, PathInResource, t, offset, shape) for t, offset, shape in regions]
+
+    def getImageDataRegions(self, Resource, PathInResource, axes, regions):
+        """
+        Get several image data regions at once, given as list of `(timeframe, offset, shape)` tuples,
+        see `getLabelImageRegions`
+        """
+        return [self.getImageDataRegion(Resource, PathInResource, axes, t, offset, shape) for t, offset, shape in regions]
+
     def getImageShape(self, Resource, PathInResource):
         """
         extract the shape from the labelimage
@@ -49,9 +112,32 @@ class ImageProviderPlugin(IPlugin):
         raise NotImplementedError()
         return []
 
+    def getImageDataTimeRange(self, Resource, PathInResource, axes):
+        """
+        extract the time range of the image data with the given `axes`
+        Return tuple of (first frame, last frame + 1)
+        """
+        raise NotImplementedError()
+        return []
+
     def exportLabelImage(self, labelimage, timeframe, Resource, PathInResource):
         """
         export labelimage of timeframe
         """
         raise NotImplementedError()
-        return []
\ No newline at end of file
+        return []
+
+    def openLabelImageExport(self, Resource, PathInResource, timeRange):
+        """
+        Prepare the export of the label images of all frames in `timeRange` (first frame, last frame + 1).
+        Return an object with methods `write(labelimage, timeframe)` and `close()` that can be used as context manager.
+        Plugins can override this to stream frames to an open file, the default calls `exportLabelImage` for every frame.
+        """
+        return FrameByFrameLabelImageExport(self, Resource, PathInResource)
+
+    def releaseResource(self, Resource):
+        """
+        Close any handles the plugin keeps open to `Resource`, e.g. before it is overwritten.
+        The default does nothing.
+        """
+        pass
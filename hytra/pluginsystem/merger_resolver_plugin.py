@@ -38,13 +38,27 @@ class MergerResolverPlugin(IPlugin):
 
         return []
 
-    def resolveMerger(self, labelImage, objectId, nextId, mergerCount, initializations=None):
+    def resolveMergersForCoords(self, coordinatesList, mergerCounts, initializationsList):
+        """
+        Resolve several objects of one frame at once, given as lists of their pixel coordinates,
+        merger counts and initializations (see `resolveMergerForCoords`).
+        Plugins that can fit many objects together should override this method.
+
+        **returns** a list of the lists of fitted objects
+        """
+        return [self.resolveMergerForCoords(coordinates, mergerCount, initializations)
+                for coordinates, mergerCount, initializations in zip(coordinatesList, mergerCounts, initializationsList)]
+
+    def resolveMerger(self, labelImage, objectId, nextId, mergerCount, initializations=None, offset=None):
         """
         Resolve the object with the ID `objectId` in the `labelImage` into `mergerCount`
         new segments by fitting some kind of model. The `initializations` provide fits
         in the preceding frame of all possible incomings (list may be empty, but could
         also be more than `mergerCount`).
 
+        `labelImage` can be a cutout of the full frame (e.g. the bounding box of the object),
+        then `offset` is the position of the cutout in the frame, such that the fits are in frame coordinates.
+
         `labelImage` is used read-only, use `updateLabelImage` to refine the segmentation
 
         **returns** a list of fitted objects
@@ -2,11 +2,13 @@ from __future__ import print_function, absolute_import, nested_scopes, generator
 from yapsy.PluginManager import PluginManager
 from yapsy.FilteredPluginManager import FilteredPluginManager
 import logging
+import numpy as np
 from hytra.pluginsystem.object_feature_computation_plugin import ObjectFeatureComputationPlugin
-from hytra.pluginsystem.transition_feature_vector_construction_plugin import TransitionFeatureVectorConstructionPlugin
+from hytra.pluginsystem.transition_feature_vector_construction_plugin import TransitionFeatureVectorConstructionPlugin, getNumTransitions
 from hytra.pluginsystem.image_provider_plugin import ImageProviderPlugin
 from hytra.pluginsystem.feature_serializer_plugin import FeatureSerializerPlugin
 from hytra.pluginsystem.merger_resolver_plugin import MergerResolverPlugin
+from hytra.pluginsystem.caching_image_provider import CachingImageProvider
 
 class TrackingPluginManager(object):
     """
@@ -27,6 +29,8 @@ class TrackingPluginManager(object):
         self.chosen_data_provider = "LocalImageLoader"
         self.chosen_feature_serializer = "LocalFeatureSerializer"
         self.chosen_merger_resolver = 'GMMMergerResolver'
+        self._imageProviderCacheSettings = None
+        self._cachingImageProvider = None
 
     def __getstate__(self):
         '''
@@ -40,6 +44,7 @@ class TrackingPluginManager(object):
         state = self.__dict__.copy()
         # Remove the unpicklable entries.
         del state['_yapsyPluginManager']
+        state['_cachingImageProvider'] = None
         return state
 
     def __setstate__(self, state):
@@ -118,6 +123,27 @@ class TrackingPluginManager(object):
 
         return featureVector
 
+    def applyTransitionFeatureMatrixConstructionPlugins(self, featureDictObjectsA, featureDictObjectsB, selectedFeatures):
+        """
+        constructs the transition feature vectors of many transitions at once, given two dictionaries that contain
+        a matrix per feature with one row per transition (see `stackObjectFeatures`). Plugins that only
+        implement `constructFeatureVector` are called once per transition.
+
+        **returns** a matrix with one row per transition, each equal to the result of
+        `applyTransitionFeatureVectorConstructionPlugins` for this transition
+        """
+        numTransitions = getNumTransitions(featureDictObjectsA)
+        if numTransitions == 0:
+            return np.zeros((0, 0))
+        featureMatrices = [np.zeros((numTransitions, 0))]
+        def appendFeatures(plugin):
+            f = plugin.constructFeatureMatrix(featureDictObjectsA, featureDictObjectsB, selectedFeatures)
+            featureMatrices.append(np.asarray(f, dtype=np.float64).reshape(numTransitions, -1))
+
+        self._applyToAllPluginsOfCategory(appendFeatures, "TransitionFeatureVectorConstruction")
+
+        return np.hstack(featureMatrices)
+
     def getTransitionFeatureNames(self, featureDictObjectA, featureDictObjectB, selectedFeatures):
         """
         returns a verbal description of each feature in the transition feature vector
@@ -136,8 +162,25 @@ class TrackingPluginManager(object):
     	self.chosen_data_provider = imageProviderName
 
     def getImageProvider(self):
-        ''' get an instance of the selected image provider plugin '''
-        return self._getPluginOfCategory(self.chosen_data_provider, "ImageProvider")
+        '''
+        get an instance of the selected image provider plugin,
+        wrapped in a `CachingImageProvider` if `enableImageProviderCache` was called
+        '''
+        imageProvider = self._getPluginOfCategory(self.chosen_data_provider, "ImageProvider")
+        if self._imageProviderCacheSettings is None:
+            return imageProvider
+        if self._cachingImageProvider is None or self._cachingImageProvider._imageProvider is not imageProvider:
+            maxCacheBytes, readAhead = self._imageProviderCacheSettings
+            self._cachingImageProvider = CachingImageProvider(imageProvider, maxCacheBytes, readAhead)
+        return self._cachingImageProvider
+
+    def enableImageProviderCache(self, maxCacheBytes=512 * 2**20, readAhead=2):
+        '''
+        keep up to `maxCacheBytes` of recently read frames in memory and read the next `readAhead` frames
+        in the background, see `CachingImageProvider`
+        '''
+        self._imageProviderCacheSettings = (maxCacheBytes, readAhead)
+        self._cachingImageProvider = None
 
     def setFeatureSerializer(self, featureSerializerName):
         ''' set the used feature serializer plugin name '''
@@ -1,5 +1,38 @@
 from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
 from yapsy.IPlugin import IPlugin
+import numpy as np
+
+
+def stackObjectFeatures(featureDicts, selectedFeatures):
+    """
+    Combine the feature dictionaries of several objects into one dictionary with a feature matrix per feature,
+    whose rows are the objects in the order of `featureDicts`, as expected by `constructFeatureMatrix`.
+    Raises a `ValueError` if there are objects but no `selectedFeatures`, or if a selected feature is missing
+    for any of the objects, because the feature matrix would silently lose those objects or features.
+    """
+    if len(featureDicts) > 0:
+        if len(selectedFeatures) == 0:
+            raise ValueError("No features selected to stack for {} objects".format(len(featureDicts)))
+        missingFeatures = [k for k in selectedFeatures if not all(k in f for f in featureDicts)]
+        if len(missingFeatures) > 0:
+            raise ValueError("Features {} are missing for some of the {} objects".format(missingFeatures, len(featureDicts)))
+    return dict((k, np.array([f[k] for f in featureDicts])) for k in selectedFeatures)
+
+def asFeatureMatrix(values):
+    """
+    **returns** the values of one feature for many transitions as 2D array with one row per transition,
+    where features with several entries per object are flattened
+    """
+    values = np.asarray(values)
+    return values.reshape((values.shape[0], int(np.prod(values.shape[1:]))))
+
+def getNumTransitions(featureDictObjects):
+    """
+    **returns** the number of transitions described by a dictionary of feature matrices (see `constructFeatureMatrix`)
+    """
+    for value in featureDictObjects.values():
+        return len(value)
+    return 0
 
 
 class TransitionFeatureVectorConstructionPlugin(IPlugin):
@@ -40,4 +73,26 @@ class TransitionFeatureVectorConstructionPlugin(IPlugin):
                     featureDictObjectA['meanIntensity']*featureDictObjectB['meanIntensity']]
         """
         raise NotImplementedError()
-        return []
\ No newline at end of file
+        return []
+
+    def constructFeatureMatrix(self, featureDictObjectsA, featureDictObjectsB, selectedFeatures):
+        """
+        Set up the feature vectors of many transitions at once. Both dictionaries map every feature name
+        to an array whose first axis enumerates the transitions, such that row `i` of `featureDictObjectsA`
+        and `featureDictObjectsB` describes the two objects of the `i`-th transition.
+
+        Return a numpy array with one row per transition, whose columns are the entries of
+        the vector `constructFeatureVector` returns for the same transition.
+
+        This default implementation calls `constructFeatureVector` for every single transition,
+        plugins should override it with vectorized numpy operations on the whole matrices.
+        """
+        numTransitions = getNumTransitions(featureDictObjectsA)
+        if numTransitions == 0:
+            return np.zeros((0, 0))
+        rows = []
+        for i in range(numTransitions):
+            rows.append(self.constructFeatureVector(dict((k, v[i]) for k, v in featureDictObjectsA.items()),
+                                                    dict((k, v[i]) for k, v in featureDictObjectsB.items()),
+                                                    selectedFeatures))
+        return np.array(rows, dtype=np.float64).reshape(numTransitions, -1)
@@ -0,0 +1,199 @@
+"""
+This module provides n-dimensional arrays that are stored in a directory with one compressed file per chunk,
+following the layout of the [zarr v2 format](https://zarr.readthedocs.io/en/stable/spec/v2.html)
+with zlib compression: the directory contains the JSON metadata in `.zarray`, user attributes in `.zattrs`,
+and every chunk is a file named by its chunk indices joined by dots (e.g. `3.0.1`).
+
+As every chunk is a separate file, any number of processes can read concurrently without contending on one file,
+and the chunks of a region are decompressed in parallel threads (zlib releases the GIL).
+"""
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import os
+import json
+import zlib
+import itertools
+import threading
+import numpy as np
+import concurrent.futures
+
+_decodingExecutor = None
+_decodingExecutorPid = None
+_decodingExecutorLock = threading.Lock()
+
+def getDecodingExecutor(numThreads=4):
+    """
+    **returns** the thread pool used to (de)compress chunks, which is created once per process
+    """
+    global _decodingExecutor, _decodingExecutorPid
+    with _decodingExecutorLock:
+        if _decodingExecutor is None or _decodingExecutorPid != os.getpid():
+            _decodingExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=numThreads)
+            _decodingExecutorPid = os.getpid()
+        return _decodingExecutor
+
+def getDefaultChunks(shape, axes):
+    """
+    **returns** a chunk shape for a dataset of the given `shape` and `axes`, that stores every frame (`t`)
+    and all channels (`c`) together in chunks of at most 256 x 256 x 32 pixels (`xyz`)
+    """
+    maxChunkSize = {'t': 1, 'x': 256, 'y': 256, 'z': 32}
+    return tuple(min(s, maxChunkSize.get(a, s)) for s, a in zip(shape, axes))
+
+
+class ChunkedArray(object):
+    """
+    An array stored as a directory of compressed chunks, see module documentation.
+
+    Usage:
+
+        a = ChunkedArray.create('data.chunked/raw', shape=(10, 512, 512), chunks=(1, 128, 128), dtype=np.uint8)
+        a.write((0, 0, 0), frame[np.newaxis, ...])
+        region = ChunkedArray('data.chunked/raw').read((0, 100, 100), (1, 64, 64))
+    """
+
+    compressionLevel = 4
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, '.zarray'), 'r') as f:
+            metadata = json.load(f)
+        assert(metadata['zarr_format'] == 2)
+        assert(metadata['order'] == 'C')
+        assert(metadata['compressor'] is None or metadata['compressor']['id'] == 'zlib')
+        self.shape = tuple(metadata['shape'])
+        self.chunks = tuple(metadata['chunks'])
+        self.dtype = np.dtype(metadata['dtype'])
+        self.fillValue = metadata['fill_value'] if metadata['fill_value'] is not None else 0
+        self._compressed = metadata['compressor'] is not None
+        attributesFilename = os.path.join(path, '.zattrs')
+        if os.path.exists(attributesFilename):
+            with open(attributesFilename, 'r') as f:
+                self.attrs = json.load(f)
+        else:
+            self.attrs = {}
+
+    @classmethod
+    def create(cls, path, shape, chunks, dtype, attrs=None):
+        """
+        Create a new empty array at `path`, overwriting the metadata of an existing one.
+
+        **returns** the `ChunkedArray`
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+        metadata = {'zarr_format': 2,
+                    'shape': [int(s) for s in shape],
+                    'chunks': [int(min(c, s)) if s > 0 else int(c) for c, s in zip(chunks, shape)],
+                    'dtype': np.dtype(dtype).str,
+                    'compressor': {'id': 'zlib', 'level': cls.compressionLevel},
+                    'fill_value': 0,
+                    'order': 'C',
+                    'filters': None}
+        with open(os.path.join(path, '.zarray'), 'w') as f:
+            json.dump(metadata, f)
+        if attrs is not None:
+            with open(os.path.join(path, '.zattrs'), 'w') as f:
+                json.dump(attrs, f)
+        return cls(path)
+
+    @staticmethod
+    def exists(path):
+        """ **returns** whether there is an array stored at `path` """
+        return os.path.exists(os.path.join(path, '.zarray'))
+
+    def resize(self, shape):
+        """ change the shape of the array, chunks outside of the new shape are not removed """
+        with open(os.path.join(self.path, '.zarray'), 'r') as f:
+            metadata = json.load(f)
+        metadata['shape'] = [int(s) for s in shape]
+        with open(os.path.join(self.path, '.zarray'), 'w') as f:
+            json.dump(metadata, f)
+        self.shape = tuple(shape)
+
+    def _getChunkFilename(self, chunkIndex):
+        return os.path.join(self.path, '.'.join(str(i) for i in chunkIndex))
+
+    def _getChunkIndices(self, begin, end):
+        ranges = [range(b // c, (e - 1) // c + 1) for b, e, c in zip(begin, end, self.chunks)]
+        return list(itertools.product(*ranges))
+
+    def _readChunk(self, chunkIndex):
+        ''' **returns** the decompressed chunk, or `None` if it was never written '''
+        filename = self._getChunkFilename(chunkIndex)
+        if not os.path.exists(filename):
+            return None
+        with open(filename, 'rb') as f:
+            data = f.read()
+        if self._compressed:
+            data = zlib.decompress(data)
+        return np.frombuffer(data, dtype=self.dtype).reshape(self.chunks)
+
+    def _writeChunk(self, chunkIndex, chunk):
+        data = np.ascontiguousarray(chunk, dtype=self.dtype).tobytes()
+        if self._compressed:
+            data = zlib.compress(data, self.compressionLevel)
+        filename = self._getChunkFilename(chunkIndex)
+        # write to a temporary file of this process first, such that concurrent readers never see partial chunks
+        # and concurrent writers of the same chunk do not write into each other's temporary file
+        tmpFilename = "{}.{}.tmp".format(filename, os.getpid())
+        with open(tmpFilename, 'wb') as f:
+            f.write(data)
+        os.rename(tmpFilename, filename)
+
+    def read(self, offset=None, shape=None):
+        """
+        Read the region starting at `offset` with the given `shape` (defaults: the whole array),
+        decompressing all chunks that overlap the region in parallel.
+
+        **returns** the region as numpy array
+        """
+        begin = np.zeros(len(self.shape), dtype=int) if offset is None else np.array(offset, dtype=int)
+        end = np.array(self.shape, dtype=int) if shape is None else begin + np.array(shape, dtype=int)
+        assert(np.all(begin >= 0) and np.all(end <= self.shape))
+        region = np.empty(end - begin, dtype=self.dtype)
+        if region.size == 0:
+            return region
+        region.fill(self.fillValue)
+
+        def copyChunk(chunkIndex):
+            chunk = self._readChunk(chunkIndex)
+            if chunk is None:
+                return
+            chunkBegin = np.array(chunkIndex) * self.chunks
+            overlapBegin = np.maximum(begin, chunkBegin)
+            overlapEnd = np.minimum(end, chunkBegin + self.chunks)
+            region[tuple(slice(b, e) for b, e in zip(overlapBegin - begin, overlapEnd - begin))] = \
+                chunk[tuple(slice(b, e) for b, e in zip(overlapBegin - chunkBegin, overlapEnd - chunkBegin))]
+
+        # list() to re-raise errors of the worker threads
+        list(getDecodingExecutor().map(copyChunk, self._getChunkIndices(begin, end)))
+        return region
+
+    def write(self, offset, data):
+        """
+        Write `data` into the array starting at `offset`. Chunks that are only partially covered by `data`
+        are read and updated, all chunks are compressed in parallel.
+        """
+        begin = np.array(offset, dtype=int)
+        end = begin + data.shape
+        assert(np.all(begin >= 0) and np.all(end <= self.shape))
+
+        def writeChunk(chunkIndex):
+            chunkBegin = np.array(chunkIndex) * self.chunks
+            overlapBegin = np.maximum(begin, chunkBegin)
+            overlapEnd = np.minimum(end, chunkBegin + self.chunks)
+            dataSlicing = tuple(slice(b, e) for b, e in zip(overlapBegin - begin, overlapEnd - begin))
+            chunkSlicing = tuple(slice(b, e) for b, e in zip(overlapBegin - chunkBegin, overlapEnd - chunkBegin))
+            if all(s.stop - s.start == c for s, c in zip(chunkSlicing, self.chunks)):
+                chunk = data[dataSlicing]
+            else:
+                chunk = self._readChunk(chunkIndex)
+                if chunk is None:
+                    chunk = np.empty(self.chunks, dtype=self.dtype)
+                    chunk.fill(self.fillValue)
+                else:
+                    chunk = chunk.copy()
+                chunk[chunkSlicing] = data[dataSlicing]
+            self._writeChunk(chunkIndex, chunk)
+
+        list(getDecodingExecutor().map(writeChunk, self._getChunkIndices(begin, end)))
@@ -0,0 +1,38 @@
+"""
+This module relabels the objects in label images, e.g. to color objects by their track ID when exporting tracking results.
+
+Instead of comparing the whole image against every object ID, a dense lookup table is built from the mapping
+of object IDs to new labels, and all pixels are relabeled in a single vectorized indexing pass.
+"""
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import numpy as np
+
+def buildLookupTable(mapping, maxLabel, dtype=np.uint32, default=0):
+    """
+    Create a dense lookup table `lut` of length `maxLabel + 1` where `lut[label] == mapping[label]` for all labels
+    in the dictionary `mapping`. All other labels are mapped to `default`, except for the background (0),
+    which stays 0 unless it is contained in `mapping`. Labels in `mapping` that are larger than `maxLabel` are ignored.
+
+    **returns** the lookup table as numpy array of the given `dtype`
+    """
+    lut = np.full(maxLabel + 1, default, dtype=dtype)
+    lut[0] = 0
+    if len(mapping) > 0:
+        keys = np.fromiter(mapping.keys(), dtype=np.int64, count=len(mapping))
+        values = np.fromiter(mapping.values(), dtype=np.int64, count=len(mapping))
+        valid = (keys >= 0) & (keys <= maxLabel)
+        lut[keys[valid]] = values[valid]
+    return lut
+
+def relabel(labelImage, mapping, default=0, dtype=None):
+    """
+    Replace every label in `labelImage` by its value in the dictionary `mapping`,
+    labels that are not contained in `mapping` are set to `default` (see `buildLookupTable`).
+
+    **returns** the relabeled image, of the same `dtype` as `labelImage` if none is given
+    """
+    if dtype is None:
+        dtype = labelImage.dtype
+    maxLabel = int(labelImage.max()) if labelImage.size > 0 else 0
+    lut = buildLookupTable(mapping, maxLabel, dtype, default)
+    return np.take(lut, labelImage)
@@ -0,0 +1,168 @@
+"""
+This module converts between sequences of TIFF files with one file per frame, as used by the Cell Tracking Challenge,
+and chunked, gzip compressed HDF5 datasets, one frame at a time such that only a single frame is kept in memory.
+
+The chunks of every written frame are compressed in parallel threads (zlib releases the GIL)
+and stored with `write_direct_chunk`, which produces the same files as letting HDF5 compress them.
+"""
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import glob
+import zlib
+import logging
+import itertools
+import numpy as np
+import h5py
+from skimage.external import tifffile
+import hytra.util.axesconversion
+from hytra.util.chunkedarray import getDecodingExecutor, getDefaultChunks
+
+def getLogger():
+    ''' logger to be used in this module '''
+    return logging.getLogger(__name__)
+
+def getTiffSequence(filenamePattern):
+    """
+    **returns** the sorted list of filenames matching `filenamePattern`, e.g. `01_GT/TRA/man_track*.tif`
+    """
+    return sorted(glob.glob(filenamePattern))
+
+def iterateTiffFrames(filenames, frameAxes, outputAxes='xyzc'):
+    """
+    Read one TIFF file with axes `frameAxes` (e.g. `yx` or `zyx`) after the other,
+    and yield each frame converted to `outputAxes`
+    """
+    for filename in filenames:
+        frame = tifffile.imread(filename)
+        yield hytra.util.axesconversion.adjustOrder(frame, frameAxes, outputAxes)
+
+def _canWriteDirectChunks(dataset, offset, shape):
+    ''' direct chunk writes only work for gzip compressed datasets and regions consisting of whole chunks '''
+    if dataset.chunks is None or dataset.compression != 'gzip' or dataset.shuffle or dataset.fletcher32 \
+            or dataset.scaleoffset is not None or dataset.dtype.byteorder == '>':
+        return False
+    for o, s, c, d in zip(offset, shape, dataset.chunks, dataset.shape):
+        if o % c != 0 or (s % c != 0 and o + s != d):
+            return False
+    return True
+
+def writeCompressed(dataset, offset, data):
+    """
+    Write `data` to the HDF5 `dataset` starting at `offset`. If the dataset is gzip compressed and the region
+    consists of whole chunks (or reaches the end of the dataset), the chunks are compressed in parallel
+    and written directly, otherwise HDF5 compresses them while writing.
+
+    Note that with HDF5 1.10.4 directly written chunks can read back as zeros through dataset handles that were
+    open while writing, the data is only guaranteed to be visible once the dataset has been closed and reopened.
+    """
+    offset = tuple(int(o) for o in offset)
+    if not _canWriteDirectChunks(dataset, offset, data.shape):
+        dataset[tuple(slice(o, o + s) for o, s in zip(offset, data.shape))] = data
+        return
+
+    data = np.asarray(data)
+    if data.dtype.kind in 'iu' and dataset.dtype.kind in 'iu' and data.dtype != dataset.dtype:
+        # saturate like HDF5 does when converting to a smaller integer type
+        info = np.iinfo(dataset.dtype)
+        data = np.clip(data, max(info.min, np.iinfo(data.dtype).min), min(info.max, np.iinfo(data.dtype).max))
+    data = data.astype(dataset.dtype, copy=False)
+    chunks = dataset.chunks
+    level = dataset.compression_opts
+
+    def compressChunk(chunkBegin):
+        # chunks at the border of the dataset are stored with their full size, padded with zeros
+        block = data[tuple(slice(b - o, b - o + c) for b, o, c in zip(chunkBegin, offset, chunks))]
+        if block.shape != chunks:
+            padded = np.zeros(chunks, dtype=dataset.dtype)
+            padded[tuple(slice(0, s) for s in block.shape)] = block
+            block = padded
+        return chunkBegin, zlib.compress(np.ascontiguousarray(block).tobytes(), level)
+
+    chunkBegins = itertools.product(*[range(o, o + s, c) for o, s, c in zip(offset, data.shape, chunks)])
+    for chunkBegin, compressed in getDecodingExecutor().map(compressChunk, chunkBegins):
+        dataset.id.write_direct_chunk(chunkBegin, compressed)
+
+def createCompressedDataset(group, path, data, dtype=None, axes=None, chunks=None, compressionLevel=4):
+    """
+    Create a gzip compressed dataset at `path` in the HDF5 `group` that contains `data`, see `writeCompressed`.
+    The `chunks` default to `getDefaultChunks` if the `axes` of `data` are given, otherwise to HDF5's choice.
+
+    **returns** the dataset
+    """
+    if dtype is None:
+        dtype = data.dtype
+    if chunks is None:
+        chunks = getDefaultChunks(data.shape, axes) if axes is not None else True
+    elif chunks is not True:
+        chunks = tuple(chunks)
+    dataset = group.create_dataset(path, shape=data.shape, dtype=dtype, chunks=chunks,
+                                   compression='gzip', compression_opts=compressionLevel)
+    writeCompressed(dataset, (0,) * data.ndim, data)
+    return dataset
+
+def tiffSequenceToH5(filenames,
+                     h5Filename,
+                     path,
+                     frameAxes,
+                     outputAxes='txyzc',
+                     dtype=None,
+                     chunks=None,
+                     compressionLevel=4):
+    """
+    Stack the frames of a TIFF sequence, one file per frame with axes `frameAxes`, along the `t` axis
+    of a compressed dataset with axes `outputAxes` at `path` in `h5Filename`, reading and writing one frame at a time.
+    The `chunks` are given in the order of `outputAxes` and default to `getDefaultChunks`.
+
+    **returns** the shape of the dataset
+    """
+    assert('t' in outputAxes)
+    assert('t' not in frameAxes)
+    timeAxis = outputAxes.index('t')
+    frameOutputAxes = outputAxes.replace('t', '')
+
+    with h5py.File(h5Filename, 'a') as h5file:
+        if path in h5file:
+            del h5file[path]
+        dataset = None
+        for timeframe, frame in enumerate(iterateTiffFrames(filenames, frameAxes, frameOutputAxes)):
+            frame = np.expand_dims(frame, axis=timeAxis)
+            if dataset is None:
+                shape = frame.shape[:timeAxis] + (len(filenames),) + frame.shape[timeAxis + 1:]
+                getLogger().info("Saving h5 volume of shape {}".format(shape))
+                dataset = h5file.create_dataset(path,
+                                                shape=shape,
+                                                dtype=dtype if dtype is not None else frame.dtype,
+                                                chunks=tuple(chunks) if chunks is not None else getDefaultChunks(shape, outputAxes),
+                                                compression='gzip',
+                                                compression_opts=compressionLevel)
+            offset = [0] * len(outputAxes)
+            offset[timeAxis] = timeframe
+            writeCompressed(dataset, offset, frame)
+        return dataset.shape if dataset is not None else None
+
+def h5ToTiffSequence(h5Filename, path, axes, filenamePattern, frameAxes='zyx', dtype=None, filenameZeroPadding=3):
+    """
+    Export a dataset with `axes` at `path` in `h5Filename` to one TIFF file per frame, reading one frame at a time.
+    The files are named by replacing the `*` in `filenamePattern` by the zero padded frame number
+    and contain the frame with axes `frameAxes`, where axes of size one that are not in `frameAxes` are dropped.
+
+    **returns** the list of written filenames
+    """
+    filenames = []
+    with h5py.File(h5Filename, 'r') as h5file:
+        dataset = h5file[path]
+        timeAxis = axes.index('t')
+        for timeframe in range(dataset.shape[timeAxis]):
+            frame = dataset[hytra.util.axesconversion.getFrameSlicing(axes, timeframe)]
+            frameAxesInData = axes.replace('t', '')
+            # drop singleton axes that are not exported
+            for axis in [a for a in frameAxesInData if a not in frameAxes]:
+                assert(frame.shape[frameAxesInData.index(axis)] == 1)
+                frame = frame.take(0, axis=frameAxesInData.index(axis))
+                frameAxesInData = frameAxesInData.replace(axis, '')
+            frame = hytra.util.axesconversion.adjustOrder(frame, frameAxesInData, frameAxes)
+            if dtype is not None:
+                frame = frame.astype(dtype)
+            filename = filenamePattern.replace('*', format(timeframe, "0{}".format(filenameZeroPadding)))
+            tifffile.imsave(filename, frame)
+            filenames.append(filename)
+    return filenames
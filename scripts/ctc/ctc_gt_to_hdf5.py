@@ -9,11 +9,9 @@ import configargparse as argparse
 import logging
 import numpy as np
 import h5py
-import vigra
-from skimage.external import tifffile
-import glob
 import hytra.util.axesconversion
-from hytra.util.skimage_tifffile_hack import hack
+from hytra.util.relabeling import relabel
+from hytra.util.tiffsequence import getTiffSequence, iterateTiffFrames, createCompressedDataset
 
 def find_splits(filename, start_frame):
     # store split events indexed by timestep, then parent
@@ -45,11 +43,7 @@ def remap_label_image(label_image, mapping):
     given a label image and a mapping, creates and 
     returns a new label image with remapped object pixel values 
     """
-    remapped_label_image = np.zeros_like(label_image)
-    for src, dest in mapping.iteritems():
-        remapped_label_image[label_image == src] = dest
-
-    return remapped_label_image
+    return relabel(label_image, mapping)
 
 def remap_events(events, mappingA, mappingB=None):
     """
@@ -97,47 +91,30 @@ def find_label_image_remapping(label_image):
 
 def save_label_image_for_frame(options, label_volume, out_h5, frame, mapping_per_frame=None):
     """
-    Takes a specific frame or all frames from the `label_volume` and stores them in `out_h5`.
+    Takes the label image of one frame (`label_volume` with axes xyzc) and stores it in `out_h5`.
 
-    **If** `options.single_frames == True` then the respective part is taken from the label_volume
-    and stored in `/segmentation/labels` of `out_h5`, and a `mapping_per_frame` is applied if given.
-    **Otherwise** the full volume is saved when `frame == 0`, and it does nothing for all further
-    frames.
+    **If** `options.single_frames == True` then the frame is stored in `/segmentation/labels` of `out_h5`,
+    and a `mapping_per_frame` is applied if given. Storing all frames in one volume is not implemented.
 
     `mapping_per_frame` must be a dictionary, with frames as keys, and the values are then again dictionaries
     from the indices of objects in a frame of `label_volume` to the output indices.
     """
     if options.single_frames:
-        out_label_volume = label_volume[..., frame, :]
+        out_label_volume = label_volume
         if options.index_remapping and mapping_per_frame is not None:
             out_label_volume = remap_label_image(out_label_volume, mapping_per_frame[frame])
 
         out_label_volume = hytra.util.axesconversion.adjustOrder(out_label_volume, 'xyzc', options.groundtruth_axes)
-        out_h5.create_dataset("segmentation/labels", data=out_label_volume, dtype='u2', compression='gzip')
+        createCompressedDataset(out_h5, "segmentation/labels", out_label_volume, dtype='u2',
+                                axes=options.groundtruth_axes, chunks=options.groundtruth_chunks)
     else:
         raise NotImplementedError
-        out_label_volume = np.transpose(label_volume, axes=[2, 1, 0, 3])
-        
-        if options.index_remapping and mapping_per_frame is not None:
-            # remap every frame in the volume individually
-            for frame in range(label_volume.shape[2]):
-                remapped_frame = remap_label_image(out_label_volume[..., frame, 0], mapping_per_frame[frame])
-                out_label_volume[..., frame, 0] = remapped_frame
-
-        out_h5.create_dataset("label_image", data=out_label_volume, dtype='u2', compression='gzip')
-        out_label_volume = (out_label_volume.swapaxes(1, 2))[..., np.newaxis]
-        out_h5.create_dataset("label_image_T", data=out_label_volume, dtype='u2', compression='gzip')
 
 def create_label_volume(options):
-    # read image
-    # label_volume = vigra.impex.readVolume('/export/home/lparcala/Fluo-N2DH-SIM/01_GT/TRA/man_track000.tif')
-    # label_volume = tifffile.imread(options.input_tif) # this could work, if tifffile would work.
-    path, files = hack(options.input_tif)
-    os.chdir(path)
-    label_volume = tifffile.imread(files)
-    logging.getLogger('ctc_gt_to_hdf5.py').info("Found dataset of size {}".format(label_volume.shape))
-    label_volume = hytra.util.axesconversion.adjustOrder(label_volume, options.tif_input_axes, 'xyztc')
-    timeaxis = label_volume.shape[3]
+    # the frames are read one at a time, only the objects and mappings of the previous frame are kept
+    timeaxis = len(options.input_tif)
+    logging.getLogger('ctc_gt_to_hdf5.py').info("Found {} frames".format(timeaxis))
+    frame_axes = options.tif_input_axes.replace('t', '')
 
     split_events = find_splits(options.input_track, options.start_frame)
 
@@ -153,83 +130,80 @@ def create_label_volume(options):
             shutil.rmtree(options.output_file)
             os.mkdir(options.output_file)
 
-    # store object ids per frame and generate mappings
-    objects_per_frame = []
-    mapping_per_frame = {}
-
-    for frame in range(timeaxis):
-        label_image = label_volume[..., frame, 0]
-        mapping_per_frame[frame] = find_label_image_remapping(label_image)
-
-    # handle frame zero
     if not options.single_frames:
         # one holistic volume file
         out_h5 = h5py.File(options.output_file, 'w')
         ids = out_h5.create_group('ids')
         tracking = out_h5.create_group('tracking')
-        # create empty tracking group for first frame
-        tracking_frame = tracking.create_group(format(0, options.filename_zero_padding))
-    else:
-        frame = 0
-        out_h5 = h5py.File(options.output_file + format(frame, options.filename_zero_padding) + '.h5', 'w')
-        tracking_frame = out_h5.create_group('tracking')
-    save_label_image_for_frame(options, label_volume, out_h5, 0, mapping_per_frame)
 
-    for frame in range(timeaxis):
-        label_image = label_volume[..., frame, 0]
+    # store object ids and mappings of the previous frame
+    objects_per_frame = {}
+    mapping_per_frame = {}
+
+    for frame, label_volume in enumerate(iterateTiffFrames(options.input_tif, frame_axes, 'xyzc')):
+        label_image = label_volume[..., 0]
+        if frame == 0:
+            logging.getLogger('ctc_gt_to_hdf5.py').info("Found frames of size {}".format(label_volume.shape))
+        mapping_per_frame[frame] = find_label_image_remapping(label_image)
         objects = np.unique(label_image)
-        objects_per_frame.append(set(objects))
-        if not options.single_frames:
-            ids.create_dataset(format(frame, options.filename_zero_padding), data=objects, dtype='u2')
+        objects_per_frame[frame] = set(objects)
+        mapping_per_frame.pop(frame - 2, None)
+        objects_per_frame.pop(frame - 2, None)
 
-    # handle all further frames
-    for frame in range(1, timeaxis):
         if options.single_frames:
             out_h5 = h5py.File(options.output_file + format(frame, options.filename_zero_padding) + '.h5', 'w')
             tracking_frame = out_h5.create_group('tracking')
         else:
             tracking_frame = tracking.create_group(format(frame, options.filename_zero_padding))
+            ids.create_dataset(format(frame, options.filename_zero_padding), data=objects, dtype='u2')
         save_label_image_for_frame(options, label_volume, out_h5, frame, mapping_per_frame)
 
-        # intersect track id sets of both frames, and place moves in HDF5 file
-        tracks_in_both_frames = objects_per_frame[frame - 1] & objects_per_frame[frame] - set([0])
-        moves = zip(list(tracks_in_both_frames), list(tracks_in_both_frames))
-
-        # add the found splits as both, mitosis and split events
-        if frame in split_events.keys():
-            splits_in_frame = split_events[frame]
-
-            # make sure all splits have the same dimension
-            splits = []
-            for key, value in splits_in_frame.iteritems():
-                value = [v for v in value if v in objects_per_frame[frame]]
-
-                if key not in objects_per_frame[frame - 1]:
-                    logging.getLogger('ctc_gt_to_hdf5.py').warning("Parent {} of split is not in previous frame {}. Ignored".format(key, frame - 1))
-                    continue
-
-                if len(value) > 1:
-                    if len(value) > 2:
-                        logging.getLogger('ctc_gt_to_hdf5.py').warning("Cutting off children of {} in timestep {}".format(key, frame))
-                    # cut off divisions into more than 2
-                    splits.append([key] + value[0:2])
-                elif len(value) == 1:
-                    # store as move
-                    logging.getLogger('ctc_gt_to_hdf5.py').warning("Store move ({},{}) instead of split into one in timestep {}".format(key, value[0], frame))
-                    moves.append((key, value[0]))
-
-            if len(splits) > 0:
-                splits = np.array(splits)
+        if frame > 0:
+            # intersect track id sets of both frames, and place moves in HDF5 file
+            tracks_in_both_frames = objects_per_frame[frame - 1] & objects_per_frame[frame] - set([0])
+            moves = zip(list(tracks_in_both_frames), list(tracks_in_both_frames))
+
+            # add the found splits as both, mitosis and split events
+            if frame in split_events.keys():
+                splits_in_frame = split_events[frame]
+
+                # make sure all splits have the same dimension
+                splits = []
+                for key, value in splits_in_frame.iteritems():
+                    value = [v for v in value if v in objects_per_frame[frame]]
+
+                    if key not in objects_per_frame[frame - 1]:
+                        logging.getLogger('ctc_gt_to_hdf5.py').warning("Parent {} of split is not in previous frame {}. Ignored".format(key, frame - 1))
+                        continue
+
+                    if len(value) > 1:
+                        if len(value) > 2:
+                            logging.getLogger('ctc_gt_to_hdf5.py').warning("Cutting off children of {} in timestep {}".format(key, frame))
+                        # cut off divisions into more than 2
+                        splits.append([key] + value[0:2])
+                    elif len(value) == 1:
+                        # store as move
+                        logging.getLogger('ctc_gt_to_hdf5.py').warning("Store move ({},{}) instead of split into one in timestep {}".format(key, value[0], frame))
+                        moves.append((key, value[0]))
+
+                if len(splits) > 0:
+                    splits = np.array(splits)
+                    if options.index_remapping:
+                        splits = remap_events(splits, mapping_per_frame[frame - 1], mapping_per_frame[frame])
+                    tracking_frame.create_dataset("Splits", data=splits, dtype='u2')
+                    mitosis = [splits[i][0] for i in range(splits.shape[0])]
+                    tracking_frame.create_dataset("Mitosis", data=np.array(mitosis), dtype='u2')
+
+            if len(moves) > 0:
                 if options.index_remapping:
-                    splits = remap_events(splits, mapping_per_frame[frame - 1], mapping_per_frame[frame])
-                tracking_frame.create_dataset("Splits", data=splits, dtype='u2')
-                mitosis = [splits[i][0] for i in range(splits.shape[0])]
-                tracking_frame.create_dataset("Mitosis", data=np.array(mitosis), dtype='u2')
+                        moves = remap_events(np.array(moves), mapping_per_frame[frame - 1], mapping_per_frame[frame])
+                tracking_frame.create_dataset("Moves", data=moves, dtype='u2')
+
+        if options.single_frames:
+            out_h5.close()
 
-        if len(moves) > 0:
-            if options.index_remapping:
-                    moves = remap_events(np.array(moves), mapping_per_frame[frame - 1], mapping_per_frame[frame])
-            tracking_frame.create_dataset("Moves", data=moves, dtype='u2')
+    if not options.single_frames:
+        out_h5.close()
 
 
 if __name__ == "__main__":
@@ -250,6 +224,9 @@ if __name__ == "__main__":
                         help='Filename for the resulting HDF5 file/folder.')
     parser.add_argument("--groundtruth-axes", dest='groundtruth_axes', type=str, default='xyzc',
                         help="axes ordering to use when creating the ground truth segmentations per frame (no t!), e.g. xyzc")
+    parser.add_argument("--groundtruth-chunks", dest='groundtruth_chunks', type=int, nargs='+', default=None,
+                        help="chunk shape of the ground truth segmentations in the order of --groundtruth-axes, "
+                             "defaults to at most 256x256x32 pixels")
     parser.add_argument('--start-frame', type=int, dest='start_frame', default=0,
                         help='First frame number (usually 0, but e.g. their rapoport starts at 150')
     parser.add_argument('--ctc-to-gt-single-frames', action='store_true', dest='single_frames',
@@ -261,8 +238,7 @@ if __name__ == "__main__":
 
     # parse command line
     options, unknown = parser.parse_known_args()
-    options.input_tif = glob.glob(options.tif_input_file_pattern)
-    options.input_tif.sort()
+    options.input_tif = getTiffSequence(options.tif_input_file_pattern)
 
     if options.verbose:
         logging.basicConfig(level=logging.DEBUG)
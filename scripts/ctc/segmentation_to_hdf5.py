@@ -8,9 +8,8 @@ sys.path.insert(0, os.path.abspath('..'))
 import h5py
 import configargparse as argparse
 import logging
-import glob
-from skimage.external import tifffile
 import hytra.util.axesconversion
+from hytra.util.tiffsequence import getTiffSequence, iterateTiffFrames, createCompressedDataset
 
 def segmentation_to_hdf5(options):
     """
@@ -18,19 +17,12 @@ def segmentation_to_hdf5(options):
     and each of these datasets has shape 1(t),x,y,z,1(c).
     """
     out_h5 = h5py.File(options.hdf5Path, 'w')
-    for timeframe in range(len(options.tif_input_files)):
-        data = tifffile.imread(options.tif_input_files[timeframe])
-        
-        if timeframe == 0:
-            logging.getLogger('segmentation_to_hdf5.py').info("Found image of shape {}".format(data.shape))
-        
-        data = hytra.util.axesconversion.adjustOrder(data, options.tif_input_axes, 'txyzc')
-
+    for timeframe, data in enumerate(iterateTiffFrames(options.tif_input_files, options.tif_input_axes, 'txyzc')):
         if timeframe == 0:
             logging.getLogger('segmentation_to_hdf5.py').info("Changed into shape {}".format(data.shape))
 
         internalPath = options.hdf5ImagePath % (timeframe, timeframe + 1, data.shape[1], data.shape[2], data.shape[3])
-        out_h5.create_dataset(internalPath, data=data, dtype='u2', compression='gzip')
+        createCompressedDataset(out_h5, internalPath, data, dtype='u2', axes='txyzc', chunks=options.hdf5ImageChunks)
         time = timeframe
     logging.getLogger('segmentation_to_hdf5.py').info("Saved {} timeframes".format(time))
 
@@ -53,12 +45,14 @@ if __name__ == '__main__':
     parser.add_argument('--label-image-path', type=str, dest='hdf5ImagePath',
                         help='Path inside ilastik project file to the label image',
                         default='/TrackingFeatureExtraction/LabelImage/0000/[[%d, 0, 0, 0, 0], [%d, %d, %d, %d, 1]]')
+    parser.add_argument('--label-image-chunks', type=int, nargs='+', dest='hdf5ImageChunks', default=None,
+                        help='chunk shape of the label image of each frame, in txyzc order. '
+                             'Defaults to at most 256x256x32 pixels')
     parser.add_argument("--verbose", dest='verbose', action='store_true', default=False)
 
     # parse command line
     options, unknown = parser.parse_known_args()
-    options.tif_input_files = glob.glob(options.tif_input_file_pattern)
-    options.tif_input_files.sort()
+    options.tif_input_files = getTiffSequence(options.tif_input_file_pattern)
 
     if options.verbose:
         logging.basicConfig(level=logging.DEBUG)
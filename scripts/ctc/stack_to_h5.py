@@ -5,22 +5,19 @@ import sys
 sys.path.insert(0, os.path.abspath('../..'))
 sys.path.insert(0, os.path.abspath('..'))
 # standard imports
-import vigra
 import configargparse as argparse
 import logging
-from skimage.external import tifffile
-import hytra.util.axesconversion
-import glob
-from hytra.util.skimage_tifffile_hack import hack
+from hytra.util.tiffsequence import getTiffSequence, tiffSequenceToH5
 
 def convert_to_volume(options):
-    # data = tifffile.imread(options.input_file)
-    path, files = hack(options.input_file)
-    os.chdir(path)
-    data = tifffile.imread(files)
-    reshapedData = hytra.util.axesconversion.adjustOrder(data, options.tif_input_axes, options.output_axes)
-    logging.getLogger('stack_to_h5.py').info("Saving h5 volume of shape {}".format(data.shape))
-    vigra.writeHDF5(reshapedData, options.output_file, options.output_path)
+    # the tif files are stacked along the time axis one at a time, into a chunked and compressed dataset
+    shape = tiffSequenceToH5(options.input_file,
+                             options.output_file,
+                             options.output_path,
+                             options.tif_input_axes.replace('t', ''),
+                             options.output_axes,
+                             chunks=options.output_chunks)
+    logging.getLogger('stack_to_h5.py').info("Saved h5 volume of shape {}".format(shape))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -39,12 +36,14 @@ if __name__ == "__main__":
                         help='Path inside the HDF5 file to the data')
     parser.add_argument("--raw-data-axes", dest='output_axes', type=str, default='txyzc',
                         help="axes ordering of the produced raw image, e.g. xyztc.")
+    parser.add_argument("--raw-data-chunks", dest='output_chunks', type=int, nargs='+', default=None,
+                        help="chunk shape of the produced raw image in the order of --raw-data-axes, "
+                             "defaults to single frames of at most 256x256x32 pixels")
     parser.add_argument("--verbose", dest='verbose', action='store_true', default=False)
 
     # parse command line
     options, unknown = parser.parse_known_args()
-    options.input_file = glob.glob(options.tif_input_file_pattern)
-    options.input_file.sort()
+    options.input_file = getTiffSequence(options.tif_input_file_pattern)
 
 
     if options.verbose:
@@ -0,0 +1,110 @@
+# pythonpath modification to make hytra and empryonic available 
+# for import without requiring it to be installed
+import os
+import sys
+sys.path.insert(0, os.path.abspath('..'))
+# standard imports
+import configargparse as argparse
+import numpy as np
+import h5py
+import logging
+from hytra.util.chunkedarray import ChunkedArray
+from hytra.pluginsystem.plugin_manager import TrackingPluginManager
+
+def getLogger():
+    return logging.getLogger('h5_to_chunked_directory.py')
+
+def getChunks(axes, shape, spatialChunks):
+    ''' chunk shape for an array with the given axes: single frames and channels, spatial axes split into blocks '''
+    chunks = []
+    for a, s in zip(axes, shape):
+        if a in 'xyz':
+            chunks.append(min(spatialChunks['xyz'.index(a)], s))
+        elif a == 't':
+            chunks.append(1)
+        else:
+            chunks.append(s)
+    return tuple(chunks)
+
+def convertRawData(options):
+    ''' copy the raw dataset frame by frame, keeping its axes order '''
+    with h5py.File(options.raw_filename, 'r') as h5file:
+        dataset = h5file[options.raw_path]
+        assert(len(options.raw_axes) == len(dataset.shape))
+        array = ChunkedArray.create(os.path.join(options.output_dir, options.out_raw_path),
+                                    dataset.shape,
+                                    getChunks(options.raw_axes, dataset.shape, options.chunks),
+                                    dataset.dtype,
+                                    attrs={'axes': options.raw_axes})
+        timeAxis = options.raw_axes.index('t')
+        for t in range(dataset.shape[timeAxis]):
+            getLogger().debug("Converting raw data of frame {}".format(t))
+            slicing = [slice(None)] * len(dataset.shape)
+            slicing[timeAxis] = slice(t, t + 1)
+            offset = [0] * len(dataset.shape)
+            offset[timeAxis] = t
+            array.write(offset, dataset[tuple(slicing)])
+
+def convertLabelImage(options):
+    ''' read the label image frame by frame via the `LocalImageLoader`, which understands all ilastik label image styles '''
+    pluginManager = TrackingPluginManager(verbose=options.verbose, pluginPaths=options.pluginPaths)
+    pluginManager.setImageProvider('LocalImageLoader')
+    imageProvider = pluginManager.getImageProvider()
+    shape = tuple(imageProvider.getImageShape(options.label_image_filename, options.label_image_path))
+    timeRange = imageProvider.getTimeRange(options.label_image_filename, options.label_image_path)
+
+    array = ChunkedArray.create(os.path.join(options.output_dir, options.out_label_image_path),
+                                (timeRange[1],) + shape + (1,),
+                                getChunks('txyzc', (timeRange[1],) + shape + (1,), options.chunks),
+                                np.uint32,
+                                attrs={'axes': 'txyzc'})
+    for t in range(timeRange[0], timeRange[1]):
+        getLogger().debug("Converting label image of frame {}".format(t))
+        labelImage = imageProvider.getLabelImageForFrame(options.label_image_filename, options.label_image_path, t)
+        array.write((t, 0, 0, 0, 0), labelImage.reshape((1,) + shape + (1,)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Convert raw data and label images from HDF5 to directories of compressed chunks, '
+                    'which can be read concurrently by the ChunkedDirectoryImageLoader plugin',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-c', '--config', is_config_file=True, help='config file path')
+
+    parser.add_argument('--raw-data-file', type=str, dest='raw_filename', default=None,
+                        help='filename of the raw image HDF5 file')
+    parser.add_argument('--raw-data-path', type=str, dest='raw_path', default='exported_data',
+                        help='Path inside the raw data HDF5 file to the data')
+    parser.add_argument('--raw-data-axes', type=str, dest='raw_axes', default='txyzc',
+                        help='axes ordering of the raw data')
+    parser.add_argument('--label-image-file', type=str, dest='label_image_filename', default=None,
+                        help='Filename of the ilastik-style segmentation HDF5 file')
+    parser.add_argument('--label-image-path', dest='label_image_path', type=str,
+                        default='/TrackingFeatureExtraction/LabelImage/0000/[[%d, 0, 0, 0, 0], [%d, %d, %d, %d, 1]]',
+                        help='internal hdf5 path to label image')
+    parser.add_argument('--output-dir', type=str, dest='output_dir', required=True,
+                        help='Directory in which the chunked arrays are created')
+    parser.add_argument('--out-raw-data-path', type=str, dest='out_raw_path', default='raw',
+                        help='Path of the raw data array inside the output directory')
+    parser.add_argument('--out-label-image-path', type=str, dest='out_label_image_path', default='labelimage',
+                        help='Path of the label image array inside the output directory')
+    parser.add_argument('--chunk-shape', type=int, dest='chunks', nargs=3, default=[256, 256, 32],
+                        help='Chunk size along the x, y and z axes. Every frame is stored in separate chunks, channels are kept together.')
+    parser.add_argument('--plugin-paths', dest='pluginPaths', type=str, nargs='+',
+                        default=[os.path.abspath('../hytra/plugins')],
+                        help='A list of paths to search for plugins for the tracking pipeline.')
+    parser.add_argument("--verbose", dest='verbose', action='store_true', default=False)
+
+    options, unknown = parser.parse_known_args()
+
+    if options.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+    getLogger().debug("Ignoring unknown parameters: {}".format(unknown))
+
+    if options.raw_filename is not None:
+        getLogger().info("Converting raw data")
+        convertRawData(options)
+    if options.label_image_filename is not None:
+        getLogger().info("Converting label image")
+        convertLabelImage(options)
@@ -9,18 +9,25 @@ import sys
 sys.path.insert(0, os.path.abspath('..'))
 
 import logging
+import copy
 try:
     import commentjson as json
 except ImportError:
     import json
-import dpct
-from subprocess import check_call
 import configargparse as argparse
 import hytra.core.ilastik_project_options
+import hytra.core.splittracking
+import hytra.core.anytimetracking
+import hytra.core.jsongraph
+import hytra.core.eventexport
+import hytra.core.ctcexport
+import hytra.core.labelimageexport
+from hytra.core.pipelineengine import Pipeline
 from hytra.core.jsongraph import JsonTrackingGraph
 from hytra.core.ilastikhypothesesgraph import IlastikHypothesesGraph
 from hytra.core.fieldofview import FieldOfView
 from hytra.core.jsonmergerresolver import JsonMergerResolver
+from hytra.pluginsystem.plugin_manager import TrackingPluginManager
 
 def convertToDict(unknown):
     indicesOfParameters = [i for i, p in enumerate(unknown) if p.startswith('--')]
@@ -41,11 +48,86 @@ def constructFov(shape, t0, t1, scale=[1, 1, 1]):
                       zscale * (zshape - 1))
     return fov
 
+def getIlpOptions(params):
+    """
+    Set up the `IlastikProjectOptions` pointing to the raw data and label image given in the config file parameters
+    """
+    from hytra.core.ilastik_project_options import IlastikProjectOptions
+    ilpOptions = IlastikProjectOptions()
+    ilpOptions.labelImagePath = params[str('label-image-path')]
+    ilpOptions.labelImageFilename = params[str('label-image-file')]
+    ilpOptions.rawImagePath = params[str('raw-data-path')]
+    ilpOptions.rawImageFilename = params[str('raw-data-file')]
+    try:
+        ilpOptions.rawImageAxes = params[str('raw-data-axes')]
+    except:
+        ilpOptions.rawImageAxes = 'txyzc'
+    return ilpOptions
+
+def createGraph(options, params):
+    """
+    Build the hypotheses graph from the ilastik project, and return its model in our JSON format
+    """
+    import hytra.core.probabilitygenerator as probabilitygenerator
+    ilpOptions = getIlpOptions(params)
+    ilpOptions.sizeFilter = [int(params[str('min-size')]), 100000]
+
+    if 'object-count-classifier-file' in params:
+        ilpOptions.objectCountClassifierFilename = params[str('object-count-classifier-file')]
+    else:
+        ilpOptions.objectCountClassifierFilename = options.ilastik_tracking_project
+
+    withDivisions = 'without-divisions' not in params
+    if withDivisions:
+        if 'division-classifier-file' in params:
+            ilpOptions.divisionClassifierFilename = params[str('division-classifier-file')]
+        else:
+            ilpOptions.divisionClassifierFilename = options.ilastik_tracking_project
+    else:
+        ilpOptions.divisionClassifierFilename = None
+
+    probGenerator = probabilitygenerator.IlpProbabilityGenerator(ilpOptions, 
+                                          pluginPaths=[str('../hytra/plugins')],
+                                          useMultiprocessing=False)
+
+    # if time_range is not None:
+    #     traxelstore.timeRange = time_range
+
+    probGenerator.fillTraxels(usePgmlink=False)
+    fieldOfView = constructFov(probGenerator.shape,
+                               probGenerator.timeRange[0],
+                               probGenerator.timeRange[1],
+                               [probGenerator.x_scale,
+                               probGenerator.y_scale,
+                               probGenerator.z_scale])
+
+    hypotheses_graph = IlastikHypothesesGraph(
+        probabilityGenerator=probGenerator,
+        timeRange=probGenerator.timeRange,
+        maxNumObjects=int(params[str('max-number-objects')]),
+        numNearestNeighbors=int(params[str('max-nearest-neighbors')]),
+        fieldOfView=fieldOfView,
+        withDivisions=withDivisions,
+        divisionThreshold=0.1
+    )
+
+    withTracklets = True
+    if withTracklets:
+        hypotheses_graph = hypotheses_graph.generateTrackletGraph()
+
+    hypotheses_graph.insertEnergies()
+    return hypotheses_graph.toTrackingGraph().model
+
 def run_pipeline(options, unknown):
     """
-    Run the complete tracking pipeline by invoking the different steps.
+    Run the complete tracking pipeline by invoking the different steps in this process.
     Using the `do-SOMETHING` switches one can configure which parts of the pipeline are run.
 
+    The steps are stages of a `hytra.core.pipelineengine.Pipeline`: they pass their results in memory,
+    independent stages run in parallel unless they start worker processes themselves (tracking, merger resolving,
+    event and CTC export), and if a `--cache-dir` is given, stages whose configuration and input files did not change
+    since the last run are skipped. Results that were not proven optimal within the `--time-budget` are not cached.
+
     **Params:**
 
     * `options`: the options of the tracking script as returned from argparse
@@ -54,133 +136,228 @@ def run_pipeline(options, unknown):
     """
 
     params = convertToDict(unknown)
-    
+    pipeline = Pipeline(cacheDirectory=options.cache_dir, numWorkers=options.num_parallel_stages)
+    targets = []
+
+    # ------------------------------------------------------------
+    def getWeights():
+        if options.do_extract_weights:
+            logging.info("Extracting weights from ilastik project...")
+            return hytra.core.ilastik_project_options.extractWeightDictFromIlastikProject(options.ilastik_tracking_project)
+        else:
+            with open(options.weight_filename, 'r') as f:
+                return json.load(f)
+
     if options.do_extract_weights:
-        logging.info("Extracting weights from ilastik project...")
-        weights = hytra.core.ilastik_project_options.extractWeightDictFromIlastikProject(options.ilastik_tracking_project)
+        pipeline.addStage('weights', getWeights, config={'extract': True}, inputFiles=[options.ilastik_tracking_project])
     else:
-        with open(options.weight_filename, 'r') as f:
-            weights = json.load(f)
+        pipeline.addStage('weights', getWeights, config={'extract': False}, inputFiles=[options.weight_filename])
 
-    if options.do_create_graph:
-        logging.info("Create hypotheses graph...")
-
-        import hytra.core.probabilitygenerator as probabilitygenerator
-        from hytra.core.ilastik_project_options import IlastikProjectOptions
-        ilpOptions = IlastikProjectOptions()
-        ilpOptions.labelImagePath = params[str('label-image-path')]
-        ilpOptions.labelImageFilename = params[str('label-image-file')]
-        ilpOptions.rawImagePath = params[str('raw-data-path')]
-        ilpOptions.rawImageFilename = params[str('raw-data-file')]
-        try:
-            ilpOptions.rawImageAxes = params[str('raw-data-axes')]
-        except:
-            ilpOptions.rawImageAxes = 'txyzc'
-
-        ilpOptions.sizeFilter = [int(params[str('min-size')]), 100000]
-
-        if 'object-count-classifier-file' in params:
-            ilpOptions.objectCountClassifierFilename = params[str('object-count-classifier-file')]
+    # ------------------------------------------------------------
+    def getModel():
+        if options.do_create_graph:
+            logging.info("Create hypotheses graph...")
+            model = createGraph(options, params)
+            hytra.core.jsongraph.writeToFormattedJSON(options.model_filename, model)
+            trackingGraph = JsonTrackingGraph(model=model)
         else:
-            ilpOptions.objectCountClassifierFilename = options.ilastik_tracking_project
-
-        withDivisions = 'without-divisions' not in params
-        if withDivisions:
-            if 'division-classifier-file' in params:
-                ilpOptions.divisionClassifierFilename = params[str('division-classifier-file')]
-            else:
-                ilpOptions.divisionClassifierFilename = options.ilastik_tracking_project
-        else:
-            ilpOptions.divisionClassifierFilename = None
-
-        probGenerator = probabilitygenerator.IlpProbabilityGenerator(ilpOptions, 
-                                              pluginPaths=[str('../hytra/plugins')],
-                                              useMultiprocessing=False)
-
-        # if time_range is not None:
-        #     traxelstore.timeRange = time_range
-
-        probGenerator.fillTraxels(usePgmlink=False)
-        fieldOfView = constructFov(probGenerator.shape,
-                                   probGenerator.timeRange[0],
-                                   probGenerator.timeRange[1],
-                                   [probGenerator.x_scale,
-                                   probGenerator.y_scale,
-                                   probGenerator.z_scale])
-
-        hypotheses_graph = IlastikHypothesesGraph(
-            probabilityGenerator=probGenerator,
-            timeRange=probGenerator.timeRange,
-            maxNumObjects=int(params[str('max-number-objects')]),
-            numNearestNeighbors=int(params[str('max-nearest-neighbors')]),
-            fieldOfView=fieldOfView,
-            withDivisions=withDivisions,
-            divisionThreshold=0.1
-        )
-
-        withTracklets = True
-        if withTracklets:
-            hypotheses_graph = hypotheses_graph.generateTrackletGraph()
-
-        hypotheses_graph.insertEnergies()
-        trackingGraph = hypotheses_graph.toTrackingGraph()
-    else:
-        trackingGraph = JsonTrackingGraph(model_filename=options.model_filename)
+            trackingGraph = JsonTrackingGraph(model_filename=options.model_filename)
 
-    if options.do_convexify:
-        logging.info("Convexifying graph energies...")
-        trackingGraph.convexifyCosts()
+        if options.do_convexify:
+            logging.info("Convexifying graph energies...")
+            trackingGraph.convexifyCosts()
+        return trackingGraph.model
 
-    # get model out of trackingGraph
-    model = trackingGraph.model
+    if options.do_create_graph:
+        graphInputFiles = [options.ilastik_tracking_project] + \
+            [params[k] for k in ['label-image-file', 'raw-data-file', 'object-count-classifier-file', 'division-classifier-file'] if k in params]
+        pipeline.addStage('model', getModel, config={'params': params, 'convexify': options.do_convexify},
+                          inputFiles=graphInputFiles, outputFiles=[options.model_filename])
+    else:
+        pipeline.addStage('model', getModel, config={'convexify': options.do_convexify}, inputFiles=[options.model_filename])
 
-    if options.do_tracking:
+    # ------------------------------------------------------------
+    def track(model, weights):
         logging.info("Run tracking...")
         if options.solver == "flow-based":
-            result = dpct.trackFlowBased(model, weights)
+            solver = hytra.core.splittracking.trackFlowBased
         elif options.solver == "ilp":
-            try:
-                import multiHypoTracking_with_cplex as mht
-            except ImportError:
-                try:
-                    import multiHypoTracking_with_gurobi as mht
-                except ImportError:
-                    raise ImportError("Could not find multi hypotheses tracking ilp solver")
-            result = mht.track(model, weights)
-            
+            solver = hytra.core.splittracking.trackIlp
+        else:
+            raise ValueError("Unknown solver {}".format(options.solver))
+
+        if options.time_budget is not None:
+            logging.info("Tracking with a time budget of {} secs".format(options.time_budget))
+            result = hytra.core.anytimetracking.trackWithTimeBudget(model,
+                                                                    weights,
+                                                                    options.time_budget,
+                                                                    solver=solver,
+                                                                    numSplits=options.num_splits,
+                                                                    overlap=options.split_overlap)
+        elif options.num_splits > 1:
+            logging.info("Splitting tracking problem into {} time windows".format(options.num_splits))
+            splitTracking = hytra.core.splittracking.SplitTracking(model, weights, solver=solver)
+            result = splitTracking.track(numSplits=options.num_splits, overlap=options.split_overlap)
+        else:
+            result = solver(model, weights)
+
         hytra.core.jsongraph.writeToFormattedJSON(options.result_filename, result)
-        
-        if hypotheses_graph:
-            # insert the solution into the hypotheses graph and from that deduce the lineages
-            hypotheses_graph.insertSolution(result)
-            hypotheses_graph.computeLineage()
+        return result
 
+    def loadResult():
+        with open(options.result_filename, 'r') as f:
+            return json.load(f)
+
+    if options.do_tracking:
+        pipeline.addStage('result', track, dependencies=['model', 'weights'],
+                          config={'solver': options.solver,
+                                  'numSplits': options.num_splits,
+                                  'splitOverlap': options.split_overlap,
+                                  'timeBudget': options.time_budget},
+                          outputFiles=[options.result_filename],
+                          isCacheable=lambda result: result.get('provenOptimal', True),
+                          exclusive=True)
+        targets.append('result')
+    else:
+        # use the result of a previous tracking run
+        pipeline.addStage('result', loadResult, inputFiles=[options.result_filename])
+
+    # ------------------------------------------------------------
     if options.do_merger_resolving:
-        logging.info("Run merger resolving")
-        trackingGraph = JsonTrackingGraph(model=model, result=result)
-        merger_resolver = JsonMergerResolver(
-            trackingGraph,
-            ilpOptions.labelImageFilename,
-            ilpOptions.labelImagePath,
-            params[str('out-label-image-file')],
-            ilpOptions.rawImageFilename,
-            ilpOptions.rawImagePath,
-            ilpOptions.rawImageAxes,
-            [str('../hytra/plugins')],
-            True)
-        ilpOptions.labelImagePath = params[str('label-image-path')]
-        ilpOptions.labelImageFilename = params[str('label-image-file')]
-        ilpOptions.rawImagePath = params[str('raw-data-path')]
-        ilpOptions.rawImageFilename = params[str('raw-data-file')]
-        try:
-            ilpOptions.rawImageAxes = params[str('raw-data-axes')]
-        except:
-            ilpOptions.rawImageAxes = 'txyzc'
-        merger_resolver.run(None,  None)
-
-        ## resolved model and result are now here:
-        # merger_resolver.model
-        # merger_resolver.result
+        def resolveMergers(model, result):
+            logging.info("Run merger resolving")
+            ilpOptions = getIlpOptions(params)
+            # the merger resolver modifies the model in place, which must not change the output of the model stage
+            trackingGraph = JsonTrackingGraph(model=copy.deepcopy(model), result=copy.deepcopy(result))
+            merger_resolver = JsonMergerResolver(
+                trackingGraph,
+                ilpOptions.labelImageFilename,
+                ilpOptions.labelImagePath,
+                params[str('out-label-image-file')],
+                ilpOptions.rawImageFilename,
+                ilpOptions.rawImagePath,
+                ilpOptions.rawImageAxes,
+                [str('../hytra/plugins')],
+                True)
+            merger_resolver.run(None,  None, timeBudget=options.time_budget)
+
+            # resolved model and result are now here:
+            for key, value in [('out-graph-json-file', merger_resolver.model), ('out-result-json-file', merger_resolver.result)]:
+                if key in params:
+                    hytra.core.jsongraph.writeToFormattedJSON(params[key], value)
+            return merger_resolver.model, merger_resolver.result
+
+        outputFiles = [params[k] for k in ['out-graph-json-file', 'out-label-image-file', 'out-result-json-file'] if k in params]
+        pipeline.addStage('mergerResolving', resolveMergers, dependencies=['model', 'result'],
+                          config={'params': params, 'timeBudget': options.time_budget},
+                          inputFiles=[params[k] for k in ['label-image-file', 'raw-data-file'] if k in params],
+                          outputFiles=outputFiles,
+                          isCacheable=lambda modelAndResult: modelAndResult[1].get('provenOptimal', True),
+                          exclusive=True)
+        targets.append('mergerResolving')
+
+    # ------------------------------------------------------------
+    # the exports are independent of each other, but those that start worker processes run one at a time
+    if options.export_format is not None:
+        if options.do_merger_resolving:
+            exportDependencies = ['mergerResolving']
+            labelImageFilename = params[str('out-label-image-file')]
+            labelImageInputFiles = []
+        else:
+            exportDependencies = ['model', 'result']
+            labelImageFilename = params[str('label-image-file')]
+            labelImageInputFiles = [labelImageFilename]
+        labelImagePath = params[str('label-image-path')]
+        imageProviderName = params.get(str('image-provider'), 'LocalImageLoader')
+        numWorkers = int(params[str('num-workers')]) if 'num-workers' in params else None
+
+        def getModelAndResult(inputs):
+            if options.do_merger_resolving:
+                return inputs['mergerResolving']
+            return inputs['model'], inputs['result']
+
+        def exportEvents(**inputs):
+            model, result = getModelAndResult(inputs)
+            eventsPerTimestep = hytra.core.eventexport.getEventsPerTimestep(model, result)
+            hytra.core.eventexport.exportEvents(eventsPerTimestep,
+                                                labelImageFilename,
+                                                labelImagePath,
+                                                params.get(str('h5-event-out-dir'), '.'),
+                                                pluginPaths=[str('../hytra/plugins')],
+                                                imageProviderName=imageProviderName,
+                                                numWorkers=numWorkers,
+                                                verbose=options.verbose)
+
+        def getCtcTrackFilename():
+            return os.path.join(params[str('ctc-output-dir')],
+                                'man_track.txt' if 'is-ground-truth' in params else 'res_track.txt')
+
+        def exportCtc(**inputs):
+            model, result = getModelAndResult(inputs)
+            outputDir = params[str('ctc-output-dir')]
+            if not os.path.exists(outputDir):
+                os.makedirs(outputDir)
+            # computing the lineage annotates the graph, which must not change the outputs of previous stages
+            trackingGraph = JsonTrackingGraph(model=copy.deepcopy(model), result=copy.deepcopy(result))
+            hypothesesGraph = trackingGraph.toHypothesesGraph()
+            hypothesesGraph.computeLineage(1, 1, int(params.get(str('links-to-num-next-frames'), 1)))
+            lineage = hytra.core.ctcexport.getLineageArrays(hypothesesGraph)
+
+            pluginManager = TrackingPluginManager(verbose=options.verbose, pluginPaths=[str('../hytra/plugins')])
+            pluginManager.setImageProvider(imageProviderName)
+            timeRange = pluginManager.getImageProvider().getTimeRange(labelImageFilename, labelImagePath)
+            hytra.core.ctcexport.exportLabelImages(hytra.core.ctcexport.getFrameMappings(lineage),
+                                                   timeRange,
+                                                   pluginManager,
+                                                   labelImageFilename,
+                                                   labelImagePath,
+                                                   outputDir,
+                                                   filenamePrefix='man_track' if 'is-ground-truth' in params else 'mask',
+                                                   filenameZeroPadding=int(params.get(str('ctc-filename-zero-pad-length'), 3)),
+                                                   numWorkers=numWorkers)
+            # the track file is written last, its existence marks a complete export
+            hytra.core.ctcexport.saveTracks(hytra.core.ctcexport.getTrackTable(lineage), getCtcTrackFilename())
+
+        def exportLabelImage(**inputs):
+            model, result = getModelAndResult(inputs)
+            hytra.core.labelimageexport.exportLabelImage(model, result, labelImageFilename, labelImagePath,
+                                                         params[str('label-image-out')])
+
+        # export format -> stage name, stage function, relevant config parameters, files written by the stage,
+        # whether the stage starts worker processes
+        exportStages = {
+            'ilastikH5': ('events', exportEvents, ['h5-event-out-dir', 'image-provider'],
+                          lambda: [params.get(str('h5-event-out-dir'), '.')], True),
+            'ctc': ('ctc', exportCtc, ['ctc-output-dir', 'ctc-filename-zero-pad-length', 'is-ground-truth',
+                                       'links-to-num-next-frames', 'image-provider'],
+                    lambda: [getCtcTrackFilename()], True),
+            'labelimage': ('labelimage', exportLabelImage, ['label-image-out'],
+                           lambda: [params[str('label-image-out')]], False),
+        }
+
+        # every format is only exported once, even if it is given several times
+        exportFormats = []
+        for export_format in options.export_format.split(','):
+            if export_format not in exportFormats:
+                exportFormats.append(export_format)
+
+        for export_format in exportFormats:
+            if export_format not in exportStages:
+                logging.error("Unknown export format chosen!")
+                raise ValueError("Unknown export format chosen!")
+            logging.info("Convert result to {}...".format(export_format))
+            name, function, configKeys, getOutputFiles, exclusive = exportStages[export_format]
+            pipeline.addStage(name, function, dependencies=exportDependencies,
+                              config={'format': export_format,
+                                      'labelImage': [labelImageFilename, labelImagePath],
+                                      'params': dict((k, params[k]) for k in configKeys if k in params)},
+                              inputFiles=labelImageInputFiles,
+                              outputFiles=getOutputFiles(),
+                              exclusive=exclusive)
+            targets.append(name)
+
+    if len(targets) > 0:
+        pipeline.run(targets)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -198,9 +375,18 @@ if __name__ == "__main__":
     parser.add_argument("--do-tracking", dest='do_tracking', action='store_true', default=False)
     parser.add_argument("--do-merger-resolving", dest='do_merger_resolving', action='store_true', default=False)
     parser.add_argument("--export-format", dest='export_format', type=str, default=None,
-                        help='Export format may be one of: "ilastikH5", "ctc", "labelimage", or None')
+                        help='Export format may be one of: "ilastikH5", "ctc", "labelimage", or None. '
+                             'Several formats can be given separated by commas')
     parser.add_argument("--solver", dest='solver', default='flow-based', type=str,
                         help='Name of the solver to use, can be "ilp" or "flow-based"')
+    parser.add_argument("--num-splits", dest='num_splits', default=1, type=int,
+                        help='Into how many time windows the tracking problem should be split')
+    parser.add_argument("--split-overlap", dest='split_overlap', default=0, type=int,
+                        help='Number of frames by which the time windows are extended as context for tracking')
+    parser.add_argument("--time-budget", dest='time_budget', default=None, type=float,
+                        help='Maximum number of seconds for tracking and for merger resolving. If the solver does not '
+                             'finish in time, the best solution found so far is used and marked as not proven optimal. '
+                             'Combine with --num-splits to obtain a good initial solution quickly')
     parser.add_argument("--ilastik-tracking-project", dest='ilastik_tracking_project', required=True,
                         type=str, help='ilastik tracking project file that contains the chosen weights')
     parser.add_argument('--graph-json-file', required=True, type=str, dest='model_filename',
@@ -209,6 +395,11 @@ if __name__ == "__main__":
                         help='Filename of the json file containing results')
     parser.add_argument('--weight-json-file', required=True, type=str, dest='weight_filename',
                         help='Filename of the weights stored in json')
+    parser.add_argument("--cache-dir", dest='cache_dir', default=None, type=str,
+                        help='Directory where the results of all pipeline stages are cached. When the pipeline is run again, '
+                             'stages whose configuration and input files did not change are skipped')
+    parser.add_argument("--num-parallel-stages", dest='num_parallel_stages', default=None, type=int,
+                        help='Maximum number of independent pipeline stages that run at the same time, defaults to the number of CPUs')
     parser.add_argument("--verbose", dest='verbose', action='store_true', default=False)
 
     # parse command line
@@ -45,6 +45,10 @@ if __name__ == "__main__":
                         help='alpha for the transition prior')
     parser.add_argument('--verbose', dest='verbose', action='store_true',
                         help='Turn on verbose logging', default=False)
+    parser.add_argument('--use-multiprocessing', dest='use_multiprocessing', action='store_true',
+                        help='Fit the mergers within each frame in parallel processes', default=False)
+    parser.add_argument('--merger-resolver-plugin', dest='merger_resolver_plugin', type=str, default='GMMMergerResolver',
+                        help='Name of the merger resolver plugin, e.g. GMMMergerResolver or the faster EMMergerResolver')
     parser.add_argument('--plugin-paths', dest='pluginPaths', type=str, nargs='+',
                         default=[os.path.abspath('../hytra/plugins')],
                         help='A list of paths to search for plugins for the tracking pipeline.')
@@ -65,7 +69,9 @@ if __name__ == "__main__":
         args.raw_path,
         args.raw_axes,
         args.pluginPaths,
-        args.verbose)
+        args.verbose,
+        args.use_multiprocessing)
+    merger_resolver.setMergerResolverPlugin(args.merger_resolver_plugin)
     merger_resolver.run(
         args.transition_classifier_filename,
         args.transition_classifier_path)
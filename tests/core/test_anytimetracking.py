@@ -0,0 +1,53 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import multiprocessing
+from hytra.core.anytimetracking import trackWithTimeBudget
+
+def activateEverything(model, weights):
+    ''' dummy solver that uses every detection and link '''
+    return {'detectionResults': [{'id': d['id'], 'value': 1} for d in model['segmentationHypotheses']],
+            'linkingResults': [{'src': l['src'], 'dest': l['dest'], 'value': 1} for l in model['linkingHypotheses']],
+            'divisionResults': []}
+
+def getChainModel(numFrames=10):
+    ''' model of a single track over `numFrames` frames '''
+    model = {'segmentationHypotheses': [], 'linkingHypotheses': [], 'traxelToUniqueId': {}, 'settings': {}}
+    for t in range(numFrames):
+        model['segmentationHypotheses'].append({'id': t,
+                                                'features': [[1.0], [0.0]],
+                                                'appearanceFeatures': [[0.0], [5.0]],
+                                                'disappearanceFeatures': [[0.0], [5.0]]})
+        model['traxelToUniqueId'][str(t)] = {'1': t}
+        if t > 0:
+            model['linkingHypotheses'].append({'src': t - 1, 'dest': t, 'features': [[1.0], [0.0]]})
+    return model
+
+# never set, solvers waiting for it only return when their process is terminated
+neverFinished = multiprocessing.Event()
+
+def blockedOnFullModel(model, weights):
+    ''' dummy solver that only finishes on the small models of the time windows '''
+    if len(model['segmentationHypotheses']) > 5:
+        neverFinished.wait()
+    return activateEverything(model, weights)
+
+def test_finishedInTime():
+    model = getChainModel()
+    result = trackWithTimeBudget(model, None, 10.0, solver=activateEverything)
+    assert(result['provenOptimal'])
+    assert(all(d['value'] == 1 for d in result['detectionResults']))
+
+def test_timeBudgetExceeded():
+    model = getChainModel()
+    result = trackWithTimeBudget(model, None, 0.5, solver=blockedOnFullModel)
+    assert(not result['provenOptimal'])
+    assert(all(d['value'] == 0 for d in result['detectionResults']))
+
+    # the split tracking solution is used as best solution found so far
+    result = trackWithTimeBudget(model, None, 3.0, solver=blockedOnFullModel, numSplits=4)
+    assert(not result['provenOptimal'])
+    assert(len(result['detectionResults']) == len(model['segmentationHypotheses']))
+    assert(all(d['value'] == 1 for d in result['detectionResults']))
+
+if __name__ == "__main__":
+    test_finishedInTime()
+    test_timeBudgetExceeded()
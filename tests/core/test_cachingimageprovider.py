@@ -0,0 +1,64 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import numpy as np
+from hytra.pluginsystem.image_provider_plugin import ImageProviderPlugin
+from hytra.pluginsystem.caching_image_provider import CachingImageProvider
+
+class InMemoryImageProvider(ImageProviderPlugin):
+    ''' serves frames of 10x10 pixels (800 bytes) and remembers which frames were read '''
+    def __init__(self, numFrames):
+        self.frames = [np.full((10, 10), t, dtype=np.float64) for t in range(numFrames)]
+        self.reads = []
+
+    def getImageDataAtTimeFrame(self, Resource, PathInResource, axes, timeframe):
+        self.reads.append(('raw', timeframe))
+        return self.frames[timeframe]
+
+    def getLabelImageForFrame(self, Resource, PathInResource, timeframe):
+        self.reads.append(('label', timeframe))
+        return self.frames[timeframe]
+
+    def getTimeRange(self, Resource, PathInResource):
+        return (0, len(self.frames))
+
+    def getImageDataTimeRange(self, Resource, PathInResource, axes):
+        return (0, len(self.frames))
+
+def test_leastRecentlyUsedEviction():
+    imageProvider = InMemoryImageProvider(3)
+    cache = CachingImageProvider(imageProvider, maxCacheBytes=2 * 800, readAhead=0)
+    for t in [0, 1, 0, 2]:
+        assert(cache.getLabelImageForFrame('file', 'path', t)[0, 0] == t)
+    # frame 1 was used least recently when frame 2 had to be stored
+    assert(imageProvider.reads == [('label', 0), ('label', 1), ('label', 2)])
+    cache.getLabelImageForFrame('file', 'path', 0)
+    cache.getLabelImageForFrame('file', 'path', 1)
+    assert(imageProvider.reads[3:] == [('label', 1)])
+
+    # returned frames are copies
+    cache.getLabelImageForFrame('file', 'path', 1)[:] = 42
+    assert(cache.getLabelImageForFrame('file', 'path', 1)[0, 0] == 1)
+
+def test_readAheadHit():
+    imageProvider = InMemoryImageProvider(3)
+    cache = CachingImageProvider(imageProvider, readAhead=2)
+    try:
+        for t in range(3):
+            assert(cache.getLabelImageForFrame('file', 'path', t)[0, 0] == t)
+            assert(cache.getImageDataAtTimeFrame('file', 'path', 'txy', t)[0, 0] == t)
+        cache.releaseResource('file')
+    finally:
+        cache.close()
+    # every frame was read exactly once, and nothing was read beyond the last frame
+    assert(sorted(imageProvider.reads) == [(kind, t) for kind in ['label', 'raw'] for t in range(3)])
+
+def test_frameTooLargeToCache():
+    imageProvider = InMemoryImageProvider(3)
+    cache = CachingImageProvider(imageProvider, maxCacheBytes=100, readAhead=2)
+    try:
+        for t in [0, 1, 0]:
+            assert(cache.getLabelImageForFrame('file', 'path', t)[0, 0] == t)
+        # once a frame is known not to fit, frames are neither cached nor read ahead
+        cache.releaseResource('file')
+        assert(imageProvider.reads == [('label', 0), ('label', 1), ('label', 0)])
+    finally:
+        cache.close()
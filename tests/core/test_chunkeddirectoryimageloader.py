@@ -0,0 +1,107 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import os
+import imp
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import h5py
+from hytra.pluginsystem.plugin_manager import TrackingPluginManager
+from hytra.util.chunkedarray import ChunkedArray
+
+labelImagePath = '/TrackingFeatureExtraction/LabelImage/0000/[[%d, 0, 0, 0, 0], [%d, %d, %d, %d, 1]]'
+
+def getImageProvider(name):
+    pluginManager = TrackingPluginManager(pluginPaths=['hytra/plugins'], verbose=False)
+    pluginManager.setImageProvider(name)
+    return pluginManager.getImageProvider()
+
+def getRegions(shape):
+    ''' regions inside one chunk, spanning several chunks, and at the border of an image of the given `shape` '''
+    regions = [((1, 2, 0), (3, 2, 1)), ((3, 2, 0), (7, 6, 1)), ((shape[0] - 4, shape[1] - 3, 0), (4, 3, 1))]
+    return [(offset[:len(shape)], tuple(min(s, d) for s, d in zip(size, shape))) for offset, size in regions]
+
+def test_exportLabelImageRoundTrip():
+    tempDir = tempfile.mkdtemp()
+    try:
+        rng = np.random.RandomState(0)
+        # shapes that are no multiple of the chunk shape, such that there are chunks at the border
+        for shape in [(13, 9), (13, 9, 5)]:
+            frames = [rng.randint(0, 1000, size=shape).astype(np.uint32) for _ in range(3)]
+            frames[0][0, 0] = np.iinfo(np.uint16).max + 10
+            imageProvider = getImageProvider('ChunkedDirectoryImageLoader')
+            imageProvider.exportChunks = (4, 4, 2)
+            path = 'labelimage{}d'.format(len(shape))
+            # the array is created for frame 1, and grows when frame 2 is exported
+            for t in [1, 0, 2]:
+                imageProvider.exportLabelImage(frames[t], t, tempDir, path)
+            assert(ChunkedArray(os.path.join(tempDir, path)).chunks == (1, 4, 4, 2 if len(shape) == 3 else 1, 1))
+
+            imageProvider = getImageProvider('ChunkedDirectoryImageLoader')
+            assert(imageProvider.getTimeRange(tempDir, path) == (0, 3))
+            assert(tuple(imageProvider.getImageShape(tempDir, path)) == (shape + (1,))[:3])
+            # labels that do not fit into 16 bits saturate
+            expectedFrames = [np.minimum(f, np.iinfo(np.uint16).max) for f in frames]
+            for t, frame in enumerate(expectedFrames):
+                assert(np.array_equal(imageProvider.getLabelImageForFrame(tempDir, path, t), frame))
+                for offset, size in getRegions(shape):
+                    region = imageProvider.getLabelImageRegion(tempDir, path, t, offset, size)
+                    assert(np.array_equal(region, frame[tuple(slice(o, o + s) for o, s in zip(offset, size))]))
+    finally:
+        shutil.rmtree(tempDir)
+
+def convertWithScript(h5Filename, rawAxes, outputDir):
+    ''' convert raw data and label image from `h5Filename` with `scripts/h5_to_chunked_directory.py` '''
+    script = imp.load_source('h5_to_chunked_directory', os.path.join('scripts', 'h5_to_chunked_directory.py'))
+    options = argparse.Namespace(raw_filename=h5Filename,
+                                 raw_path='exported_data',
+                                 raw_axes=rawAxes,
+                                 label_image_filename=h5Filename,
+                                 label_image_path=labelImagePath,
+                                 output_dir=outputDir,
+                                 out_raw_path='raw',
+                                 out_label_image_path='labelimage',
+                                 chunks=[4, 4, 2],
+                                 pluginPaths=['hytra/plugins'],
+                                 verbose=False)
+    script.convertRawData(options)
+    script.convertLabelImage(options)
+
+def test_conversionScriptRoundTrip():
+    tempDir = tempfile.mkdtemp()
+    try:
+        rng = np.random.RandomState(1)
+        shape = (13, 9, 3)
+        labelImages = [rng.randint(0, 100, size=shape).astype(np.uint32) for _ in range(3)]
+        # raw data with an axes order different from txyzc and two channels
+        raw = rng.randint(0, 255, size=(3, 3, 9, 13, 2)).astype(np.uint8)
+        rawAxes = 'tzyxc'
+        h5Filename = os.path.join(tempDir, 'data.h5')
+        with h5py.File(h5Filename, 'w') as h5file:
+            h5file.create_dataset('exported_data', data=raw)
+            for t, labelImage in enumerate(labelImages):
+                h5file.create_dataset(labelImagePath % (t, t + 1, shape[0], shape[1], shape[2]),
+                                      data=labelImage[np.newaxis, ..., np.newaxis])
+        outputDir = os.path.join(tempDir, 'chunked')
+        convertWithScript(h5Filename, rawAxes, outputDir)
+
+        h5Loader = getImageProvider('LocalImageLoader')
+        chunkedLoader = getImageProvider('ChunkedDirectoryImageLoader')
+        assert(chunkedLoader.getTimeRange(outputDir, 'labelimage') == h5Loader.getTimeRange(h5Filename, labelImagePath))
+        assert(tuple(chunkedLoader.getImageShape(outputDir, 'labelimage'))
+               == tuple(h5Loader.getImageShape(h5Filename, labelImagePath)))
+        assert(chunkedLoader.getImageDataTimeRange(outputDir, 'raw', rawAxes)
+               == h5Loader.getImageDataTimeRange(h5Filename, 'exported_data', rawAxes))
+        for t in range(3):
+            assert(np.array_equal(chunkedLoader.getLabelImageForFrame(outputDir, 'labelimage', t),
+                                  h5Loader.getLabelImageForFrame(h5Filename, labelImagePath, t)))
+            assert(np.array_equal(chunkedLoader.getImageDataAtTimeFrame(outputDir, 'raw', rawAxes, t),
+                                  h5Loader.getImageDataAtTimeFrame(h5Filename, 'exported_data', rawAxes, t)))
+            for offset, size in getRegions(shape):
+                assert(np.array_equal(chunkedLoader.getLabelImageRegion(outputDir, 'labelimage', t, offset, size),
+                                      h5Loader.getLabelImageRegion(h5Filename, labelImagePath, t, offset, size)))
+                assert(np.array_equal(chunkedLoader.getImageDataRegion(outputDir, 'raw', rawAxes, t, offset, size),
+                                      h5Loader.getImageDataRegion(h5Filename, 'exported_data', rawAxes, t, offset, size)))
+        h5Loader.releaseResource(h5Filename)
+    finally:
+        shutil.rmtree(tempDir)
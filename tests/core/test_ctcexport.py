@@ -0,0 +1,81 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import numpy as np
+import hytra.core.hypothesesgraph as hg
+import hytra.core.probabilitygenerator as pg
+from hytra.core import ctcexport
+
+def getLineage():
+    '''
+    Lineage of a graph where
+    * the object at (0, 1) divides at (1, 1) into (2, 1) and (2, 2),
+    * (0, 2) is linked to (2, 3), skipping frame 1,
+    * (1, 3) is not part of the tracking result
+    '''
+    h = hg.HypothesesGraph()
+    h._graph.add_path([(0, 1), (1, 1), (2, 1)])
+    h._graph.add_edge((1, 1), (2, 2))
+    h._graph.add_edge((0, 2), (2, 3), gap=2)
+    h._graph.add_node((1, 3))
+    for i, n in enumerate(sorted(h._graph.nodes())):
+        h._graph.node[n]['id'] = i
+        h._graph.node[n]['traxel'] = pg.Traxel()
+        h._graph.node[n]['traxel'].Id = n[1]
+        h._graph.node[n]['traxel'].Timestep = n[0]
+    ids = dict((n, h._graph.node[n]['id']) for n in h._graph.nodes())
+
+    solutionDict = {
+        'detectionResults': [{'id': ids[n], 'value': 0 if n == (1, 3) else 1} for n in ids],
+        'linkingResults': [{'src': ids[a], 'dest': ids[b], 'value': 1} for a, b in h._graph.edges()],
+        'divisionResults': [{'id': ids[(1, 1)], 'value': True}]
+    }
+    h.insertSolution(solutionDict)
+    h.computeLineage(1, 1, 1)
+    return ctcexport.getLineageArrays(h)
+
+def test_lineageArrays():
+    lineage = getLineage()
+    assert(sorted(lineage.keys()) == ['gapParent', 'objectId', 'parent', 'timestep', 'trackId'])
+    assert(all(len(v) == 7 for v in lineage.values()))
+    rows = dict(((t, o), (trackId, parent, gapParent)) for t, o, trackId, parent, gapParent
+                in zip(lineage['timestep'], lineage['objectId'], lineage['trackId'], lineage['parent'], lineage['gapParent']))
+
+    motherTrack = rows[(0, 1)][0]
+    assert(rows[(1, 1)] == (motherTrack, 0, 0))
+    # both children get new tracks with the mother as parent
+    assert(rows[(2, 1)][1:] == (motherTrack, 0))
+    assert(rows[(2, 2)][1:] == (motherTrack, 0))
+    assert(len(set([motherTrack, rows[(2, 1)][0], rows[(2, 2)][0]])) == 3)
+    # a link skipping frames starts a new track
+    assert(rows[(2, 3)][0] != rows[(0, 2)][0])
+    assert(rows[(2, 3)][1:] == (0, rows[(0, 2)][0]))
+    # untracked objects have no track
+    assert(rows[(1, 3)] == (0, 0, 0))
+
+def test_trackTable():
+    lineage = getLineage()
+    trackOf = dict(((t, o), trackId) for t, o, trackId in zip(lineage['timestep'], lineage['objectId'], lineage['trackId']))
+    trackTable = ctcexport.getTrackTable(lineage)
+
+    assert(trackTable.shape == (5, 4))
+    assert(list(trackTable[:, 0]) == sorted(trackTable[:, 0]))
+    tracks = dict((row[0], tuple(row[1:])) for row in trackTable.tolist())
+    assert(tracks[trackOf[(0, 1)]] == (0, 1, 0))
+    assert(tracks[trackOf[(2, 1)]] == (2, 2, trackOf[(0, 1)]))
+    assert(tracks[trackOf[(2, 2)]] == (2, 2, trackOf[(0, 1)]))
+    assert(tracks[trackOf[(0, 2)]] == (0, 0, 0))
+    assert(tracks[trackOf[(2, 3)]] == (2, 2, trackOf[(0, 2)]))
+
+def test_frameMappings():
+    lineage = getLineage()
+    trackOf = dict(((t, o), trackId) for t, o, trackId in zip(lineage['timestep'], lineage['objectId'], lineage['trackId']))
+    mappings = ctcexport.getFrameMappings(lineage)
+
+    assert(sorted(mappings.keys()) == [0, 1, 2])
+    assert(mappings[0] == {1: trackOf[(0, 1)], 2: trackOf[(0, 2)]})
+    # the untracked object is mapped to the background, and frame 1 has no object of the gap link
+    assert(mappings[1] == {1: trackOf[(1, 1)], 3: 0})
+    assert(mappings[2] == {1: trackOf[(2, 1)], 2: trackOf[(2, 2)], 3: trackOf[(2, 3)]})
+
+    emptyLineage = dict((k, np.zeros(0, dtype=np.int64)) for k in lineage.keys())
+    assert(ctcexport.getTrackTable(emptyLineage).shape == (0, 4))
+    assert(ctcexport.getFrameMappings(emptyLineage) == {})
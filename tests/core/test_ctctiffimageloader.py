@@ -0,0 +1,108 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import os
+import imp
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import concurrent.futures
+from skimage.external import tifffile
+from hytra.pluginsystem.plugin_manager import TrackingPluginManager
+from hytra.util.tiffsequence import getTiffSequence
+
+labelImagePath = '/TrackingFeatureExtraction/LabelImage/0000/[[%d, 0, 0, 0, 0], [%d, %d, %d, %d, 1]]'
+
+def getImageProvider(name):
+    pluginManager = TrackingPluginManager(pluginPaths=['hytra/plugins'], verbose=False)
+    pluginManager.setImageProvider(name)
+    return pluginManager.getImageProvider()
+
+def writeSequence(directory, frames):
+    ''' write the `frames` as `man_seg000.tif, ...` like in the Cell Tracking Challenge '''
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    for t, frame in enumerate(frames):
+        tifffile.imsave(os.path.join(directory, 'man_seg{:03d}.tif'.format(t)), frame.astype(np.uint16))
+
+def convertWithScript(directory, tiffAxes, h5Filename):
+    ''' convert the sequence in `directory` to HDF5 with `scripts/ctc/segmentation_to_hdf5.py` '''
+    script = imp.load_source('segmentation_to_hdf5', os.path.join('scripts', 'ctc', 'segmentation_to_hdf5.py'))
+    options = argparse.Namespace(tif_input_files=getTiffSequence(os.path.join(directory, 'man_seg*.tif')),
+                                 tif_input_axes=tiffAxes,
+                                 hdf5Path=h5Filename,
+                                 hdf5ImagePath=labelImagePath,
+                                 hdf5ImageChunks=None)
+    script.segmentation_to_hdf5(options)
+
+def test_axisOrderMatchesConversionScript():
+    tempDir = tempfile.mkdtemp()
+    try:
+        rng = np.random.RandomState(0)
+        # 2D files are read as xy, 3D files as zyx, the shapes are chosen such that mixing up axes fails
+        for tiffAxes, shape in [('xy', (7, 5)), ('zyx', (3, 7, 5))]:
+            directory = os.path.join(tempDir, tiffAxes)
+            writeSequence(directory, [rng.randint(0, 10, size=shape) for _ in range(3)])
+            h5Filename = os.path.join(tempDir, tiffAxes + '.h5')
+            convertWithScript(directory, tiffAxes, h5Filename)
+
+            tiffLoader = getImageProvider('CTCTiffImageLoader')
+            h5Loader = getImageProvider('LocalImageLoader')
+            assert(tiffLoader.getTimeRange(directory, 'man_seg*.tif') == h5Loader.getTimeRange(h5Filename, labelImagePath))
+            assert(tuple(tiffLoader.getImageShape(directory, 'man_seg*.tif'))
+                   == tuple(h5Loader.getImageShape(h5Filename, labelImagePath)))
+            for t in range(3):
+                assert(np.array_equal(tiffLoader.getLabelImageForFrame(directory, 'man_seg*.tif', t),
+                                      h5Loader.getLabelImageForFrame(h5Filename, labelImagePath, t)))
+            h5Loader.releaseResource(h5Filename)
+    finally:
+        shutil.rmtree(tempDir)
+
+def test_reindexAfterFileWasAdded():
+    tempDir = tempfile.mkdtemp()
+    try:
+        frames = [np.full((6, 4), t, dtype=np.uint16) for t in range(3)]
+        writeSequence(tempDir, frames[:2])
+        tiffLoader = getImageProvider('CTCTiffImageLoader')
+        assert(tiffLoader.getTimeRange(tempDir, 'man_seg*.tif') == (0, 2))
+
+        writeSequence(tempDir, frames)
+        # make sure the directory looks modified, even on file systems with a coarse timestamp resolution
+        modificationTime = os.stat(tempDir).st_mtime + 2
+        os.utime(tempDir, (modificationTime, modificationTime))
+        assert(tiffLoader.getTimeRange(tempDir, 'man_seg*.tif') == (0, 3))
+        assert(np.all(tiffLoader.getLabelImageForFrame(tempDir, 'man_seg*.tif', 2) == 2))
+    finally:
+        shutil.rmtree(tempDir)
+
+def test_exportLabelImageRoundTrip():
+    tempDir = tempfile.mkdtemp()
+    try:
+        rng = np.random.RandomState(1)
+        tiffLoader = getImageProvider('CTCTiffImageLoader')
+        for name, shape in [('2d', (7, 5)), ('3d', (7, 5, 3))]:
+            directory = os.path.join(tempDir, name)
+            frames = [rng.randint(0, 1000, size=shape).astype(np.uint32) for _ in range(3)]
+            for t, frame in enumerate(frames):
+                tiffLoader.exportLabelImage(frame, t, directory, 'mask*.tif')
+            assert(os.path.exists(os.path.join(directory, 'mask002.tif')))
+            assert(tiffLoader.getTimeRange(directory, 'mask*.tif') == (0, 3))
+            for t, frame in enumerate(frames):
+                assert(np.array_equal(tiffLoader.getLabelImageForFrame(directory, 'mask*.tif', t), frame))
+    finally:
+        shutil.rmtree(tempDir)
+
+def test_concurrentReads():
+    tempDir = tempfile.mkdtemp()
+    try:
+        frames = [np.full((6, 4), t, dtype=np.uint16) for t in range(8)]
+        writeSequence(tempDir, frames)
+        tiffLoader = getImageProvider('CTCTiffImageLoader')
+
+        def readFrame(t):
+            return t, tiffLoader.getLabelImageForFrame(tempDir, 'man_seg*.tif', t)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            for t, frame in executor.map(readFrame, [t % 8 for t in range(200)]):
+                assert(np.all(frame == t))
+    finally:
+        shutil.rmtree(tempDir)
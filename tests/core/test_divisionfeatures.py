@@ -0,0 +1,33 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import numpy as np
+from hytra.core.divisionfeatures import FeatureManager
+
+def getFeatures(regionCenters):
+    ''' features of the given objects, row 0 is the background '''
+    return {'RegionCenter': np.array([[0.0, 0.0]] + regionCenters),
+            'Count': np.array([0.0] + [5.0] * len(regionCenters))}
+
+def test_templateRegionMatchesFullFrame():
+    # the template of size 50 around a center at 24.5 ends at 25 + 25 = 50, so it covers the object at 49
+    featuresAtT = getFeatures([[24.5, 24.5]])
+    featuresAtTPlus1 = getFeatures([[49.0, 49.0], [10.0, 30.0], [70.0, 70.0]])
+    labelImageAtTPlus1 = np.zeros((100, 100), dtype=np.uint32)
+    for label, (x, y) in enumerate(featuresAtTPlus1['RegionCenter'][1:]):
+        labelImageAtTPlus1[int(x), int(y)] = label + 1
+
+    featureNames = ['ParentChildrenRatio_Count', 'ChildrenRatio_Count', 'ParentChildrenAngle_RegionCenter']
+    fm = FeatureManager(ndim=2)
+    offset, shape = fm.getTemplateRegion(featuresAtT, labelImageAtTPlus1.shape)
+    assert(offset == (0, 0))
+    assert(shape == (50, 50))
+
+    region = labelImageAtTPlus1[tuple(slice(o, o + s) for o, s in zip(offset, shape))]
+    regionFeatures = fm.computeFeatures_at(featuresAtT, featuresAtTPlus1, region, featureNames, img_next_offset=offset)
+    fullFrameFeatures = fm.computeFeatures_at(featuresAtT, featuresAtTPlus1, labelImageAtTPlus1, featureNames)
+
+    assert(set(regionFeatures.keys()) == set(fullFrameFeatures.keys()))
+    for name in fullFrameFeatures:
+        assert(np.allclose(regionFeatures[name], fullFrameFeatures[name]))
+    # both children were found
+    assert(fullFrameFeatures['SquaredDistances_1'][1] < 9999)
+    assert(fullFrameFeatures['SquaredDistances_2'][1] == 9999)
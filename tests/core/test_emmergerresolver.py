@@ -0,0 +1,74 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import numpy as np
+from hytra.pluginsystem.plugin_manager import TrackingPluginManager
+
+def getMergerResolver():
+    pluginManager = TrackingPluginManager(pluginPaths=['hytra/plugins'], verbose=False)
+    pluginManager.setMergerResolver('EMMergerResolver')
+    return pluginManager.getMergerResolver()
+
+def getBlobCoordinates(centers, radius=3):
+    ''' pixel coordinates of discs (or balls) around the given `centers`, as one would find them in a label image '''
+    coordinates = []
+    for center in centers:
+        center = np.array(center)
+        grid = np.indices([2 * radius + 1] * len(center)).reshape(len(center), -1).T - radius
+        disc = grid[(grid**2).sum(axis=1) <= radius**2]
+        coordinates.append(disc + center)
+    return np.vstack(coordinates)
+
+def assertFitsMatchCenters(fits, centers):
+    assert(len(fits) == len(centers))
+    means = sorted(tuple(f[2]) for f in fits)
+    for mean, center in zip(means, sorted(tuple(c) for c in centers)):
+        assert(np.allclose(mean, center, atol=0.5))
+    assert(np.isclose(sum(f[0] for f in fits), 1.0))
+
+def test_findsWellSeparatedBlobs():
+    resolver = getMergerResolver()
+    centers2D = [(10, 10), (10, 40)]
+    assertFitsMatchCenters(resolver.resolveMergerForCoords(getBlobCoordinates(centers2D), 2), centers2D)
+
+    centers3D = [(10, 10, 10), (30, 10, 5), (10, 35, 20)]
+    assertFitsMatchCenters(resolver.resolveMergerForCoords(getBlobCoordinates(centers3D), 3), centers3D)
+
+def test_paddedComponents():
+    # mergers of different counts in one frame are fitted together, padded to the maximum count
+    resolver = getMergerResolver()
+    centersPerObject = [[(5, 5)], [(50, 10), (50, 40), (80, 25)], [(20, 60), (20, 90)]]
+    fitsPerObject = resolver.resolveMergersForCoords([getBlobCoordinates(c) for c in centersPerObject],
+                                                     [len(c) for c in centersPerObject],
+                                                     [[], [], []])
+    assert(len(fitsPerObject) == len(centersPerObject))
+    for fits, centers in zip(fitsPerObject, centersPerObject):
+        assertFitsMatchCenters(fits, centers)
+        # no padding component may leak into the result
+        assert(all(f[0] > 0 for f in fits))
+
+    # the result does not depend on the other objects in the batch
+    singleFits = resolver.resolveMergerForCoords(getBlobCoordinates(centersPerObject[2]), 2)
+    assert(np.allclose(sorted(tuple(f[2]) for f in singleFits), sorted(tuple(f[2]) for f in fitsPerObject[2]), atol=1e-3))
+
+def test_fitFormatMatchesGMMMergerResolver():
+    # fits are (weight, variances, mean), with one variance per dimension as the diagonal GMM covariances
+    resolver = getMergerResolver()
+    centers = [(10, 10), (10, 40)]
+    fits = resolver.resolveMergerForCoords(getBlobCoordinates(centers), 2)
+    for weight, variances, mean in fits:
+        assert(np.isscalar(weight))
+        assert(np.asarray(variances).shape == (2,))
+        assert(np.all(np.asarray(variances) > 0))
+        assert(np.asarray(mean).shape == (2,))
+
+    # the fits serve as initializations in the next frame, and the nearest ones are used
+    movedCenters = [(12, 11), (11, 42)]
+    movedFits = resolver.resolveMergerForCoords(getBlobCoordinates(movedCenters), 2, initializations=fits)
+    assertFitsMatchCenters(movedFits, movedCenters)
+
+    # and they can be used to split the merger in the label image
+    labelImage = np.zeros((25, 55), dtype=np.uint32)
+    coordinates = getBlobCoordinates(centers)
+    labelImage[coordinates[:, 0], coordinates[:, 1]] = 1
+    resolver.updateLabelImage(labelImage, 1, fits, [2, 3])
+    assert(set(np.unique(labelImage)) == set([0, 2, 3]))
+    assert(labelImage[10, 10] != labelImage[10, 40])
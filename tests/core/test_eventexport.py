@@ -0,0 +1,29 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+from hytra.core.eventexport import getEventsPerTimestep
+
+def test_eventsPerTimestep():
+    # frame 2 is empty, the object at (0, 1) divides and also has a link that skips to frame 3
+    model = {'traxelToUniqueId': {'0': {'1': 0, '2': 1},
+                                  '1': {'1': 2, '2': 3, '3': 4},
+                                  '2': {},
+                                  '3': {'1': 5}}}
+    result = {'detectionResults': [{'id': i, 'value': 2 if i == 4 else 1} for i in range(6)],
+              'linkingResults': [{'src': 0, 'dest': 2, 'value': 1},
+                                 {'src': 0, 'dest': 3, 'value': 1},
+                                 {'src': 1, 'dest': 4, 'value': 1},
+                                 {'src': 0, 'dest': 5, 'value': 1},
+                                 {'src': 1, 'dest': 2, 'value': 0}],
+              'divisionResults': [{'id': 0, 'value': True}, {'id': 1, 'value': False}]}
+
+    events = getEventsPerTimestep(model, result)
+    assert(sorted(events.keys()) == [0, 1, 2, 3])
+    assert(events[0] == {'moves': [], 'splits': {}, 'mergers': {}})
+
+    assert(sorted(events[1]['moves']) == [(1, 1), (1, 2), (2, 3)])
+    assert(list(events[1]['splits'].keys()) == [1])
+    assert(sorted(events[1]['splits'][1]) == [1, 2])
+    assert(events[1]['mergers'] == {3: 2})
+
+    assert(events[2] == {'moves': [], 'splits': {}, 'mergers': {}})
+    # the link skipping frame 2 is a move into frame 3, but no child of the division
+    assert(events[3] == {'moves': [(1, 1)], 'splits': {}, 'mergers': {}})
@@ -0,0 +1,66 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import os
+import shutil
+import tempfile
+import numpy as np
+import h5py
+from hytra.pluginsystem.plugin_manager import TrackingPluginManager
+from hytra.core.probabilitygenerator import computeRegionFeaturesOnCloud
+
+def test_npzFeatureSerializer():
+    pluginManager = TrackingPluginManager(pluginPaths=['hytra/plugins'], verbose=False)
+    pluginManager.setFeatureSerializer('NpzFeatureSerializer')
+    featureSerializer = pluginManager.getFeatureSerializer()
+    featureSerializer.feature_directory = tempfile.mkdtemp()
+    try:
+        features = {'Count': np.arange(5, dtype=np.float32),
+                    'RegionCenter': np.random.rand(5, 2),
+                    'Global<Maximum >': 255.0}
+        featureSerializer.storeFeaturesForFrame(features, 3)
+        featureSerializer.storeFeaturesForFrame({'Count': np.ones(2)}, 0)
+
+        loaded = featureSerializer.loadFeaturesForFrame(None, 3)
+        assert(sorted(loaded.keys()) == sorted(features.keys()))
+        assert(loaded['Count'].dtype == np.float32)
+        assert(np.array_equal(loaded['RegionCenter'], features['RegionCenter']))
+        assert(loaded['Global<Maximum >'] == 255.0)
+
+        loaded = featureSerializer.loadFeaturesForFrame(['Count'], 0)
+        assert(list(loaded.keys()) == ['Count'])
+        assert(np.array_equal(loaded['Count'], np.ones(2)))
+    finally:
+        shutil.rmtree(featureSerializer.feature_directory)
+
+def test_computeRegionFeaturesWithNpzSerializer():
+    tempDir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tempDir, 'data.h5')
+        labelImagePath = '/LabelImage/[[%d, 0, 0, 0, 0], [%d, %d, %d, %d, 1]]'
+        labelImage = np.zeros((20, 10), dtype=np.uint16)
+        labelImage[2:6, 2:5] = 1
+        labelImage[10:18, 4:9] = 2
+        with h5py.File(filename, 'w') as h5file:
+            h5file.create_dataset('raw', data=np.random.rand(2, 20, 10).astype(np.float32))
+            for t in range(2):
+                h5file.create_dataset(labelImagePath % (t, t + 1, 20, 10, 1), data=labelImage[np.newaxis, :, :, np.newaxis, np.newaxis])
+
+        frame, features = computeRegionFeaturesOnCloud(1, filename, 'raw', 'txy', filename, labelImagePath, [], ['hytra/plugins'])
+        assert(frame == 1)
+
+        # with the npz serializer, the features are stored in the feature directory instead of being returned
+        featureDirectory = os.path.join(tempDir, 'features')
+        frame, stored = computeRegionFeaturesOnCloud(1, filename, 'raw', 'txy', filename, labelImagePath, [], ['hytra/plugins'],
+                                                     featureSerializerPluginName='NpzFeatureSerializer',
+                                                     featureDirectory=featureDirectory)
+        assert(frame == 1 and stored is None)
+
+        pluginManager = TrackingPluginManager(pluginPaths=['hytra/plugins'], verbose=False)
+        pluginManager.setFeatureSerializer('NpzFeatureSerializer')
+        featureSerializer = pluginManager.getFeatureSerializer()
+        featureSerializer.feature_directory = featureDirectory
+        loaded = featureSerializer.loadFeaturesForFrame(None, 1)
+        assert(sorted(loaded.keys()) == sorted(features.keys()))
+        for name in features:
+            assert(np.allclose(loaded[name], features[name]))
+    finally:
+        shutil.rmtree(tempDir)
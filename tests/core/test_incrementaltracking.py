@@ -0,0 +1,74 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import numpy as np
+from hytra.core.probabilitygenerator import Traxel
+from hytra.core.fieldofview import FieldOfView
+from hytra.core.ilastikhypothesesgraph import IlastikHypothesesGraph
+from hytra.core.incrementaltracking import IncrementalTracking
+
+class DummyProbabilityGenerator(object):
+    ''' two objects per frame moving along the x axis at different speeds '''
+    def __init__(self, numFrames=4):
+        self.TraxelsPerFrame = {}
+        for t in range(numFrames):
+            for obj, (speed, y) in enumerate([(1.0, 0.0), (3.0, 50.0)], start=1):
+                traxel = Traxel()
+                traxel.Timestep = t
+                traxel.Id = obj
+                traxel.Features['com'] = np.array([10.0 + speed * t, y])
+                traxel.Features['detProb'] = [0.2, 0.8]
+                traxel.Features['divProb'] = [0.9, 0.1]
+                traxel.Features['count'] = [10]
+                self.TraxelsPerFrame.setdefault(t, {})[obj] = traxel
+
+def buildGraph(transitionParameter):
+    hypothesesGraph = IlastikHypothesesGraph(DummyProbabilityGenerator(),
+                                             timeRange=(0, 4),
+                                             maxNumObjects=1,
+                                             numNearestNeighbors=2,
+                                             fieldOfView=FieldOfView(0, 0, 0, 0, 4, 100, 100, 0),
+                                             withDivisions=False,
+                                             transitionParameter=transitionParameter)
+    hypothesesGraph.insertEnergies()
+    return hypothesesGraph
+
+class CountingSolver(object):
+    ''' dummy solver that activates nothing and counts how often it was called '''
+    def __init__(self):
+        self.numCalls = 0
+
+    def __call__(self, model, weights):
+        self.numCalls += 1
+        return {'detectionResults': [{'id': d['id'], 'value': 0} for d in model['segmentationHypotheses']],
+                'linkingResults': [{'src': l['src'], 'dest': l['dest'], 'value': 0} for l in model['linkingHypotheses']],
+                'divisionResults': []}
+
+def test_energiesOfNewTransitionParameter():
+    incrementalTracking = IncrementalTracking(buildGraph(5.0), [10.0, 10.0, 10.0, 500.0, 500.0], solver=CountingSolver())
+    incrementalTracking.resolve(transitionParameter=12.0)
+
+    expected = buildGraph(12.0).toTrackingGraph().model
+    linkFeatures = dict(((l['src'], l['dest']), l['features']) for l in expected['linkingHypotheses'])
+    assert(len(linkFeatures) == len(incrementalTracking.model['linkingHypotheses']))
+    for link in incrementalTracking.model['linkingHypotheses']:
+        assert(np.allclose(link['features'], linkFeatures[(link['src'], link['dest'])]))
+    detectionFeatures = dict((d['id'], d['features']) for d in expected['segmentationHypotheses'])
+    for detection in incrementalTracking.model['segmentationHypotheses']:
+        assert(np.allclose(detection['features'], detectionFeatures[detection['id']]))
+
+def test_resultCache():
+    solver = CountingSolver()
+    incrementalTracking = IncrementalTracking(buildGraph(5.0), [10.0, 10.0, 10.0, 500.0, 500.0], solver=solver)
+    incrementalTracking.resolve()
+    assert(solver.numCalls == 1)
+
+    # scaling all weights by the same factor gives the same solution
+    incrementalTracking.resolve(transitionWeight=20.0, detectionWeight=20.0, divisionWeight=20.0,
+                                appearanceCost=1000.0, disappearanceCost=1000.0)
+    assert(solver.numCalls == 1)
+
+    incrementalTracking.resolve(transitionWeight=5.0)
+    assert(solver.numCalls == 2)
+    incrementalTracking.resolve(transitionParameter=12.0)
+    assert(solver.numCalls == 3)
+    incrementalTracking.resolve(transitionParameter=5.0, transitionWeight=20.0)
+    assert(solver.numCalls == 3)
@@ -0,0 +1,75 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import os
+import shutil
+import tempfile
+import numpy as np
+import h5py
+from hytra.core.labelimageexport import getLinksPerTimestep, exportLabelImage
+
+labelImagePath = '/TrackingFeatureExtraction/LabelImage/0000/[[%d, 0, 0, 0, 0], [%d, %d, %d, %d, 1]]'
+
+def getFixture():
+    '''
+    Four frames: the objects 1 and 2 of frame 0 form a tracklet and a track with the objects of frame 1,
+    object 3 of frame 0 is not tracked, object 1 of frame 1 divides into the two objects of frame 2, and frame 3 is empty.
+
+    **returns** the label images, model and result
+    '''
+    labelImages = [np.zeros((8, 6), dtype=np.uint32) for _ in range(4)]
+    labelImages[0][0:2, 0:2] = 1
+    labelImages[0][4:6, 0:2] = 2
+    labelImages[0][6:8, 4:6] = 3
+    labelImages[1][1:3, 1:3] = 1
+    labelImages[1][5:7, 1:3] = 2
+    labelImages[2][0:2, 3:5] = 1
+    labelImages[2][3:5, 3:5] = 2
+
+    model = {'traxelToUniqueId': {'0': {'1': 10, '2': 11, '3': 12},
+                                  '1': {'1': 10, '2': 13},
+                                  '2': {'1': 14, '2': 15},
+                                  '3': {}}}
+    result = {'linkingResults': [{'src': 10, 'dest': 14, 'value': 1},
+                                 {'src': 10, 'dest': 15, 'value': 1},
+                                 {'src': 11, 'dest': 13, 'value': 1},
+                                 {'src': 12, 'dest': 13, 'value': 0}]}
+    return labelImages, model, result
+
+def test_linksPerTimestep():
+    _, model, result = getFixture()
+    linksPerTimestep = getLinksPerTimestep(model, result)
+    assert(sorted(linksPerTimestep.keys()) == [0, 1, 2, 3])
+    assert(linksPerTimestep[0] == [])
+    # the link within the tracklet is included, the inactive one is not
+    assert(sorted(linksPerTimestep[1]) == [(1, 1), (2, 2)])
+    assert(sorted(linksPerTimestep[2]) == [(1, 1), (1, 2)])
+    assert(linksPerTimestep[3] == [])
+
+def test_exportLabelImage():
+    tempDir = tempfile.mkdtemp()
+    try:
+        labelImages, model, result = getFixture()
+        labelImageFilename = os.path.join(tempDir, 'segmentation.h5')
+        with h5py.File(labelImageFilename, 'w') as h5file:
+            for t, labelImage in enumerate(labelImages):
+                shape = labelImage.shape
+                h5file.create_dataset(labelImagePath % (t, t + 1, shape[0], shape[1], 1),
+                                      data=labelImage[np.newaxis, :, :, np.newaxis, np.newaxis])
+        outFilename = os.path.join(tempDir, 'tracks.h5')
+        exportLabelImage(model, result, labelImageFilename, labelImagePath, outFilename)
+
+        # every track keeps its label, both children of the division get the label of their parent,
+        # and the untracked object is removed. Labels are numbered in the order of the links, so we only
+        # require the two tracks to have distinct labels
+        tracks = [{1: 'a', 2: 'b'}, {1: 'a', 2: 'b'}, {1: 'a', 2: 'a'}, {}]
+        with h5py.File(outFilename, 'r') as h5file:
+            exported = h5file['exported_data'][...]
+        assert(exported.shape == (4, 8, 6, 1))
+        colors = {'a': exported[0, 0, 0, 0], 'b': exported[0, 4, 0, 0]}
+        assert(sorted(colors.values()) == [1, 2])
+        for t, (labelImage, trackPerLabel) in enumerate(zip(labelImages, tracks)):
+            expected = np.zeros_like(labelImage)
+            for label, track in trackPerLabel.items():
+                expected[labelImage == label] = colors[track]
+            assert(np.array_equal(exported[t, ..., 0], expected))
+    finally:
+        shutil.rmtree(tempDir)
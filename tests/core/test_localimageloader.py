@@ -0,0 +1,188 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import os
+import shutil
+import tempfile
+import numpy as np
+import h5py
+from hytra.pluginsystem.plugin_manager import TrackingPluginManager
+from hytra.pluginsystem.image_provider_plugin import FrameByFrameLabelImageExport
+
+labelImagePath = '/TrackingFeatureExtraction/LabelImage/0000/[[%d, 0, 0, 0, 0], [%d, %d, %d, %d, 1]]'
+labelImageV2Path = '/TrackingFeatureExtraction/LabelImage_v2/'
+
+def getImageProvider():
+    ''' a fresh `LocalImageLoader`, which does not remember the shape of a previous label image '''
+    pluginManager = TrackingPluginManager(pluginPaths=['hytra/plugins'], verbose=False)
+    pluginManager.setImageProvider('LocalImageLoader')
+    return pluginManager.getImageProvider()
+
+def getH5FilePool(imageProvider):
+    ''' the pool of open files of the module of the `imageProvider`, as loaded by yapsy '''
+    return imageProvider.releaseResource.__func__.__globals__['h5FilePool']
+
+def getFrames(shape, numFrames=3):
+    ''' random label images, one of them using the full 16 bit range '''
+    rng = np.random.RandomState(0)
+    frames = [rng.randint(0, 1000, size=shape).astype(np.uint32) for _ in range(numFrames)]
+    frames[-1][0, 0] = np.iinfo(np.uint16).max
+    return frames
+
+def test_streamingLabelImageExport():
+    tempDir = tempfile.mkdtemp()
+    try:
+        # x spans two tiles of at most 256 pixels and z two tiles of at most 32, so there are tiles at the border
+        for shape in [(300, 20), (270, 10, 40)]:
+            frames = getFrames(shape)
+            for path in [labelImagePath, labelImageV2Path]:
+                filename = os.path.join(tempDir, 'stream.h5')
+                with h5py.File(filename, 'w'):
+                    pass
+                with getImageProvider().openLabelImageExport(filename, path, (0, len(frames))) as export:
+                    for t in [2, 0, 1]:
+                        export.write(frames[t], t)
+
+                imageProvider = getImageProvider()
+                assert(imageProvider.getTimeRange(filename, path) == (0, len(frames)))
+                assert(tuple(imageProvider.getImageShape(filename, path)) == (shape + (1,))[:3])
+                for t, frame in enumerate(frames):
+                    assert(np.array_equal(imageProvider.getLabelImageForFrame(filename, path, t), frame))
+                imageProvider.releaseResource(filename)
+    finally:
+        shutil.rmtree(tempDir)
+
+def test_frameByFrameLabelImageExport():
+    tempDir = tempfile.mkdtemp()
+    try:
+        for shape in [(30, 20), (27, 10, 4)]:
+            frames = getFrames(shape)
+            for path in [labelImagePath, labelImageV2Path]:
+                filename = os.path.join(tempDir, 'frames.h5')
+                with h5py.File(filename, 'w'):
+                    pass
+                imageProvider = getImageProvider()
+                imageProvider.shape = (shape + (1,))[:3]
+                with FrameByFrameLabelImageExport(imageProvider, filename, path) as export:
+                    for t in [2, 0, 1]:
+                        export.write(frames[t], t)
+
+                imageProvider = getImageProvider()
+                assert(imageProvider.getTimeRange(filename, path) == (0, len(frames)))
+                for t, frame in enumerate(frames):
+                    assert(np.array_equal(imageProvider.getLabelImageForFrame(filename, path, t), frame))
+                imageProvider.releaseResource(filename)
+    finally:
+        shutil.rmtree(tempDir)
+
+def writeLabelImages(filename, frames):
+    ''' write the `frames` with one dataset per frame at `labelImagePath` '''
+    with h5py.File(filename, 'w') as h5file:
+        for t, frame in enumerate(frames):
+            shape = frame.shape
+            h5file.create_dataset(labelImagePath % (t, t + 1, shape[0], shape[1], 1), data=frame[np.newaxis, :, :, np.newaxis, np.newaxis])
+
+def test_h5FilePool():
+    tempDir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tempDir, 'labels.h5')
+        frames = getFrames((12, 8))
+        writeLabelImages(filename, frames[:2])
+        imageProvider = getImageProvider()
+        h5FilePool = getH5FilePool(imageProvider)
+
+        # handles are reused by all reads
+        assert(np.array_equal(imageProvider.getLabelImageForFrame(filename, labelImagePath, 0), frames[0]))
+        handle = h5FilePool.get(filename)
+        assert(np.array_equal(imageProvider.getLabelImageForFrame(filename, labelImagePath, 1), frames[1]))
+        assert(h5FilePool.get(filename) is handle)
+
+        # the export releases the handle before writing, and the next read sees the new frame
+        imageProvider.exportLabelImage(frames[2], 2, filename, labelImagePath)
+        assert(not handle.id.valid)
+        assert(imageProvider.getTimeRange(filename, labelImagePath) == (0, 3))
+        assert(np.array_equal(imageProvider.getLabelImageForFrame(filename, labelImagePath, 2), frames[2]))
+
+        # a file that was replaced on disk is reopened
+        handle = h5FilePool.get(filename)
+        writeLabelImages(filename + '.new', frames[::-1])
+        os.rename(filename + '.new', filename)
+        assert(np.array_equal(imageProvider.getLabelImageForFrame(filename, labelImagePath, 0), frames[2]))
+        assert(h5FilePool.get(filename) is not handle)
+
+        # a forked child opens its own handle, and the one of the parent stays usable
+        handle = h5FilePool.get(filename)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                ok = np.array_equal(imageProvider.getLabelImageForFrame(filename, labelImagePath, 1), frames[1]) \
+                     and h5FilePool.get(filename) is not handle
+            except Exception:
+                ok = False
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        assert(status == 0)
+        assert(h5FilePool.get(filename) is handle)
+        assert(np.array_equal(imageProvider.getLabelImageForFrame(filename, labelImagePath, 2), frames[0]))
+        imageProvider.releaseResource(filename)
+    finally:
+        shutil.rmtree(tempDir)
+
+def getBlockIndexShape(group):
+    ''' the spatial shape covered by all blocks of the group '''
+    ends = [[int(r.split(':')[1]) for r in block.attrs['blockSlice'][1:-1].split(',')] for block in group.values()]
+    return tuple(np.max(ends, axis=0)[1:4])
+
+def scanBlocks(filename, path, timeframe):
+    '''
+    reference: read frame `timeframe` of a `LabelImage_v2` group by looking at the `blockSlice` of every block,
+    like `LocalImageLoader` did before it had a block index
+    '''
+    labelImage = None
+    with h5py.File(filename, 'r') as h5file:
+        for block in h5file[path].values():
+            roi = [(int(r.split(':')[0]), int(r.split(':')[1])) for r in block.attrs['blockSlice'][1:-1].split(',')]
+            if roi[0][0] <= timeframe < roi[0][1]:
+                if labelImage is None:
+                    labelImage = np.zeros(getBlockIndexShape(h5file[path]), dtype=np.uint32)
+                t = timeframe - roi[0][0]
+                labelImage[tuple(slice(b, e) for b, e in roi[1:4])] = block[t, ..., 0]
+    assert labelImage is not None
+    return labelImage
+
+def writeBlocks(filename, blocks):
+    ''' write `LabelImage_v2` blocks given as (time range, spatial offset, data of shape t, x, y, z) '''
+    with h5py.File(filename, 'w') as h5file:
+        for i, (timeRange, offset, data) in enumerate(blocks):
+            dataset = h5file.create_dataset(labelImageV2Path + 'block{:04d}'.format(i), data=data[..., np.newaxis])
+            roi = [timeRange] + [(o, o + s) for o, s in zip(offset, data.shape[1:4])] + [(0, 1)]
+            dataset.attrs['blockSlice'] = '[' + ','.join('{}:{}'.format(b, e) for b, e in roi) + ']'
+
+def test_labelImageBlockIndex():
+    tempDir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tempDir, 'blocks.h5')
+        rng = np.random.RandomState(2)
+        def randomBlock(numFrames, shape):
+            return rng.randint(0, 100, size=(numFrames,) + shape).astype(np.uint16)
+        # frames 0-2 and 3-4 are stored in blocks of several frames each covering the whole image,
+        # frame 5 is split into four blocks in x and y, which are stored in an arbitrary order
+        blocks = [((3, 5), (0, 0, 0), randomBlock(2, (20, 16, 3))),
+                  ((0, 3), (0, 0, 0), randomBlock(3, (20, 16, 3))),
+                  ((5, 6), (10, 8, 0), randomBlock(1, (10, 8, 3))),
+                  ((5, 6), (0, 0, 0), randomBlock(1, (10, 8, 3))),
+                  ((5, 6), (10, 0, 0), randomBlock(1, (10, 8, 3))),
+                  ((5, 6), (0, 8, 0), randomBlock(1, (10, 8, 3)))]
+        writeBlocks(filename, blocks)
+
+        imageProvider = getImageProvider()
+        assert(imageProvider.getTimeRange(filename, labelImageV2Path) == (0, 6))
+        assert(tuple(imageProvider.getImageShape(filename, labelImageV2Path)) == (20, 16, 3))
+        for t in range(6):
+            expected = scanBlocks(filename, labelImageV2Path, t)
+            assert(np.array_equal(imageProvider.getLabelImageForFrame(filename, labelImageV2Path, t), expected))
+            # regions inside one block, spanning several blocks, and at the border of the image
+            for offset, shape in [((1, 2, 0), (5, 4, 3)), ((7, 5, 1), (8, 6, 2)), ((15, 12, 2), (5, 4, 1))]:
+                region = imageProvider.getLabelImageRegion(filename, labelImageV2Path, t, offset, shape)
+                assert(np.array_equal(region, expected[tuple(slice(o, o + s) for o, s in zip(offset, shape))]))
+        imageProvider.releaseResource(filename)
+    finally:
+        shutil.rmtree(tempDir)
@@ -0,0 +1,330 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import os
+import shutil
+import tempfile
+import numpy as np
+import h5py
+import hytra.core.hypothesesgraph as hg
+import hytra.core.probabilitygenerator as pg
+from hytra.core.mergerresolver import MergerResolver, getObjectSlicings, cropToObject, getObjectCoordinates
+from hytra.core.ilastikmergerresolver import IlastikMergerResolver
+from hytra.core.jsonmergerresolver import JsonMergerResolver
+from hytra.core.jsongraph import JsonTrackingGraph
+from hytra.core.random_forest_classifier import RandomForestClassifier
+
+def drawDiscs(labelImage, centers, label, radius=3):
+    ''' draw discs around the given `centers` into the `labelImage` '''
+    grid = np.indices(labelImage.shape)
+    for center in centers:
+        disc = sum((g - c)**2 for g, c in zip(grid, center)) <= radius**2
+        labelImage[disc] = label
+
+class InMemoryMergerResolver(MergerResolver):
+    ''' merger resolver working on label images in memory, with a graph set up by the test '''
+    def __init__(self, labelImages, useMultiprocessing):
+        super(InMemoryMergerResolver, self).__init__(pluginPaths=['hytra/plugins'], useMultiprocessing=useMultiprocessing)
+        self.setMergerResolverPlugin('EMMergerResolver')
+        self.labelImages = labelImages
+
+    def _readLabelImage(self, timeframe):
+        return self.labelImages[timeframe].copy()
+
+def getTwoMergerFixture():
+    '''
+    Two 2-mergers that move by one pixel from frame 0 to frame 1, and a single object in frame 1.
+
+    **returns** the label images, detections, mergers and links (per target timestep, as used by the merger resolver)
+    '''
+    labelImages = []
+    for t in range(2):
+        labelImage = np.zeros((60, 50), dtype=np.uint32)
+        drawDiscs(labelImage, [(10 + t, 10), (10 + t, 30)], 1)
+        drawDiscs(labelImage, [(40 + t, 10), (40 + t, 30)], 2)
+        if t == 1:
+            drawDiscs(labelImage, [(25, 45)], 3)
+        labelImages.append(labelImage)
+    detectionsPerTimestep = {'0': [1, 2], '1': [1, 2, 3]}
+    mergersPerTimestep = {'0': {1: 2, 2: 2}, '1': {1: 2, 2: 2}}
+    mergerLinks = [('1', (1, 1)), ('1', (2, 2))]
+    return labelImages, detectionsPerTimestep, mergersPerTimestep, mergerLinks
+
+def resolveFixture(useMultiprocessing):
+    labelImages, detectionsPerTimestep, mergersPerTimestep, mergerLinks = getTwoMergerFixture()
+    resolver = InMemoryMergerResolver(labelImages, useMultiprocessing)
+    resolver._createUnresolvedGraph({'0': {}, '1': {}}, mergersPerTimestep, mergerLinks)
+    resolver._prepareResolvedGraph()
+    resolver._fitAndRefineNodes(detectionsPerTimestep, mergersPerTimestep, ['0', '1'])
+    return resolver
+
+def test_parallelFitsMatchSingleProcess():
+    serial = resolveFixture(False)
+    parallel = resolveFixture(True)
+    assert(parallel._executor is None)
+
+    # every merger was split into two objects, with the links duplicated to all of them
+    assert(sorted(serial.resolvedGraph.nodes()) == [(0, 3), (0, 4), (0, 5), (0, 6), (1, 4), (1, 5), (1, 6), (1, 7)])
+    assert(sorted(parallel.resolvedGraph.nodes()) == sorted(serial.resolvedGraph.nodes()))
+    assert(sorted(parallel.resolvedGraph.edges()) == sorted(serial.resolvedGraph.edges()))
+
+    for node in serial.unresolvedGraph.nodes():
+        serialFits = serial.unresolvedGraph.node[node]['fits']
+        parallelFits = parallel.unresolvedGraph.node[node]['fits']
+        assert(len(serialFits) == len(parallelFits) == 2)
+        for serialFit, parallelFit in zip(serialFits, parallelFits):
+            for a, b in zip(serialFit, parallelFit):
+                assert(np.allclose(a, b, atol=1e-3))
+
+def test_closeShutsDownWorkers():
+    resolver = InMemoryMergerResolver([], useMultiprocessing=True)
+    executor = resolver._getExecutor()
+    assert(resolver._getExecutor() is executor)
+    assert(executor.submit(abs, -1).result() == 1)
+
+    resolver.close()
+    assert(resolver._executor is None)
+    try:
+        executor.submit(abs, -1)
+        assert(False)
+    except RuntimeError:
+        pass
+    # closing again does nothing
+    resolver.close()
+
+def getBorderFixture():
+    ''' a frame with 2-mergers at the top left and bottom right border of the image, and a single object '''
+    labelImage = np.zeros((60, 50), dtype=np.uint32)
+    drawDiscs(labelImage, [(1, 2), (2, 14)], 1)
+    drawDiscs(labelImage, [(57, 38), (58, 48)], 2)
+    drawDiscs(labelImage, [(30, 25)], 3)
+    return labelImage
+
+def test_croppedResolvingMatchesFullFrame():
+    labelImage = getBorderFixture()
+    objectSlicings = getObjectSlicings(labelImage)
+    assert(sorted(objectSlicings.keys()) == [1, 2, 3])
+    resolver = InMemoryMergerResolver([labelImage], useMultiprocessing=False)
+    plugin = resolver.mergerResolverPlugin
+
+    for idx in [1, 2, 3]:
+        fullCoordinates = np.transpose(np.vstack(np.where(labelImage == idx)))
+        assert(np.array_equal(getObjectCoordinates(labelImage, objectSlicings, idx), fullCoordinates))
+
+        objectImage, offset = cropToObject(labelImage, objectSlicings, idx)
+        assert(np.array_equal(offset, [s.start for s in objectSlicings[idx]]))
+        croppedFits = plugin.resolveMerger(objectImage, idx, 10, 2, offset=offset)
+        fullFits = plugin.resolveMerger(labelImage, idx, 10, 2)
+        for croppedFit, fullFit in zip(croppedFits, fullFits):
+            for a, b in zip(croppedFit, fullFit):
+                assert(np.allclose(a, b))
+
+    # objects that are not in the image are looked for in the full frame
+    objectImage, offset = cropToObject(labelImage, objectSlicings, 4)
+    assert(objectImage is labelImage and offset is None)
+
+def test_relabelMergersMatchesFullFrame():
+    labelImage = getBorderFixture()
+    resolver = InMemoryMergerResolver([labelImage], useMultiprocessing=False)
+    resolver.detectionsPerTimestep = {'0': [1, 2, 3]}
+    resolver.mergersPerTimestep = {'0': {1: 2, 2: 2}}
+    resolver._createUnresolvedGraph({'0': {}}, resolver.mergersPerTimestep, [])
+    resolver._prepareResolvedGraph()
+    for idx, newIds in [(1, [4, 5]), (2, [6, 7])]:
+        resolver.unresolvedGraph.add_node((0, idx), newIds=newIds,
+                                          fits=resolver.mergerResolverPlugin.resolveMerger(labelImage, idx, newIds[0], 2))
+
+    # the full frame path updates the whole image for every merger
+    expected = labelImage.copy()
+    for idx in [1, 2]:
+        node = resolver.unresolvedGraph.node[(0, idx)]
+        resolver.mergerResolverPlugin.updateLabelImage(expected, idx, node['fits'], node['newIds'])
+    assert(set(np.unique(expected)) == set([0, 3, 4, 5, 6, 7]))
+
+    relabeled = resolver.relabelMergers(labelImage.copy(), 0)
+    assert(np.array_equal(relabeled, expected))
+
+def getIlastikMergerResolver(traxelFeatures):
+    ''' a resolver for a graph with the objects 1 to 3 in frame 0, and the given features of their traxels '''
+    h = hg.HypothesesGraph()
+    for i, idx in enumerate([1, 2, 3]):
+        traxel = pg.Traxel()
+        traxel.Id = idx
+        traxel.Timestep = 0
+        traxel.Features = traxelFeatures.get(idx, {})
+        h._graph.add_node((0, idx), id=i, traxel=traxel)
+    h.insertSolution({'detectionResults': [{'id': i, 'value': 1} for i in range(3)], 'linkingResults': []})
+    return IlastikMergerResolver(h, pluginPaths=['hytra/plugins'])
+
+def test_ilastikCropToObject():
+    labelImage = getBorderFixture()
+    objectSlicings = getObjectSlicings(labelImage)
+    # object 1 has bounding box features, the others are cropped by their bounding boxes in the label image
+    minimum = [s.start for s in objectSlicings[1]]
+    maximum = [s.stop - 1 for s in objectSlicings[1]]
+    resolver = getIlastikMergerResolver({1: {'Coord<Minimum >': np.array(minimum + [0]),
+                                             'Coord<Maximum >': np.array(maximum + [0])}})
+
+    for idx in [1, 2, 3]:
+        objectImage, offset = resolver._cropToObject(labelImage, 0, idx)
+        expectedImage, expectedOffset = cropToObject(labelImage, objectSlicings, idx)
+        assert(np.array_equal(objectImage, expectedImage))
+        assert(np.array_equal(offset, expectedOffset))
+        coordinates = np.transpose(np.vstack(np.where(objectImage == idx))) + offset
+        assert(np.array_equal(coordinates, np.transpose(np.vstack(np.where(labelImage == idx)))))
+
+# object feature plugin that only needs numpy, such that the features of all objects of a frame are easy to verify
+testFeaturePlugin = '''
+import numpy as np
+from hytra.pluginsystem import object_feature_computation_plugin
+
+class TestObjectFeatures(object_feature_computation_plugin.ObjectFeatureComputationPlugin):
+    omittedFeatures = ['Ignored']
+
+    def computeFeatures(self, rawImage, labelImage, frameNumber, rawFilename):
+        labels = labelImage.ravel().astype(np.int64)
+        counts = np.bincount(labels)
+        denominator = np.maximum(counts, 1).astype(np.float64)
+        coordinates = np.indices(labelImage.shape).reshape(labelImage.ndim, -1)
+        return {'Count': counts.astype(np.float64),
+                'Mean': np.bincount(labels, weights=rawImage.ravel()) / denominator,
+                'RegionCenter': np.column_stack([np.bincount(labels, weights=c) / denominator for c in coordinates]),
+                'Polygon': [list(np.flatnonzero(labels == i)[:3]) for i in range(len(counts))],
+                'Ignored': np.zeros(len(counts))}
+'''
+
+def writeTestFeaturePlugin(directory):
+    with open(os.path.join(directory, 'test_object_features.py'), 'w') as f:
+        f.write(testFeaturePlugin)
+    with open(os.path.join(directory, 'test_object_features.yapsy-plugin'), 'w') as f:
+        f.write('[Core]\nName = Test Object Features\nModule = test_object_features\n')
+
+def test_frameFeaturesMatchPerObjectFeatures():
+    tempDir = tempfile.mkdtemp()
+    try:
+        writeTestFeaturePlugin(tempDir)
+        labelImages, detectionsPerTimestep, mergersPerTimestep, mergerLinks = getTwoMergerFixture()
+        filename = os.path.join(tempDir, 'data.h5')
+        labelImagePath = '/LabelImage/[[%d, 0, 0, 0, 0], [%d, %d, %d, %d, 1]]'
+        rng = np.random.RandomState(3)
+        with h5py.File(filename, 'w') as h5file:
+            h5file.create_dataset('raw', data=rng.rand(2, 60, 50).astype(np.float32))
+            for t, labelImage in enumerate(labelImages):
+                h5file.create_dataset(labelImagePath % (t, t + 1, 60, 50, 1), data=labelImage[np.newaxis, :, :, np.newaxis, np.newaxis])
+
+        trackingGraph = JsonTrackingGraph(model={'segmentationHypotheses': [], 'linkingHypotheses': [], 'traxelToUniqueId': {}},
+                                          result={'detectionResults': [], 'linkingResults': [], 'divisionResults': None})
+        resolver = JsonMergerResolver(trackingGraph, filename, labelImagePath, os.path.join(tempDir, 'out.h5'),
+                                      filename, 'raw', 'txy', pluginPaths=['hytra/plugins', tempDir])
+        resolver.setMergerResolverPlugin('EMMergerResolver')
+        resolver.detectionsPerTimestep = detectionsPerTimestep
+        resolver.mergersPerTimestep = mergersPerTimestep
+        resolver._createUnresolvedGraph({'0': {}, '1': {}}, mergersPerTimestep, mergerLinks)
+        resolver._prepareResolvedGraph()
+        resolver._fitAndRefineNodes(detectionsPerTimestep, mergersPerTimestep, ['0', '1'])
+        objectFeatures = resolver._computeObjectFeatures(['0', '1'])
+        assert(sorted(objectFeatures.keys()) == sorted(resolver.resolvedGraph.nodes()))
+
+        # reference: compute the features of every refined object on its own mask, as before
+        for (t, idx), features in objectFeatures.items():
+            mask = resolver.relabelMergers(labelImages[t].copy(), t)
+            mask = (mask == idx).astype(np.uint32)
+            rawImage = resolver.imageProvider.getImageDataAtTimeFrame(filename, 'raw', 'txy', t)
+            frameFeatureDicts, ignoreNames = resolver.pluginManager.applyObjectFeatureComputationPlugins(
+                2, rawImage, mask, t, filename)
+            expected = {}
+            for f in frameFeatureDicts:
+                expected.update(f)
+            assert('Ignored' in ignoreNames and 'Ignored' not in features)
+            assert(sorted(features.keys()) == sorted(k for k in expected.keys() if k not in ignoreNames))
+            assert(features['Count'] > 0)
+            for k in features:
+                if k == 'Polygon':
+                    assert(len(features[k]) == len(expected[k][1]))
+                else:
+                    assert(np.allclose(features[k], expected[k][1, ...]))
+        resolver.imageProvider.releaseResource(filename)
+    finally:
+        shutil.rmtree(tempDir)
+
+class StubForest(object):
+    ''' stands in for a trained vigra random forest, predicting a periodic function of a random linear combination of the features '''
+    def __init__(self, numFeatures, seed):
+        self.weights = np.random.RandomState(seed).randn(numFeatures)
+        self.numPredictedRows = []
+
+    def featureCount(self):
+        return len(self.weights)
+
+    def labelCount(self):
+        return 2
+
+    def predictProbabilities(self, features):
+        self.numPredictedRows.append(features.shape[0])
+        # bounded without saturating, whatever the magnitude of the features
+        prob = 0.5 + 0.5 * np.sin(np.dot(features, self.weights))
+        return np.column_stack([1.0 - prob, prob]).astype(np.float32)
+
+def getTransitionFixture(numObjects=40):
+    '''
+    Objects with random features in two frames, and links from every object in frame 0 to up to three objects in frame 1.
+
+    **returns** the links and the features per object
+    '''
+    rng = np.random.RandomState(3)
+    objectFeatures = {}
+    for t in range(2):
+        for o in range(1, numObjects + 1):
+            objectFeatures[(t, o)] = {'RegionCenter': rng.uniform(0, 100, size=2),
+                                      'Count': np.array([rng.randint(10, 200)], dtype=np.float64)}
+    edges = [((0, o), (1, (o + d) % numObjects + 1)) for o in range(1, numObjects + 1) for d in range(o % 3 + 1)]
+    return edges, objectFeatures
+
+def getStubTransitionClassifier(resolver, objectFeatures):
+    ''' a transition classifier on the `Count` and `RegionCenter` features, predicting with two stub forests '''
+    transitionClassifier = RandomForestClassifier(selectedFeatures=['Count', 'RegionCenter'])
+    numFeatures = len(resolver.pluginManager.applyTransitionFeatureVectorConstructionPlugins(
+        objectFeatures[(0, 1)], objectFeatures[(1, 1)], transitionClassifier.selectedFeatures))
+    transitionClassifier._randomForests = [StubForest(numFeatures, 0), StubForest(numFeatures, 1)]
+    return transitionClassifier
+
+def test_threadedPredictionsMatchSingleThread():
+    resolver = InMemoryMergerResolver([], False)
+    edges, objectFeatures = getTransitionFixture()
+    transitionClassifier = getStubTransitionClassifier(resolver, objectFeatures)
+    features = np.array([resolver.pluginManager.applyTransitionFeatureVectorConstructionPlugins(
+        objectFeatures[src], objectFeatures[dest], transitionClassifier.selectedFeatures) for src, dest in edges])
+
+    expected = transitionClassifier.predictProbabilities(features)
+    for numThreads in [2, 3, 8, None]:
+        for rf in transitionClassifier._randomForests:
+            rf.numPredictedRows = []
+        probabilities = transitionClassifier.predictProbabilities(features, numThreads=numThreads)
+        assert(np.allclose(probabilities, expected))
+        # every forest has seen every row exactly once
+        for rf in transitionClassifier._randomForests:
+            assert(sum(rf.numPredictedRows) == len(edges))
+
+def test_batchedTransitionProbabilitiesMatchPerLink():
+    resolver = InMemoryMergerResolver([], False)
+    edges, objectFeatures = getTransitionFixture()
+    transitionClassifier = getStubTransitionClassifier(resolver, objectFeatures)
+
+    # reference: one feature vector construction and prediction per link, as before batching
+    expected = []
+    for src, dest in edges:
+        featVec = resolver.pluginManager.applyTransitionFeatureVectorConstructionPlugins(
+            objectFeatures[src], objectFeatures[dest], transitionClassifier.selectedFeatures)
+        expected.append(transitionClassifier.predictProbabilities(np.expand_dims(np.array(featVec), 0))[0])
+    probabilities = resolver._getTransitionProbabilities(edges, objectFeatures, transitionClassifier)
+    assert(probabilities.shape == (len(edges), 2))
+    assert(np.allclose(probabilities, expected))
+
+    # distance based probabilities
+    expected = []
+    for src, dest in edges:
+        dist = np.linalg.norm(objectFeatures[dest]['RegionCenter'] - objectFeatures[src]['RegionCenter'])
+        prob = np.exp(-dist / 7.0)
+        expected.append([1.0 - prob, prob])
+    probabilities = resolver._getTransitionProbabilities(edges, objectFeatures, transitionParameter=7.0)
+    assert(np.allclose(probabilities, expected))
+
+    assert(resolver._getTransitionProbabilities([], objectFeatures, transitionClassifier).shape == (0, 2))
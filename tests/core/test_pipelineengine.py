@@ -0,0 +1,133 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import os
+import shutil
+import tempfile
+import threading
+import time
+from hytra.core.pipelineengine import Pipeline
+
+def test_dependenciesAndCaching():
+    tempDir = tempfile.mkdtemp()
+    try:
+        inputFilename = os.path.join(tempDir, 'input.txt')
+        with open(inputFilename, 'w') as f:
+            f.write('3')
+        calls = []
+
+        def buildPipeline(factor):
+            def readInput():
+                calls.append('input')
+                with open(inputFilename, 'r') as f:
+                    return int(f.read())
+            def scale(input):
+                calls.append('scaled')
+                return input * factor
+            def add(input, scaled):
+                calls.append('sum')
+                return input + scaled
+
+            pipeline = Pipeline(cacheDirectory=os.path.join(tempDir, 'cache'))
+            pipeline.addStage('input', readInput, inputFiles=[inputFilename])
+            pipeline.addStage('scaled', scale, dependencies=['input'], config={'factor': factor})
+            pipeline.addStage('sum', add, dependencies=['input', 'scaled'])
+            return pipeline
+
+        assert(buildPipeline(2).run(['sum'])['sum'] == 9)
+        assert(calls == ['input', 'scaled', 'sum'])
+
+        # nothing changed, everything is loaded from the cache
+        del calls[:]
+        assert(buildPipeline(2).run(['sum'])['sum'] == 9)
+        assert(calls == [])
+
+        # only stages depending on the changed configuration are re-run
+        assert(buildPipeline(3).run(['sum'])['sum'] == 12)
+        assert(calls == ['scaled', 'sum'])
+
+        # changing the input file re-runs everything
+        del calls[:]
+        with open(inputFilename, 'w') as f:
+            f.write('4')
+        assert(buildPipeline(3).run(['sum'])['sum'] == 16)
+        assert(calls == ['input', 'scaled', 'sum'])
+    finally:
+        shutil.rmtree(tempDir)
+
+def test_cyclicDependencies():
+    pipeline = Pipeline()
+    pipeline.addStage('a', lambda b: b, dependencies=['b'])
+    pipeline.addStage('b', lambda a: a, dependencies=['a'])
+    try:
+        pipeline.run()
+        assert(False)
+    except ValueError:
+        pass
+
+def test_uncacheableOutputs():
+    tempDir = tempfile.mkdtemp()
+    try:
+        calls = []
+
+        def buildPipeline(provenOptimal):
+            def track():
+                calls.append('result')
+                return {'value': 1, 'provenOptimal': provenOptimal}
+            def export(result):
+                calls.append('export')
+                return result['value']
+
+            pipeline = Pipeline(cacheDirectory=os.path.join(tempDir, 'cache'))
+            pipeline.addStage('result', track, config={'timeBudget': 10},
+                              isCacheable=lambda result: result.get('provenOptimal', True))
+            pipeline.addStage('export', export, dependencies=['result'])
+            return pipeline
+
+        # a best-effort result is neither cached on disk nor in memory, and neither are the stages using it
+        pipeline = buildPipeline(False)
+        assert(pipeline.run()['export'] == 1)
+        assert(pipeline.run()['export'] == 1)
+        assert(buildPipeline(False).run()['export'] == 1)
+        assert(calls == ['result', 'export'] * 3)
+
+        # with the same configuration, a proven optimal result is cached
+        del calls[:]
+        assert(buildPipeline(True).run()['export'] == 1)
+        assert(buildPipeline(True).run()['export'] == 1)
+        assert(calls == ['result', 'export'])
+    finally:
+        shutil.rmtree(tempDir)
+
+def test_exclusiveStages():
+    lock = threading.Lock()
+    running = []
+    overlaps = []
+
+    def makeStage(name, exclusive):
+        def stage(**inputs):
+            with lock:
+                # an exclusive stage must not start while any stage runs, no stage while an exclusive one runs
+                if (exclusive and len(running) > 0) or any(e for _, e in running):
+                    overlaps.append(name)
+                running.append((name, exclusive))
+            time.sleep(0.05)
+            with lock:
+                running.remove((name, exclusive))
+            return threading.current_thread().name
+        return stage
+
+    pipeline = Pipeline(numWorkers=4)
+    pipeline.addStage('input', makeStage('input', False))
+    for name, exclusive in [('a', False), ('b', True), ('c', False), ('d', True)]:
+        pipeline.addStage(name, makeStage(name, exclusive), dependencies=['input'], exclusive=exclusive)
+    outputs = pipeline.run()
+
+    # exclusive stages never overlap with any other stage, and they run in the main thread
+    assert(overlaps == [])
+    assert(outputs['b'] == threading.current_thread().name)
+    assert(outputs['d'] == threading.current_thread().name)
+
+if __name__ == "__main__":
+    test_dependenciesAndCaching()
+    test_cyclicDependencies()
+    test_uncacheableOutputs()
+    test_exclusiveStages()
@@ -0,0 +1,47 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+from hytra.core.splittracking import SplitTracking
+
+def activateEverything(model, weights):
+    ''' dummy solver that uses every detection and link of a graph consisting of disjoint chains '''
+    return {'detectionResults': [{'id': d['id'], 'value': 1} for d in model['segmentationHypotheses']],
+            'linkingResults': [{'src': l['src'], 'dest': l['dest'], 'value': 1} for l in model['linkingHypotheses']],
+            'divisionResults': []}
+
+def getChainModel(numFrames=10, numChains=2):
+    ''' model of `numChains` parallel tracks over `numFrames` frames '''
+    model = {'segmentationHypotheses': [], 'linkingHypotheses': [], 'traxelToUniqueId': {}, 'settings': {}}
+    for t in range(numFrames):
+        for c in range(numChains):
+            uuid = t * numChains + c
+            model['segmentationHypotheses'].append({'id': uuid,
+                                                    'features': [[1.0], [0.0], [2.0]],
+                                                    'appearanceFeatures': [[0.0], [5.0], [10.0]],
+                                                    'disappearanceFeatures': [[0.0], [5.0], [10.0]]})
+            model['traxelToUniqueId'].setdefault(str(t), {})[str(c + 1)] = uuid
+            if t > 0:
+                model['linkingHypotheses'].append({'src': uuid - numChains, 'dest': uuid, 'features': [[1.0], [0.0], [2.0]]})
+    return model
+
+def test_windows():
+    splitTracking = SplitTracking(getChainModel(), None, solver=activateEverything, useMultiprocessing=False)
+    assert(splitTracking.timeRange == (0, 10))
+    assert(splitTracking.getEvenSplitPoints(2) == [4])
+    assert(splitTracking.getWindows([4], overlap=2) == [(0, 7, 0, 5), (3, 10, 5, 10)])
+
+    submodel = splitTracking.getSubmodel(3, 7)
+    assert(len(submodel['segmentationHypotheses']) == 8)
+    assert(len(submodel['linkingHypotheses']) == 6)
+
+def test_splitAndStitch():
+    model = getChainModel()
+    for overlap in [0, 2]:
+        splitTracking = SplitTracking(model, None, solver=activateEverything, useMultiprocessing=False)
+        result = splitTracking.track(splitPoints=[2, 6], overlap=overlap)
+        assert(len(result['detectionResults']) == len(model['segmentationHypotheses']))
+        assert(all(d['value'] == 1 for d in result['detectionResults']))
+        assert(sorted((l['src'], l['dest']) for l in result['linkingResults']) == \
+            sorted((l['src'], l['dest']) for l in model['linkingHypotheses']))
+
+if __name__ == "__main__":
+    test_windows()
+    test_splitAndStitch()
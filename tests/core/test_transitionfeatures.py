@@ -0,0 +1,50 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import numpy as np
+from hytra.pluginsystem.plugin_manager import TrackingPluginManager
+from hytra.pluginsystem.transition_feature_vector_construction_plugin import TransitionFeatureVectorConstructionPlugin, stackObjectFeatures
+
+def getObjectFeatures(numObjects):
+    return [{'Count': np.float32(np.random.randint(1, 100)),
+             'Mean': np.random.rand(1).astype(np.float32),
+             'RegionCenter': np.random.rand(2) * 100,
+             'Covariance': np.random.rand(2, 2).astype(np.float32)} for _ in range(numObjects)]
+
+def test_featureMatrixMatchesFeatureVectors():
+    pluginManager = TrackingPluginManager(pluginPaths=['hytra/plugins'], verbose=False)
+    selectedFeatures = ['Count', 'Covariance', 'Mean', 'RegionCenter']
+    objectsA = getObjectFeatures(10)
+    objectsB = getObjectFeatures(10)
+
+    featureMatrix = pluginManager.applyTransitionFeatureMatrixConstructionPlugins(
+        stackObjectFeatures(objectsA, selectedFeatures), stackObjectFeatures(objectsB, selectedFeatures), selectedFeatures)
+    featureVectors = np.array([pluginManager.applyTransitionFeatureVectorConstructionPlugins(a, b, selectedFeatures)
+                               for a, b in zip(objectsA, objectsB)])
+    assert(featureMatrix.shape == featureVectors.shape)
+    assert(np.allclose(featureMatrix, featureVectors))
+
+    emptyMatrix = pluginManager.applyTransitionFeatureMatrixConstructionPlugins(
+        stackObjectFeatures([], selectedFeatures), stackObjectFeatures([], selectedFeatures), selectedFeatures)
+    assert(emptyMatrix.shape[0] == 0)
+
+class PerTransitionPlugin(TransitionFeatureVectorConstructionPlugin):
+    def constructFeatureVector(self, featureDictObjectA, featureDictObjectB, selectedFeatures):
+        return [float(featureDictObjectA['Count']) + float(featureDictObjectB['Count']), 1.0]
+
+def test_featureMatrixFallback():
+    objectsA = getObjectFeatures(3)
+    objectsB = getObjectFeatures(3)
+    featureMatrix = PerTransitionPlugin().constructFeatureMatrix(
+        stackObjectFeatures(objectsA, ['Count']), stackObjectFeatures(objectsB, ['Count']), ['Count'])
+    assert(featureMatrix.shape == (3, 2))
+    assert(np.array_equal(featureMatrix[:, 0], [float(a['Count']) + float(b['Count']) for a, b in zip(objectsA, objectsB)]))
+
+def test_stackMissingFeatures():
+    objects = getObjectFeatures(3)
+    del objects[1]['Mean']
+    for selectedFeatures in [['Count', 'Mean'], []]:
+        try:
+            stackObjectFeatures(objects, selectedFeatures)
+            assert(False)
+        except ValueError:
+            pass
+    assert(sorted(stackObjectFeatures(objects, ['Count', 'RegionCenter']).keys()) == ['Count', 'RegionCenter'])
@@ -0,0 +1,24 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import numpy as np
+from hytra.core.transitiontraining import getNegativePairs, getFeaturesWithoutNaNs
+
+def test_negativePairs():
+    # objects 1 and 2 in both frames, the background (0) and object 3 in the second frame have no pixels
+    featuresAtT = {'Count': np.array([0, 5, 5]),
+                   'RegionCenter': np.array([[0, 0], [10, 10], [20, 20]], dtype=np.float32)}
+    featuresAtTPlusOne = {'Count': np.array([0, 5, 5, 0]),
+                          'RegionCenter': np.array([[0, 0], [11, 11], [21, 21], [10, 10]], dtype=np.float32)}
+    positivePairs = np.array([[1, 1], [2, 2]])
+
+    negativePairs = getNegativePairs(featuresAtT, featuresAtTPlusOne, positivePairs)
+    assert(sorted(negativePairs.tolist()) == [[1, 2], [2, 1]])
+
+    negativePairs = getNegativePairs(featuresAtT, featuresAtTPlusOne, np.zeros((0, 2)), numNeighbors=1)
+    assert(sorted(negativePairs.tolist()) == [[1, 1], [2, 2]])
+
+def test_featuresWithoutNaNs():
+    features = {'Count': np.array([0, 5]),
+                'Mean': np.array([np.nan, 1.0]),
+                'Polygon': [[], [(0, 0)]],
+                'Global<Maximum >': 1.0}
+    assert(getFeaturesWithoutNaNs(features) == set(['Count']))
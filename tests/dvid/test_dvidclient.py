@@ -0,0 +1,37 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import numpy as np
+from hytra.dvid.mockserver import MockDvidServer
+from hytra.dvid.dvidclient import DvidNodeService, DvidServerService
+
+def test_keyValueAndVolumes():
+    with MockDvidServer() as server:
+        uuid = DvidServerService(server.address).create_new_repo('test', 'description')
+        nodeService = DvidNodeService(server.address, uuid)
+
+        assert(nodeService.create_keyvalue('config'))
+        assert(not nodeService.create_keyvalue('config'))
+        nodeService.put('config', 'imageInfo', '{"shape": [64, 32, 1]}')
+        assert(nodeService.get('config', 'imageInfo') == b'{"shape": [64, 32, 1]}')
+
+        labels = np.random.randint(0, 2**40, size=(64, 32, 1)).astype(np.uint64)
+        nodeService.create_labelblk('seg-0')
+        nodeService.put_labels3D('seg-0', labels, (0, 0, 0))
+        assert(np.array_equal(nodeService.get_labels3D('seg-0', (64, 32, 1), (0, 0, 0)), labels))
+        assert(np.array_equal(nodeService.get_labels3D('seg-0', (10, 5, 1), (20, 3, 0)), labels[20:30, 3:8, :]))
+
+        raw = np.random.randint(0, 255, size=(16, 16, 2)).astype(np.uint8)
+        server.addVolume(uuid, 'raw-0', 'grayscale8', raw)
+        assert(np.array_equal(nodeService.get_gray3D('raw-0', (16, 16, 2), (0, 0, 0)), raw))
+
+def test_connectionReuse():
+    with MockDvidServer() as server:
+        uuid = server.createRepo()
+        server.addVolume(uuid, 'seg-0', 'labelblk', np.ones((8, 8, 1)))
+        nodeService = DvidNodeService(server.address, uuid)
+        for _ in range(10):
+            assert(nodeService.get_labels3D('seg-0', (8, 8, 1), (0, 0, 0)).sum() == 64)
+        assert(server.numConnections == 1)
+
+if __name__ == "__main__":
+    test_keyValueAndVolumes()
+    test_connectionReuse()
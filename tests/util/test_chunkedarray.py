@@ -0,0 +1,71 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import os
+import shutil
+import tempfile
+import numpy as np
+from hytra.util.chunkedarray import ChunkedArray
+
+def test_writeAndReadRegions():
+    tempDir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempDir, 'data')
+        data = np.random.randint(0, 1000, size=(3, 25, 17)).astype(np.uint16)
+        a = ChunkedArray.create(path, data.shape, (1, 8, 8), data.dtype, attrs={'axes': 'txy'})
+        a.write((0, 0, 0), data[:, :20, :])
+        a.write((0, 20, 0), data[:, 20:, :])
+
+        b = ChunkedArray(path)
+        assert(b.shape == data.shape)
+        assert(b.dtype == data.dtype)
+        assert(b.attrs['axes'] == 'txy')
+        assert(np.array_equal(b.read(), data))
+        assert(np.array_equal(b.read((1, 5, 3), (2, 13, 9)), data[1:3, 5:18, 3:12]))
+    finally:
+        shutil.rmtree(tempDir)
+
+def test_missingChunksAreZero():
+    tempDir = tempfile.mkdtemp()
+    try:
+        a = ChunkedArray.create(os.path.join(tempDir, 'data'), (2, 10, 10), (1, 5, 5), np.uint32)
+        a.write((1, 5, 5), np.ones((1, 5, 5), dtype=np.uint32))
+        region = a.read()
+        assert(region.sum() == 25)
+        assert(np.all(region[1, 5:, 5:] == 1))
+    finally:
+        shutil.rmtree(tempDir)
+
+def test_concurrentWritersOfOneChunk():
+    tempDir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tempDir, 'data')
+        ChunkedArray.create(path, (1, 64, 64), (1, 64, 64), np.uint32)
+        # several processes overwrite the same chunk with their own value at the same time
+        pids = []
+        for value in range(1, 5):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    a = ChunkedArray(path)
+                    for _ in range(50):
+                        a.write((0, 0, 0), np.full((1, 64, 64), value, dtype=np.uint32))
+                        chunk = a.read()
+                        assert(len(np.unique(chunk)) == 1)
+                    os._exit(0)
+                except BaseException:
+                    os._exit(1)
+            pids.append(pid)
+        for pid in pids:
+            _, status = os.waitpid(pid, 0)
+            assert(status == 0)
+
+        # the chunk was written completely by one of them, and no temporary files are left behind
+        chunk = ChunkedArray(path).read()
+        assert(len(np.unique(chunk)) == 1 and chunk[0, 0, 0] in range(1, 5))
+        assert(sorted(os.listdir(path)) == ['.zarray', '0.0.0'])
+    finally:
+        shutil.rmtree(tempDir)
+
+if __name__ == "__main__":
+    test_writeAndReadRegions()
+    test_missingChunksAreZero()
+    test_concurrentWritersOfOneChunk()
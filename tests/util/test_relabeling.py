@@ -0,0 +1,23 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import numpy as np
+from hytra.util.relabeling import buildLookupTable, relabel
+
+def test_buildLookupTable():
+    lut = buildLookupTable({1: 7, 3: 9, 12: 4}, 4, default=2)
+    assert(list(lut) == [0, 7, 2, 9, 2])
+    assert(lut.dtype == np.uint32)
+
+def test_relabel():
+    labelImage = np.random.randint(0, 50, size=(30, 20, 5)).astype(np.uint32)
+    mapping = dict((l, l * 1000) for l in range(1, 50, 2))
+
+    expected = np.zeros_like(labelImage)
+    for src, dest in mapping.items():
+        expected[labelImage == src] = dest
+    relabeled = relabel(labelImage, mapping)
+    assert(relabeled.dtype == labelImage.dtype)
+    assert(np.array_equal(relabeled, expected))
+
+    expected[(labelImage > 0) & (labelImage % 2 == 0)] = 1
+    assert(np.array_equal(relabel(labelImage, mapping, default=1), expected))
+    assert(relabel(np.zeros((0, 3), dtype=np.uint16), {}).shape == (0, 3))
@@ -0,0 +1,67 @@
+from __future__ import print_function, absolute_import, nested_scopes, generators, division, with_statement, unicode_literals
+import os
+import shutil
+import tempfile
+import numpy as np
+import h5py
+from skimage.external import tifffile
+from hytra.util import tiffsequence
+
+def writeFrames(directory, frames):
+    ''' write one TIFF file per frame and **returns** the sorted filenames '''
+    for t, frame in enumerate(frames):
+        tifffile.imsave(os.path.join(directory, 'frame{:03d}.tif'.format(t)), frame)
+    return tiffsequence.getTiffSequence(os.path.join(directory, 'frame*.tif'))
+
+def test_tiffSequenceRoundTrip():
+    tempDir = tempfile.mkdtemp()
+    try:
+        # frames with axes zyx, the x axis spans two default chunks of at most 256 pixels, the second one at the border
+        frames = [np.random.randint(0, 5000, size=(5, 37, 300)).astype(np.uint16) for _ in range(3)]
+        filenames = writeFrames(tempDir, frames)
+        h5Filename = os.path.join(tempDir, 'data.h5')
+
+        for path, chunks in [('default', None), ('small', (1, 16, 16, 2, 1))]:
+            shape = tiffsequence.tiffSequenceToH5(filenames, h5Filename, path, 'zyx', chunks=chunks)
+            assert(shape == (3, 300, 37, 5, 1))
+            with h5py.File(h5Filename, 'r') as h5file:
+                dataset = h5file[path]
+                assert(dataset.chunks == (tuple(chunks) if chunks is not None else (1, 256, 37, 5, 1)))
+                assert(dataset.compression == 'gzip')
+                for t, frame in enumerate(frames):
+                    assert(np.array_equal(dataset[t, ..., 0], np.transpose(frame)))
+
+            exported = tiffsequence.h5ToTiffSequence(h5Filename, path, 'txyzc', os.path.join(tempDir, path + '*.tif'))
+            assert(len(exported) == len(frames))
+            for filename, frame in zip(exported, frames):
+                assert(np.array_equal(tifffile.imread(filename), frame))
+    finally:
+        shutil.rmtree(tempDir)
+
+def test_writeCompressedFallback():
+    tempDir = tempfile.mkdtemp()
+    try:
+        data = np.random.randint(0, 70000, size=(20, 30)).astype(np.uint32)
+        expected = np.minimum(data, np.iinfo(np.uint16).max)
+        with h5py.File(os.path.join(tempDir, 'data.h5'), 'w') as h5file:
+            aligned = h5file.create_dataset('aligned', shape=(20, 30), dtype='u2', chunks=(8, 8), compression='gzip')
+            shuffled = h5file.create_dataset('shuffled', shape=(20, 30), dtype='u2', chunks=(8, 8), compression='gzip', shuffle=True)
+            # whole chunks, or regions reaching the end of the dataset, are written directly
+            assert(tiffsequence._canWriteDirectChunks(aligned, (8, 0), (12, 30)))
+            assert(tiffsequence._canWriteDirectChunks(aligned, (0, 0), (16, 16)))
+            # regions that start or end within a chunk, or filters other than gzip, need HDF5 to compress
+            assert(not tiffsequence._canWriteDirectChunks(aligned, (3, 0), (8, 8)))
+            assert(not tiffsequence._canWriteDirectChunks(aligned, (0, 0), (12, 16)))
+            assert(not tiffsequence._canWriteDirectChunks(shuffled, (0, 0), (20, 30)))
+
+            tiffsequence.writeCompressed(aligned, (0, 0), data[:8])
+            tiffsequence.writeCompressed(aligned, (8, 0), data[8:13])
+            tiffsequence.writeCompressed(aligned, (13, 0), data[13:])
+            tiffsequence.writeCompressed(shuffled, (0, 0), data)
+
+        # directly written chunks are only guaranteed to be visible after reopening the file
+        with h5py.File(os.path.join(tempDir, 'data.h5'), 'r') as h5file:
+            assert(np.array_equal(h5file['aligned'][...], expected))
+            assert(np.array_equal(h5file['shuffled'][...], expected))
+    finally:
+        shutil.rmtree(tempDir)